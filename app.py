@@ -1,245 +1,183 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file
-import sqlite3
-from datetime import datetime, timedelta
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file, abort, Response, stream_with_context
+from datetime import datetime
+import click
 import os
 import csv
-from io import StringIO
-import base64
-
-# PostgreSQL import with fallback
-try:
-    import psycopg
-    POSTGRES_AVAILABLE = True
-    print("DEBUG: psycopg3 available")
-except ImportError:
-    POSTGRES_AVAILABLE = False
-    print("DEBUG: psycopg3 not available, using SQLite")
+import time
+
+import archive
+import db
+import metrics
+import profiler
+import exports
+import imports
+import ingest
+import jobs
+import migrations
+import pagination
+import partitions
+import payroll
+import payroll_engine
+import photos
+import queries  # registers the named statements used below
+import rollups
+import search
+import sessions
+from db import get_db, get_pool, query, month_range
+from cache import cache
+from logs import get_logger
 
 app = Flask(__name__)
 app.secret_key = 'employee_management_system_secret_key_2024'
+db.init_app(app)
+sessions.init_app(app)
+metrics.init_app(app)
+profiler.init_app(app, lambda: session.get('user_type') == 'admin')
 
-def get_db_connection():
-    # Try PostgreSQL first (for production)
-    database_url = os.environ.get('DATABASE_URL')
-    
-    print(f"DEBUG: DATABASE_URL from environment: {database_url}")
-    
-    if database_url and POSTGRES_AVAILABLE:
-        try:
-            conn = psycopg.connect(database_url)
-            print("DEBUG: Successfully connected to PostgreSQL with psycopg3!")
-            return conn
-        except Exception as e:
-            print(f"DEBUG: PostgreSQL connection failed: {str(e)}")
-            print("DEBUG: Falling back to SQLite...")
-    
-    # Fallback to SQLite (for development)
-    try:
-        conn = sqlite3.connect('employees.db')
-        conn.row_factory = sqlite3.Row
-        print("DEBUG: Successfully connected to SQLite!")
-        return conn
-    except Exception as e:
-        print(f"DEBUG: SQLite connection also failed: {str(e)}")
-        raise e
+logger = get_logger('app')
 
 # Database initialization - FIXED: No sample data insertion
+SCHEMA = [
+    # Employees table WITH BANK FIELDS
+    '''
+    CREATE TABLE IF NOT EXISTS employees (
+        id {pk},
+        employee_id TEXT UNIQUE NOT NULL,
+        full_name TEXT NOT NULL,
+        email TEXT,
+        phone TEXT,
+        hourly_rate REAL NOT NULL,
+        passport_number TEXT,
+        bank_name TEXT,
+        bank_account_name TEXT,
+        bank_account_number TEXT,
+        status TEXT DEFAULT 'Active',
+        created_date {timestamp} DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS work_entries (
+        id {pk},
+        employee_id TEXT NOT NULL,
+        work_date TEXT NOT NULL,
+        start_time TEXT NOT NULL,
+        end_time TEXT NOT NULL,
+        break_minutes INTEGER DEFAULT 60,
+        normal_hours REAL DEFAULT 0,
+        overtime_hours REAL DEFAULT 0,
+        holiday_hours REAL DEFAULT 0,
+        created_date {timestamp} DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS advance_payments (
+        id {pk},
+        employee_id TEXT NOT NULL,
+        amount REAL NOT NULL,
+        payment_date TEXT NOT NULL,
+        reason TEXT,
+        created_date {timestamp} DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS food_expenses (
+        id {pk},
+        employee_id TEXT NOT NULL,
+        amount REAL NOT NULL,
+        expense_date TEXT NOT NULL,
+        description TEXT,
+        created_date {timestamp} DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS attendance_photos (
+        id {pk},
+        employee_id TEXT NOT NULL,
+        work_date TEXT NOT NULL,
+        photo_type TEXT NOT NULL,
+        photo_data TEXT NOT NULL,
+        created_date {timestamp} DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS payment_records (
+        id {pk},
+        employee_id TEXT NOT NULL,
+        payment_date TEXT NOT NULL,
+        amount_paid REAL NOT NULL,
+        payment_type TEXT NOT NULL,
+        description TEXT,
+        status TEXT DEFAULT 'paid',
+        created_date {timestamp} DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+]
+
 def init_db():
-    conn = get_db_connection()
-    
-    # Check if we're using PostgreSQL or SQLite
-    is_postgres = POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL')
-    
-    if is_postgres:
-        # PostgreSQL table creation
-        with conn.cursor() as c:
-            # Create employees table WITH BANK FIELDS
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS employees (
-                    id SERIAL PRIMARY KEY,
-                    employee_id TEXT UNIQUE NOT NULL,
-                    full_name TEXT NOT NULL,
-                    email TEXT,
-                    phone TEXT,
-                    hourly_rate REAL NOT NULL,
-                    passport_number TEXT,
-                    bank_name TEXT,
-                    bank_account_name TEXT,
-                    bank_account_number TEXT,
-                    status TEXT DEFAULT 'Active',
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create work entries table
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS work_entries (
-                    id SERIAL PRIMARY KEY,
-                    employee_id TEXT NOT NULL,
-                    work_date TEXT NOT NULL,
-                    start_time TEXT NOT NULL,
-                    end_time TEXT NOT NULL,
-                    break_minutes INTEGER DEFAULT 60,
-                    normal_hours REAL DEFAULT 0,
-                    overtime_hours REAL DEFAULT 0,
-                    holiday_hours REAL DEFAULT 0,
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create advance payments table
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS advance_payments (
-                    id SERIAL PRIMARY KEY,
-                    employee_id TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    payment_date TEXT NOT NULL,
-                    reason TEXT,
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create food expenses table
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS food_expenses (
-                    id SERIAL PRIMARY KEY,
-                    employee_id TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    expense_date TEXT NOT NULL,
-                    description TEXT,
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create attendance photos table
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS attendance_photos (
-                    id SERIAL PRIMARY KEY,
-                    employee_id TEXT NOT NULL,
-                    work_date TEXT NOT NULL,
-                    photo_type TEXT NOT NULL,
-                    photo_data TEXT NOT NULL,
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create payment_records table
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS payment_records (
-                    id SERIAL PRIMARY KEY,
-                    employee_id TEXT NOT NULL,
-                    payment_date TEXT NOT NULL,
-                    amount_paid REAL NOT NULL,
-                    payment_type TEXT NOT NULL,
-                    description TEXT,
-                    status TEXT DEFAULT 'paid',
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-    else:
-        # SQLite table creation
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS employees (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                employee_id TEXT UNIQUE NOT NULL,
-                full_name TEXT NOT NULL,
-                email TEXT,
-                phone TEXT,
-                hourly_rate REAL NOT NULL,
-                passport_number TEXT,
-                bank_name TEXT,
-                bank_account_name TEXT,
-                bank_account_number TEXT,
-                status TEXT DEFAULT 'Active',
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS work_entries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                employee_id TEXT NOT NULL,
-                work_date TEXT NOT NULL,
-                start_time TEXT NOT NULL,
-                end_time TEXT NOT NULL,
-                break_minutes INTEGER DEFAULT 60,
-                normal_hours REAL DEFAULT 0,
-                overtime_hours REAL DEFAULT 0,
-                holiday_hours REAL DEFAULT 0,
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS advance_payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                employee_id TEXT NOT NULL,
-                amount REAL NOT NULL,
-                payment_date TEXT NOT NULL,
-                reason TEXT,
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS food_expenses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                employee_id TEXT NOT NULL,
-                amount REAL NOT NULL,
-                expense_date TEXT NOT NULL,
-                description TEXT,
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS attendance_photos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                employee_id TEXT NOT NULL,
-                work_date TEXT NOT NULL,
-                photo_type TEXT NOT NULL,
-                photo_data TEXT NOT NULL,
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS payment_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                employee_id TEXT NOT NULL,
-                payment_date TEXT NOT NULL,
-                amount_paid REAL NOT NULL,
-                payment_type TEXT NOT NULL,
-                description TEXT,
-                status TEXT DEFAULT 'paid',
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+    pool = get_pool()
+    conn = pool.getconn()
+    
+    # {pk} and {timestamp} are rendered for whichever backend the pool resolved
+    for ddl in SCHEMA:
+        db.execute(ddl, conn=conn)
     
     conn.commit()
-    conn.close()
-    print("Database initialized successfully with empty tables!")
+    migrations.migrate(conn)
+    partitions.ensure(conn)
+    search.ensure(conn)
+    pool.putconn(conn)
+    logger.info("Database initialized")
 
 def calculate_hours(start_time, end_time, break_minutes=60, is_holiday=False):
     """Calculate normal and overtime hours"""
-    start = datetime.strptime(start_time, '%H:%M')
-    end = datetime.strptime(end_time, '%H:%M')
-    
-    # Calculate total minutes worked
-    total_minutes = (end - start).total_seconds() / 60
-    total_minutes -= break_minutes  # Subtract break time
-    
-    total_hours = total_minutes / 60
-    
-    if is_holiday:
-        return 0, 0, total_hours  # All hours are holiday hours (1.5x rate)
-    
-    # Normal working hours: 8 hours per day
-    normal_hours = min(total_hours, 8)
-    overtime_hours = max(total_hours - 8, 0)
-    
-    return normal_hours, overtime_hours, 0
+    return payroll_engine.entry_hours(start_time, end_time, break_minutes, is_holiday)
+
+# ===== CACHED LOOKUPS =====
+
+def employee_record(employee_id):
+    """employees row as a dict (None when missing), cached until the employee changes"""
+    def load():
+        employee = query('employee_by_id', (employee_id,)).fetchone()
+        return dict(employee) if employee else None
+    return cache.fetch('employee', employee_id, load)
+
+def headcount():
+    """(total, active, inactive) employee counts"""
+    return cache.fetch('headcount', 'all', lambda: (
+        query('employee_count').fetchone()[0],
+        query('employee_count_by_status', ('Active',)).fetchone()[0],
+        query('employee_count_by_status', ('Inactive',)).fetchone()[0],
+    ))
+
+def month_payroll(month):
+    """payroll.month_totals rows with pay columns, cached until the next payroll write"""
+    return cache.fetch('payroll_month', month, lambda: payroll_engine.with_pay(payroll.month_totals(month)))
+
+def invalidate_employee(employee_id):
+    cache.invalidate('employee', employee_id)
+    cache.invalidate('headcount')
+    cache.invalidate('payroll_month')
+    search.employee_changed(employee_id)
+
+def listing_page(listing, **kwargs):
+    """One page of ``listing`` for the current request; bad filters are flashed and dropped"""
+    try:
+        return listing.page(request.args, **kwargs)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return listing.page({}, **kwargs)
+
+def listing_json(listing, endpoint, url_args=None, **kwargs):
+    """JSON response for a page of ``listing``, with the URL of the next page"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return jsonify(success=False, message='Please log in again.'), 401
+    try:
+        page = listing.page(request.args, **kwargs)
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+    next_args = page.next_args()
+    next_url = url_for(endpoint, **(url_args or {}), **next_args) if next_args else None
+    return jsonify(success=True, next_url=next_url, **page.as_dict())
 
 # Routes
 @app.route('/')
@@ -249,12 +187,117 @@ def index():
 @app.route('/debug_db')
 def debug_db():
     """Debug route to check database connection"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
     try:
-        conn = get_db_connection()
-        conn.close()
+        get_db().execute('SELECT 1')
         return "Database connection successful!"
     except Exception as e:
-        return f"Database connection failed: {str(e)}"
+        # The error can name hosts and credentials; keep it in the server log
+        print(f"Database connection check failed: {e}")
+        return "Database connection failed!", 503
+
+@app.route('/debug_db/pool')
+def debug_db_pool():
+    """Pool metrics for this worker: wait time, checked out, connection errors"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    return jsonify(get_pool().stats())
+
+@app.route('/debug_db/writes')
+def debug_db_writes():
+    """SQLite write queue for this worker: writes, batches, failures and queue depth"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    writer = db.get_write_queue()
+    return jsonify(writer.stats() if writer else {})
+
+@app.route('/debug_db/replicas')
+def debug_db_replicas():
+    """Read replicas as this worker sees them: reachable, lag in seconds, in use"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    return jsonify([replica.status() for replica in db.replicas()])
+
+@app.route('/debug_db/cache')
+def debug_db_cache():
+    """Cache hit/miss counters for this worker"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    return jsonify(cache.stats())
+
+# ===== METRICS =====
+
+# Prometheus scrapers cannot log in; they send "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+POOL_GAUGES = ('checked_out', 'size', 'idle', 'max_size', 'checkouts', 'connections_opened', 'connection_errors',
+               'health_check_failures', 'evicted', 'timeouts', 'wait_time_total', 'wait_time_max')
+
+def pool_stat(key):
+    value = get_pool().stats().get(key)
+    return [((), value)] if value is not None else []
+
+def write_queue_stat(key):
+    writer = db.get_write_queue()
+    return [((), writer.stats()[key])] if writer else []
+
+def cache_stat(counter):
+    return [((namespace,), counters[counter]) for namespace, counters in cache.stats()['namespaces'].items()]
+
+for _key in POOL_GAUGES:
+    metrics.register(metrics.Gauges(f'ems_db_pool_{_key}', f'Connection pool {_key.replace("_", " ")}',
+                                    lambda key=_key: pool_stat(key)))
+for _counter in ('hits', 'misses', 'invalidations', 'errors'):
+    metrics.register(metrics.Gauges(f'ems_cache_{_counter}', f'Cache {_counter} by namespace',
+                                    lambda counter=_counter: cache_stat(counter), labels=('namespace',)))
+for _key in ('writes', 'batches', 'failed_writes', 'failed_batches', 'queued'):
+    metrics.register(metrics.Gauges(f'ems_db_write_queue_{_key}', f'SQLite write queue {_key.replace("_", " ")}',
+                                    lambda key=_key: write_queue_stat(key)))
+metrics.register(metrics.Gauges('ems_db_replica_lag_seconds', 'Replication lag last measured by this worker',
+                                lambda: [((replica.name,), replica.lag) for replica in db.replicas()
+                                         if replica.lag is not None], labels=('replica',)))
+metrics.register(metrics.Gauges('ems_ingest_pending', 'Photo uploads queued for ingestion in this process',
+                                lambda: [((), ingest.pool.pending())]))
+
+def metrics_allowed():
+    if session.get('logged_in') and session.get('user_type') == 'admin':
+        return True
+    return bool(METRICS_TOKEN) and request.headers.get('Authorization') == f'Bearer {METRICS_TOKEN}'
+
+@app.route('/admin/metrics')
+def metrics_endpoint():
+    """Request, query, pool and cache metrics of this worker in Prometheus text format"""
+    if not metrics_allowed():
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/metrics/slow_queries')
+def slow_queries():
+    if not metrics_allowed():
+        return jsonify(success=False, message='Please log in again.'), 401
+    return jsonify(success=True, threshold=metrics.SLOW_QUERY_SECONDS,
+                   slow_queries=list(reversed(metrics.slow_query_log)))
+
+@app.route('/admin/metrics/profiles')
+def profiles():
+    if not metrics_allowed():
+        return jsonify(success=False, message='Please log in again.'), 401
+    return jsonify(success=True, profiles=profiler.recent())
+
+@app.route('/admin/metrics/profiles/<int:profile_id>')
+def profile_report(profile_id):
+    if not metrics_allowed():
+        abort(401)
+    profile = profiler.get(profile_id)
+    if profile is None:
+        abort(404)
+    return Response(profile['report'], mimetype='text/plain')
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -262,102 +305,65 @@ def login():
     password = request.form.get('password')
     user_type = request.form.get('user_type')
     
-    print(f"Login attempt - User Type: {user_type}, Username: {username}, Password: {password}")
+    logger.debug('login attempt', extra={'user_type': user_type, 'username': username})
     
     if user_type == 'admin':
         if username == 'admin' and password == 'admin':
+            sessions.regenerate(session)
             session['logged_in'] = True
             session['username'] = username
             session['user_type'] = 'admin'
-            print("Admin login successful")
+            logger.info('admin login', extra={'username': username})
             return redirect(url_for('admin_dashboard'))
         else:
-            print("Admin login failed - invalid credentials")
+            logger.warning('admin login failed', extra={'username': username, 'remote_addr': request.remote_addr})
             flash('Invalid admin credentials!', 'error')
             return redirect(url_for('index'))
     
     elif user_type == 'employee':
-        conn = get_db_connection()
-        if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-            employee = conn.execute(
-                'SELECT * FROM employees WHERE employee_id = %s AND status = %s',
-                (username, 'Active')
-            ).fetchone()
-        else:
-            employee = conn.execute(
-                'SELECT * FROM employees WHERE employee_id = ? AND status = "Active"',
-                (username,)
-            ).fetchone()
-        conn.close()
+        employee = employee_record(username)
+        if employee is None:
+            # IDs typed in another case or with stray spaces still log in
+            employee_id = search.resolve_employee_id(username)
+            employee = employee_record(employee_id) if employee_id else None
         
-        if employee:
+        if employee and employee['status'] == 'Active':
+            sessions.regenerate(session)
             session['logged_in'] = True
             session['username'] = employee['full_name']
             session['user_type'] = 'employee'
             session['employee_id'] = employee['employee_id']
-            session['employee_data'] = dict(employee)
-            print(f"Employee login successful: {employee['full_name']}")
+            logger.info('employee login', extra={'employee_id': employee['employee_id']})
             return redirect(url_for('employee_dashboard'))
         else:
-            print("Employee login failed - invalid employee ID")
+            logger.warning('employee login failed', extra={'username': username, 'remote_addr': request.remote_addr})
             flash('Invalid employee ID!', 'error')
             return redirect(url_for('index'))
     else:
-        print(f"Invalid user type: {user_type}")
+        logger.warning('login with invalid user type', extra={'user_type': user_type})
         flash('Invalid login type!', 'error')
         return redirect(url_for('index'))
 
+@app.route('/logout')
+def logout():
+    session.clear()
+    sessions.regenerate(session)
+    flash('You have been logged out.', 'success')
+    return redirect(url_for('index'))
+
 @app.route('/admin')
+@db.read_only
 def admin_dashboard():
     if not session.get('logged_in') or session.get('user_type') != 'admin':
-        print("Admin dashboard access denied - not logged in or not admin")
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
-    
     # Get employee statistics
-    if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-        total_employees = conn.execute('SELECT COUNT(*) FROM employees').fetchone()[0]
-        active_employees = conn.execute('SELECT COUNT(*) FROM employees WHERE status = %s', ('Active',)).fetchone()[0]
-        inactive_employees = conn.execute('SELECT COUNT(*) FROM employees WHERE status = %s', ('Inactive',)).fetchone()[0]
-    else:
-        total_employees = conn.execute('SELECT COUNT(*) FROM employees').fetchone()[0]
-        active_employees = conn.execute('SELECT COUNT(*) FROM employees WHERE status = "Active"').fetchone()[0]
-        inactive_employees = conn.execute('SELECT COUNT(*) FROM employees WHERE status = "Inactive"').fetchone()[0]
+    total_employees, active_employees, inactive_employees = headcount()
     
     # Get payroll summary for current month
     current_month = datetime.now().strftime('%Y-%m')
     
-    if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-        payroll_data = conn.execute('''
-            SELECT e.employee_id, e.full_name, e.hourly_rate,
-                   COALESCE(SUM(w.normal_hours), 0) as total_normal_hours,
-                   COALESCE(SUM(w.overtime_hours), 0) as total_overtime_hours,
-                   COALESCE(SUM(w.holiday_hours), 0) as total_holiday_hours,
-                   COALESCE(SUM(a.amount), 0) as total_advances,
-                   COALESCE(SUM(f.amount), 0) as total_food_expenses
-            FROM employees e
-            LEFT JOIN work_entries w ON e.employee_id = w.employee_id AND to_char(w.work_date::timestamp, 'YYYY-MM') = %s
-            LEFT JOIN advance_payments a ON e.employee_id = a.employee_id AND to_char(a.payment_date::timestamp, 'YYYY-MM') = %s
-            LEFT JOIN food_expenses f ON e.employee_id = f.employee_id AND to_char(f.expense_date::timestamp, 'YYYY-MM') = %s
-            GROUP BY e.employee_id, e.full_name, e.hourly_rate
-        ''', (current_month, current_month, current_month)).fetchall()
-    else:
-        payroll_data = conn.execute('''
-            SELECT e.employee_id, e.full_name, e.hourly_rate,
-                   COALESCE(SUM(w.normal_hours), 0) as total_normal_hours,
-                   COALESCE(SUM(w.overtime_hours), 0) as total_overtime_hours,
-                   COALESCE(SUM(w.holiday_hours), 0) as total_holiday_hours,
-                   COALESCE(SUM(a.amount), 0) as total_advances,
-                   COALESCE(SUM(f.amount), 0) as total_food_expenses
-            FROM employees e
-            LEFT JOIN work_entries w ON e.employee_id = w.employee_id AND strftime('%Y-%m', w.work_date) = ?
-            LEFT JOIN advance_payments a ON e.employee_id = a.employee_id AND strftime('%Y-%m', a.payment_date) = ?
-            LEFT JOIN food_expenses f ON e.employee_id = f.employee_id AND strftime('%Y-%m', f.expense_date) = ?
-            GROUP BY e.employee_id, e.full_name, e.hourly_rate
-        ''', (current_month, current_month, current_month)).fetchall()
-    
-    conn.close()
+    payroll_data = month_payroll(current_month)
     
     return render_template('admin_dashboard.html', 
                          total_employees=total_employees,
@@ -366,110 +372,49 @@ def admin_dashboard():
                          payroll_data=payroll_data,
                          current_month=current_month)
 
+@app.route('/admin/settings')
+def admin_settings():
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    return render_template('admin_settings.html')
+
 @app.route('/employee')
+@db.read_only
 def employee_dashboard():
     if not session.get('logged_in') or session.get('user_type') != 'employee':
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
     employee_id = session.get('employee_id')
     
     # Get current month data
     current_month = datetime.now().strftime('%Y-%m')
+    month_start, month_end = month_range(current_month)
     
     # Get work entries for current month
-    if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-        work_entries = conn.execute('''
-            SELECT * FROM work_entries 
-            WHERE employee_id = %s AND to_char(work_date::timestamp, 'YYYY-MM') = %s
-            ORDER BY work_date DESC
-        ''', (employee_id, current_month)).fetchall()
-        
-        # Get today's status
-        today = datetime.now().strftime('%Y-%m-%d')
-        today_entry = conn.execute(
-            'SELECT * FROM work_entries WHERE employee_id = %s AND work_date = %s',
-            (employee_id, today)
-        ).fetchone()
-    else:
-        work_entries = conn.execute('''
-            SELECT * FROM work_entries 
-            WHERE employee_id = ? AND strftime('%Y-%m', work_date) = ?
-            ORDER BY work_date DESC
-        ''', (employee_id, current_month)).fetchall()
-        
-        # Get today's status
-        today = datetime.now().strftime('%Y-%m-%d')
-        today_entry = conn.execute(
-            'SELECT * FROM work_entries WHERE employee_id = ? AND work_date = ?',
-            (employee_id, today)
-        ).fetchone()
+    work_entries = query('employee_month_work_entries', (employee_id, month_start, month_end)).fetchall()
+    
+    # Get today's status
+    today = datetime.now().strftime('%Y-%m-%d')
+    today_entry = query('work_entry_for_day', (employee_id, today)).fetchone()
     
     # Get payroll summary
-    if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-        payroll_summary = conn.execute('''
-            SELECT 
-                COALESCE(SUM(w.normal_hours), 0) as total_normal_hours,
-                COALESCE(SUM(w.overtime_hours), 0) as total_overtime_hours,
-                COALESCE(SUM(w.holiday_hours), 0) as total_holiday_hours,
-                COALESCE(SUM(a.amount), 0) as total_advances,
-                COALESCE(SUM(f.amount), 0) as total_food_expenses
-            FROM work_entries w
-            LEFT JOIN advance_payments a ON w.employee_id = a.employee_id AND to_char(a.payment_date::timestamp, 'YYYY-MM') = %s
-            LEFT JOIN food_expenses f ON w.employee_id = f.employee_id AND to_char(f.expense_date::timestamp, 'YYYY-MM') = %s
-            WHERE w.employee_id = %s AND to_char(w.work_date::timestamp, 'YYYY-MM') = %s
-        ''', (current_month, current_month, employee_id, current_month)).fetchone()
-    else:
-        payroll_summary = conn.execute('''
-            SELECT 
-                COALESCE(SUM(w.normal_hours), 0) as total_normal_hours,
-                COALESCE(SUM(w.overtime_hours), 0) as total_overtime_hours,
-                COALESCE(SUM(w.holiday_hours), 0) as total_holiday_hours,
-                COALESCE(SUM(a.amount), 0) as total_advances,
-                COALESCE(SUM(f.amount), 0) as total_food_expenses
-            FROM work_entries w
-            LEFT JOIN advance_payments a ON w.employee_id = a.employee_id AND strftime('%Y-%m', a.payment_date) = ?
-            LEFT JOIN food_expenses f ON w.employee_id = f.employee_id AND strftime('%Y-%m', f.expense_date) = ?
-            WHERE w.employee_id = ? AND strftime('%Y-%m', w.work_date) = ?
-        ''', (current_month, current_month, employee_id, current_month)).fetchone()
-    
-    if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-        employee = conn.execute('SELECT * FROM employees WHERE employee_id = %s', (employee_id,)).fetchone()
-    else:
-        employee = conn.execute('SELECT * FROM employees WHERE employee_id = ?', (employee_id,)).fetchone()
+    payroll_summary = payroll.employee_month_totals(employee_id, current_month)
+    
+    employee = employee_record(employee_id)
     
     # Calculate payment totals
-    if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-        total_earnings = conn.execute('''
-            SELECT COALESCE(SUM(normal_hours + overtime_hours + holiday_hours), 0) * %s as total 
-            FROM work_entries WHERE employee_id = %s
-        ''', (employee['hourly_rate'], employee_id)).fetchone()[0]
-        
-        total_paid = conn.execute('''
-            SELECT COALESCE(SUM(amount_paid), 0) as total 
-            FROM payment_records WHERE employee_id = %s
-        ''', (employee_id,)).fetchone()[0]
-    else:
-        total_earnings = conn.execute('''
-            SELECT COALESCE(SUM(normal_hours + overtime_hours + holiday_hours), 0) * ? as total 
-            FROM work_entries WHERE employee_id = ?
-        ''', (employee['hourly_rate'], employee_id)).fetchone()[0]
-        
-        total_paid = conn.execute('''
-            SELECT COALESCE(SUM(amount_paid), 0) as total 
-            FROM payment_records WHERE employee_id = ?
-        ''', (employee_id,)).fetchone()[0]
+    lifetime = payroll.employee_lifetime_totals(employee_id)
+    total_earnings = lifetime['total_earnings']
+    total_paid = lifetime['total_paid']
     
     pending_amount = total_earnings - total_paid
     
-    conn.close()
-    
     # Calculate payments
-    hourly_rate = employee['hourly_rate']
-    normal_pay = payroll_summary['total_normal_hours'] * hourly_rate
-    overtime_pay = payroll_summary['total_overtime_hours'] * hourly_rate * 1.5  # 1.5x for overtime
-    holiday_pay = payroll_summary['total_holiday_hours'] * hourly_rate * 1.5   # 1.5x for holidays
-    total_earnings_calc = normal_pay + overtime_pay + holiday_pay
+    pay = payroll_engine.month_pay(payroll_summary)
+    normal_pay = pay['normal_pay']
+    overtime_pay = pay['overtime_pay']
+    holiday_pay = pay['holiday_pay']
+    total_earnings_calc = pay['total_pay']
     grand_total = total_earnings_calc - payroll_summary['total_advances'] - payroll_summary['total_food_expenses']
     
     return render_template('employee_dashboard.html', 
@@ -485,42 +430,226 @@ def employee_dashboard():
                          total_paid=total_paid,
                          pending_amount=pending_amount,
                          today_entry=today_entry,
-                         today=today)
+                         today=today,
+                         capture_profile=photos.capture_profile())
+
+@app.route('/employee/capture_profile')
+def capture_profile():
+    """How to encode attendance photos: longest edge, quality, preferred types and byte budget"""
+    if not session.get('logged_in') or session.get('user_type') != 'employee':
+        return jsonify(success=False, message='Please log in again.'), 401
+    return jsonify(success=True, profile=photos.capture_profile())
+
+@app.route('/employee/payments')
+@db.read_only
+def employee_payment_details():
+    if not session.get('logged_in') or session.get('user_type') != 'employee':
+        return redirect(url_for('index'))
+    
+    employee_id = session.get('employee_id')
+    employee = employee_record(employee_id)
+    lifetime = payroll.employee_lifetime_totals(employee_id)
+    history = pagination.PAYMENTS.page({}, where=('p.employee_id = ?',), params=(employee_id,))
+    
+    return render_template('employee_payment_details.html',
+                         employee=employee,
+                         payment_history=history.rows,
+                         total_earnings=lifetime['total_earnings'],
+                         total_paid=lifetime['total_paid'],
+                         pending_amount=lifetime['total_earnings'] - lifetime['total_paid'])
+
+# ===== ATTENDANCE ROUTES =====
+
+PHOTO_CACHE_SECONDS = 365 * 24 * 3600
+
+def read_attendance_photo():
+    """The upload as (bytes, encoding, content type); multipart ``photo`` or the older ``photo_data`` field"""
+    upload = request.files.get('photo')
+    if upload is not None:
+        data = upload.read(photos.CAPTURE_UPLOAD_LIMIT + 1)
+        content_type = upload.mimetype
+        if not content_type.startswith('image/'):
+            raise ValueError('Photo must be an image')
+        encoding = ingest.BINARY
+    else:
+        data = (request.form.get('photo_data') or '').encode('ascii', 'replace')
+        # Decoded by the ingestion threads; only the header is checked here
+        if not data.startswith(b'data:image/') or b';base64,' not in data[:100]:
+            raise ValueError('Photo must be a base64 data URL')
+        content_type = None
+        encoding = ingest.DATA_URL
+    if not data:
+        raise ValueError('Photo is empty')
+    return data, encoding, content_type
+
+def attendance_body_refusal():
+    """Error response when the request body is over the upload limit, checked before reading it"""
+    limit = photos.CAPTURE_UPLOAD_LIMIT
+    if request.mimetype != 'multipart/form-data':
+        # The older url-encoded base64 form is about 4/3 larger, and more once percent-escaped
+        limit = limit * 3 // 2
+    # Room for the multipart headers and the other fields
+    limit += 16 * 1024
+    if request.content_length is None:
+        return jsonify(success=False, message='Upload size unknown.'), 411
+    if request.content_length > limit:
+        return jsonify(success=False, message='Photo is too large; please retake it.'), 413
+    return None
+
+def replay_attendance(employee_id, idempotency_key):
+    """Response for a retried request whose check-in was already accepted (None for a new key)"""
+    upload = ingest.previous(employee_id, idempotency_key)
+    if upload is None:
+        return None
+    return jsonify(success=True, message=upload['message'], upload_id=upload['id'], duplicate=True), 202
+
+def record_attendance(photo_type):
+    """Shared check-in/check-out handler.
+    
+    Answers once the work entry and the spooled photo are committed; the
+    photo is stored and thumbnailed by ingest.pool. An ``Idempotency-Key``
+    header makes retries return the first answer instead of a new entry.
+    """
+    if not session.get('logged_in') or session.get('user_type') != 'employee':
+        return jsonify(success=False, message='Please log in again.'), 401
+    
+    refusal = attendance_body_refusal()
+    if refusal:
+        return refusal
+    
+    employee_id = session.get('employee_id')
+    idempotency_key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    replay = replay_attendance(employee_id, idempotency_key)
+    if replay:
+        return replay
+    
+    if not ingest.pool.has_capacity():
+        response = jsonify(success=False, message='Too many check-ins right now, retrying shortly.')
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    try:
+        data, encoding, content_type = read_attendance_photo()
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+    
+    now = datetime.now()
+    today = now.strftime('%Y-%m-%d')
+    time_now = now.strftime('%H:%M')
+    message = f"{'Checked in' if photo_type == 'check_in' else 'Checked out'} at {time_now}"
+    # Written to disk before taking the write lock, which is held only for the statements
+    spool_path = ingest.spool(data)
+    
+    def record(conn):
+        entry = query('work_entry_for_day', (employee_id, today), conn=conn).fetchone()
+        if photo_type == 'check_in':
+            if entry:
+                return 'refused', 'You have already checked in today.'
+        elif not entry:
+            return 'refused', 'You have not checked in today.'
+        elif entry['end_time'] != entry['start_time']:
+            return 'refused', 'You have already checked out today.'
+        upload_id = ingest.accept(employee_id, today, photo_type, idempotency_key, spool_path, encoding,
+                                  content_type, len(data), message, conn=conn)
+        if upload_id is None:
+            # A concurrent retry with the same key got there first
+            return 'duplicate', None
+        if photo_type == 'check_in':
+            query('insert_work_entry', (employee_id, today, time_now, time_now, 60, 0, 0, 0), conn=conn)
+        else:
+            normal_hours, overtime_hours, holiday_hours = calculate_hours(entry['start_time'], time_now, entry['break_minutes'])
+            query('check_out_work_entry', (time_now, normal_hours, overtime_hours, holiday_hours, entry['id']), conn=conn)
+        payroll.refresh_summary(employee_id, today, conn=conn)
+        return 'accepted', upload_id
+    
+    outcome, detail = db.write(record)
+    if outcome != 'accepted':
+        ingest.discard(spool_path)
+        replay = replay_attendance(employee_id, idempotency_key)
+        if replay or outcome == 'duplicate':
+            return replay
+        return jsonify(success=False, message=detail)
+    cache.invalidate('payroll_month')
+    ingest.pool.submit(detail)
+    return jsonify(success=True, message=message, upload_id=detail), 202
+
+@app.route('/employee/check_in_with_photo', methods=['POST'])
+def check_in_with_photo():
+    return record_attendance('check_in')
+
+@app.route('/employee/check_out_with_photo', methods=['POST'])
+def check_out_with_photo():
+    return record_attendance('check_out')
+
+@app.route('/photo/<int:photo_id>')
+def photo_data(photo_id):
+    """Serve an attendance photo as ?size=small|medium|original (default original).
+
+    Blobs are content-addressed, so the hash makes a strong ETag and the
+    response can be cached for a year; repeat views get a 304 without
+    touching the file.
+    """
+    if not session.get('logged_in'):
+        return redirect(url_for('index'))
+    
+    size = request.args.get('size', 'original')
+    if size != 'original' and size not in photos.THUMBNAIL_SIZES:
+        abort(400)
+    
+    photo = query('attendance_photo_by_id', (photo_id,)).fetchone()
+    if not photo or (session.get('user_type') != 'admin' and photo['employee_id'] != session.get('employee_id')):
+        abort(404)
+    
+    digest = photo['photo_hash']
+    content_type = photo['content_type']
+    if not digest:
+        # Row not moved by `flask migrate-photos` yet: move it now, so later views skip the decoding
+        inline = query('attendance_photo_inline_data', (photo_id,)).fetchone()
+        data, content_type = photos.decode_data_url(inline['photo_data'])
+        digest = photos.store.put(data)
+        query('set_attendance_photo_blob', (digest, content_type, len(data), photo_id))
+        get_db().commit()
+    
+    etag = f'{digest}-{size}'
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+    else:
+        if size == 'original':
+            path = photos.store.path(digest)
+        else:
+            path = photos.thumbnail_path(digest, size)
+            if path != photos.store.path(digest):
+                content_type = 'image/jpeg'
+        # send_file hands the open file to the server's wsgi.file_wrapper (sendfile where available)
+        response = send_file(path, mimetype=content_type, etag=etag, conditional=False)
+    
+    response.cache_control.no_cache = None
+    response.cache_control.max_age = PHOTO_CACHE_SECONDS
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/admin/photos/<int:photo_id>')
+def view_photo(photo_id):
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    photo = query('attendance_photo_with_name', (photo_id,)).fetchone()
+    if not photo:
+        abort(404)
+    return render_template('view_photo.html', photo=photo)
 
 # ===== PAYMENT MANAGEMENT ROUTES =====
 
 @app.route('/admin/payments')
+@db.read_only
 def admin_payments():
     if not session.get('logged_in') or session.get('user_type') != 'admin':
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
-    
     # Get all employees with their payment summary
-    if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-        employees = conn.execute('''
-            SELECT e.*, 
-                   COALESCE(SUM(w.normal_hours + w.overtime_hours + w.holiday_hours), 0) * e.hourly_rate as total_earnings,
-                   COALESCE(SUM(p.amount_paid), 0) as total_paid
-            FROM employees e
-            LEFT JOIN work_entries w ON e.employee_id = w.employee_id
-            LEFT JOIN payment_records p ON e.employee_id = p.employee_id
-            GROUP BY e.id, e.employee_id, e.full_name, e.hourly_rate, e.bank_name, e.bank_account_number
-            ORDER BY e.full_name
-        ''').fetchall()
-    else:
-        employees = conn.execute('''
-            SELECT e.*, 
-                   COALESCE(SUM(w.normal_hours + w.overtime_hours + w.holiday_hours), 0) * e.hourly_rate as total_earnings,
-                   COALESCE(SUM(p.amount_paid), 0) as total_paid
-            FROM employees e
-            LEFT JOIN work_entries w ON e.employee_id = w.employee_id
-            LEFT JOIN payment_records p ON e.employee_id = p.employee_id
-            GROUP BY e.employee_id
-            ORDER BY e.full_name
-        ''').fetchall()
-    
-    conn.close()
+    employees = payroll.lifetime_totals()
     
     # Calculate pending amounts
     employees_with_pay = []
@@ -544,98 +673,317 @@ def make_payment(employee_id):
     if not session.get('logged_in') or session.get('user_type') != 'admin':
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
-    
     if request.method == 'POST':
         amount_paid = float(request.form['amount_paid'])
         payment_type = request.form['payment_type']
         description = request.form.get('description', '')
         
         # Insert payment record
-        if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-            conn.execute('''
-                INSERT INTO payment_records (employee_id, payment_date, amount_paid, payment_type, description)
-                VALUES (%s, CURRENT_DATE, %s, %s, %s)
-            ''', (employee_id, amount_paid, payment_type, description))
-        else:
-            conn.execute('''
-                INSERT INTO payment_records (employee_id, payment_date, amount_paid, payment_type, description)
-                VALUES (?, DATE("now"), ?, ?, ?)
-            ''', (employee_id, amount_paid, payment_type, description))
+        payment_date = datetime.now().strftime('%Y-%m-%d')
+        query('insert_payment', (employee_id, payment_date, amount_paid, payment_type, description))
+        payroll.refresh_summary(employee_id, payment_date)
         
-        conn.commit()
+        get_db().commit()
+        cache.invalidate('payroll_month')
         flash(f'Payment of RM {amount_paid:.2f} recorded successfully!', 'success')
-        conn.close()
         return redirect(url_for('admin_payments'))
     
     # GET request - show payment form
-    if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-        employee = conn.execute('SELECT * FROM employees WHERE employee_id = %s', (employee_id,)).fetchone()
-    else:
-        employee = conn.execute('SELECT * FROM employees WHERE employee_id = ?', (employee_id,)).fetchone()
+    employee = employee_record(employee_id)
     
     # Calculate totals
-    if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-        total_earnings = conn.execute('''
-            SELECT COALESCE(SUM(normal_hours + overtime_hours + holiday_hours), 0) * %s as total 
-            FROM work_entries WHERE employee_id = %s
-        ''', (employee['hourly_rate'], employee_id)).fetchone()[0]
-        
-        total_paid = conn.execute('''
-            SELECT COALESCE(SUM(amount_paid), 0) as total 
-            FROM payment_records WHERE employee_id = %s
-        ''', (employee_id,)).fetchone()[0]
-    else:
-        total_earnings = conn.execute('''
-            SELECT COALESCE(SUM(normal_hours + overtime_hours + holiday_hours), 0) * ? as total 
-            FROM work_entries WHERE employee_id = ?
-        ''', (employee['hourly_rate'], employee_id)).fetchone()[0]
-        
-        total_paid = conn.execute('''
-            SELECT COALESCE(SUM(amount_paid), 0) as total 
-            FROM payment_records WHERE employee_id = ?
-        ''', (employee_id,)).fetchone()[0]
+    lifetime = payroll.employee_lifetime_totals(employee_id)
+    total_earnings = lifetime['total_earnings']
+    total_paid = lifetime['total_paid']
     
     pending_amount = total_earnings - total_paid
     
-    # Get payment history
-    if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-        payment_history = conn.execute('''
-            SELECT * FROM payment_records 
-            WHERE employee_id = %s 
-            ORDER BY payment_date DESC
-        ''', (employee_id,)).fetchall()
-    else:
-        payment_history = conn.execute('''
-            SELECT * FROM payment_records 
-            WHERE employee_id = ? 
-            ORDER BY payment_date DESC
-        ''', (employee_id,)).fetchall()
-    
-    conn.close()
+    # Latest payments only; the history page pages through the rest
+    history = pagination.PAYMENTS.page({'limit': 10}, where=('p.employee_id = ?',), params=(employee_id,))
     
     return render_template('admin_make_payment.html', 
                          employee=employee,
-                         payment_history=payment_history,
+                         payment_history=history.rows,
+                         more_payments=history.next_cursor is not None,
                          total_earnings=total_earnings,
                          total_paid=total_paid,
                          pending_amount=pending_amount)
 
-# ... (other routes continue with similar PostgreSQL/SQLite checks)
+@app.route('/admin/payments/history/<employee_id>')
+@db.read_only
+def payment_history(employee_id):
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    employee = employee_record(employee_id)
+    page = listing_page(pagination.PAYMENTS, where=('p.employee_id = ?',), params=(employee_id,))
+    totals = query('employee_payment_totals', (employee_id,)).fetchone()
+    
+    return render_template('admin_payment_history.html', employee=employee, payment_history=page.rows, page=page,
+                           totals=totals)
+
+@app.route('/admin/api/payments/<employee_id>')
+@db.read_only
+def api_payment_history(employee_id):
+    """Payment records of one employee, newest first (?status=, ?date_from=, ?date_to=, ?cursor=, ?limit=)"""
+    return listing_json(pagination.PAYMENTS, 'api_payment_history', {'employee_id': employee_id},
+                        where=('p.employee_id = ?',), params=(employee_id,))
+
+@app.route('/admin/payments/edit/<int:payment_id>', methods=['GET', 'POST'])
+def edit_payment(payment_id):
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    payment = query('payment_by_id', (payment_id,)).fetchone()
+    if not payment:
+        flash('Payment record not found!', 'error')
+        return redirect(url_for('admin_payments'))
+    
+    if request.method == 'POST':
+        payment_date = request.form['payment_date']
+        try:
+            query('update_payment', (payment_date, float(request.form['amount_paid']), request.form['payment_type'],
+                                     request.form['status'], request.form.get('description', ''), payment_id))
+            payroll.refresh_summary(payment['employee_id'], payment['payment_date'], payment_date)
+            get_db().commit()
+            cache.invalidate('payroll_month')
+            flash('Payment updated successfully!', 'success')
+        except Exception as e:
+            get_db().rollback()
+            flash(f'Error updating payment: {str(e)}', 'error')
+        return redirect(url_for('payment_history', employee_id=payment['employee_id']))
+    
+    return render_template('admin_edit_payment.html', payment=payment)
+
+@app.route('/admin/payments/delete/<int:payment_id>', methods=['POST'])
+def delete_payment(payment_id):
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    payment = query('payment_by_id', (payment_id,)).fetchone()
+    if payment:
+        query('delete_payment', (payment_id,))
+        payroll.refresh_summary(payment['employee_id'], payment['payment_date'])
+        get_db().commit()
+        cache.invalidate('payroll_month')
+        flash('Payment deleted successfully!', 'success')
+        return redirect(url_for('payment_history', employee_id=payment['employee_id']))
+    
+    flash('Payment record not found!', 'error')
+    return redirect(url_for('admin_payments'))
+
+# ===== WORK ENTRY ROUTES =====
+
+@app.route('/admin/work_entries')
+@db.read_only
+def manage_work_entries():
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    employees = query('employee_choices').fetchall()
+    page = listing_page(pagination.WORK_ENTRIES)
+    
+    return render_template('manage_work_entries.html', employees=employees, work_entries=page.rows, page=page)
+
+@app.route('/admin/api/work_entries')
+@db.read_only
+def api_work_entries():
+    """Work entries newest first (?q=, ?employee_id=, ?date_from=, ?date_to=, ?cursor=, ?limit=)"""
+    return listing_json(pagination.WORK_ENTRIES, 'api_work_entries')
+
+def work_entry_values():
+    """Read a work entry form and compute its hours"""
+    start_time = request.form['start_time']
+    end_time = request.form['end_time']
+    break_minutes = int(request.form.get('break_minutes') or 60)
+    is_holiday = 'is_holiday' in request.form
+    normal_hours, overtime_hours, holiday_hours = calculate_hours(start_time, end_time, break_minutes, is_holiday)
+    return (request.form['employee_id'], request.form['work_date'], start_time, end_time, break_minutes,
+            normal_hours, overtime_hours, holiday_hours)
+
+@app.route('/admin/work_entries/add', methods=['POST'])
+def add_work_entry():
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    try:
+        values = work_entry_values()
+        query('insert_work_entry', values)
+        payroll.refresh_summary(values[0], values[1])
+        get_db().commit()
+        cache.invalidate('payroll_month')
+        flash('Work entry added successfully!', 'success')
+    except Exception as e:
+        get_db().rollback()
+        flash(f'Error adding work entry: {str(e)}', 'error')
+    
+    return redirect(url_for('manage_work_entries'))
+
+@app.route('/admin/work_entries/edit/<int:entry_id>', methods=['POST'])
+def edit_work_entry(entry_id):
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    entry = query('work_entry_by_id', (entry_id,)).fetchone()
+    if not entry:
+        flash('Work entry not found!', 'error')
+        return redirect(url_for('manage_work_entries'))
+    
+    try:
+        values = work_entry_values()
+        query('update_work_entry', values + (entry_id,))
+        # The entry may have moved to another employee or month
+        payroll.refresh_summary(entry['employee_id'], entry['work_date'])
+        payroll.refresh_summary(values[0], values[1])
+        get_db().commit()
+        cache.invalidate('payroll_month')
+        flash('Work entry updated successfully!', 'success')
+    except Exception as e:
+        get_db().rollback()
+        flash(f'Error updating work entry: {str(e)}', 'error')
+    
+    return redirect(url_for('manage_work_entries'))
+
+@app.route('/admin/work_entries/delete/<int:entry_id>', methods=['POST'])
+def delete_work_entry(entry_id):
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    entry = query('work_entry_by_id', (entry_id,)).fetchone()
+    if entry:
+        query('delete_work_entry', (entry_id,))
+        payroll.refresh_summary(entry['employee_id'], entry['work_date'])
+        get_db().commit()
+        cache.invalidate('payroll_month')
+        flash('Work entry deleted successfully!', 'success')
+    
+    return redirect(request.referrer or url_for('manage_work_entries'))
+
+# ===== ADVANCE PAYMENT ROUTES =====
+
+@app.route('/admin/advance_payments')
+@db.read_only
+def manage_advance_payments():
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    employees = query('employee_choices').fetchall()
+    advances = query('advances_with_names').fetchall()
+    
+    return render_template('manage_advance_payments.html', employees=employees, advances=advances)
+
+@app.route('/admin/advance_payments/add', methods=['POST'])
+def add_advance_payment():
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    employee_id = request.form['employee_id']
+    payment_date = request.form['payment_date']
+    try:
+        query('insert_advance_payment', (employee_id, float(request.form['amount']), payment_date, request.form.get('reason', '')))
+        payroll.refresh_summary(employee_id, payment_date)
+        get_db().commit()
+        cache.invalidate('payroll_month')
+        flash('Advance payment added successfully!', 'success')
+    except Exception as e:
+        get_db().rollback()
+        flash(f'Error adding advance payment: {str(e)}', 'error')
+    
+    return redirect(url_for('manage_advance_payments'))
+
+@app.route('/admin/advance_payments/delete/<int:advance_id>', methods=['POST'])
+def delete_advance_payment(advance_id):
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    advance = query('advance_payment_by_id', (advance_id,)).fetchone()
+    if advance:
+        query('delete_advance_payment', (advance_id,))
+        payroll.refresh_summary(advance['employee_id'], advance['payment_date'])
+        get_db().commit()
+        cache.invalidate('payroll_month')
+        flash('Advance payment deleted successfully!', 'success')
+    
+    return redirect(request.referrer or url_for('manage_advance_payments'))
+
+# ===== FOOD EXPENSE ROUTES =====
+
+@app.route('/admin/food_expenses')
+@db.read_only
+def manage_food_expenses():
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    employees = query('employee_choices').fetchall()
+    expenses = query('food_expenses_with_names').fetchall()
+    
+    return render_template('manage_food_expenses.html', employees=employees, expenses=expenses)
+
+@app.route('/admin/food_expenses/add', methods=['POST'])
+def add_food_expense():
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    employee_id = request.form['employee_id']
+    expense_date = request.form['expense_date']
+    try:
+        query('insert_food_expense', (employee_id, float(request.form['amount']), expense_date, request.form.get('description', '')))
+        payroll.refresh_summary(employee_id, expense_date)
+        get_db().commit()
+        cache.invalidate('payroll_month')
+        flash('Food expense added successfully!', 'success')
+    except Exception as e:
+        get_db().rollback()
+        flash(f'Error adding food expense: {str(e)}', 'error')
+    
+    return redirect(url_for('manage_food_expenses'))
+
+@app.route('/admin/food_expenses/delete/<int:expense_id>', methods=['POST'])
+def delete_food_expense(expense_id):
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    expense = query('food_expense_by_id', (expense_id,)).fetchone()
+    if expense:
+        query('delete_food_expense', (expense_id,))
+        payroll.refresh_summary(expense['employee_id'], expense['expense_date'])
+        get_db().commit()
+        cache.invalidate('payroll_month')
+        flash('Food expense deleted successfully!', 'success')
+    
+    return redirect(request.referrer or url_for('manage_food_expenses'))
+
+# ===== EMPLOYEE ROUTES =====
 
 @app.route('/admin/employees')
+@db.read_only
 def manage_employees():
     if not session.get('logged_in') or session.get('user_type') != 'admin':
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
-    if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-        employees = conn.execute('SELECT * FROM employees ORDER BY created_date DESC').fetchall()
-    else:
-        employees = conn.execute('SELECT * FROM employees ORDER BY created_date DESC').fetchall()
-    conn.close()
+    page = listing_page(pagination.EMPLOYEES)
+    total_employees = headcount()[0]
     
-    return render_template('manage_employees.html', employees=employees)
+    return render_template('manage_employees.html', employees=page.rows, page=page, total_employees=total_employees)
+
+@app.route('/admin/api/employees')
+@db.read_only
+def api_employees():
+    """Employees newest first (?q= name or ID, ?status=, ?cursor=, ?limit=)"""
+    return listing_json(pagination.EMPLOYEES, 'api_employees')
+
+@app.route('/admin/api/employees/search')
+@db.read_only
+def api_employee_search():
+    """Type-ahead: employees whose name, ID, phone, passport or bank account starts with each word of ?q="""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return jsonify(success=False, message='Please log in again.'), 401
+    try:
+        limit = int(request.args.get('limit') or search.SEARCH_DEFAULT_LIMIT)
+    except ValueError:
+        return jsonify(success=False, message='Invalid limit'), 400
+    results = search.search(request.args.get('q', ''), limit=limit, status=request.args.get('status') or None)
+    return jsonify(success=True, items=results)
 
 @app.route('/admin/employees/add', methods=['POST'])
 def add_employee():
@@ -653,54 +1001,375 @@ def add_employee():
     bank_account_number = request.form.get('bank_account_number', '')
     
     try:
-        conn = get_db_connection()
-        if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-            conn.execute('''
-                INSERT INTO employees (employee_id, full_name, email, phone, hourly_rate, passport_number, bank_name, bank_account_name, bank_account_number)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (employee_id, full_name, email, phone, float(hourly_rate), passport_number, bank_name, bank_account_name, bank_account_number))
-        else:
-            conn.execute('''
-                INSERT INTO employees (employee_id, full_name, email, phone, hourly_rate, passport_number, bank_name, bank_account_name, bank_account_number)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (employee_id, full_name, email, phone, float(hourly_rate), passport_number, bank_name, bank_account_name, bank_account_number))
-        conn.commit()
-        conn.close()
+        query('insert_employee', (employee_id, full_name, email, phone, float(hourly_rate), passport_number, bank_name, bank_account_name, bank_account_number))
+        search.store_terms(employee_id)
+        get_db().commit()
+        invalidate_employee(employee_id)
         flash('Employee added successfully!', 'success')
     except Exception as e:
         flash(f'Error adding employee: {str(e)}', 'error')
     
     return redirect(url_for('manage_employees'))
 
+# Rows of each kind shown on an employee's detail page (newest first)
+EMPLOYEE_DETAIL_ROWS = 100
+
+@app.route('/admin/employees/<employee_id>')
+@db.read_only
+def view_employee_entries(employee_id):
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    employee = employee_record(employee_id)
+    if not employee:
+        flash('Employee not found!', 'error')
+        return redirect(url_for('manage_employees'))
+    
+    newest = {'limit': EMPLOYEE_DETAIL_ROWS}
+    work_entries = pagination.WORK_ENTRIES.page(newest, where=('w.employee_id = ?',), params=(employee_id,))
+    payments = pagination.PAYMENTS.page(newest, where=('p.employee_id = ?',), params=(employee_id,))
+    advances = query('employee_recent_advances', (employee_id, EMPLOYEE_DETAIL_ROWS)).fetchall()
+    food_expenses = query('employee_recent_food_expenses', (employee_id, EMPLOYEE_DETAIL_ROWS)).fetchall()
+    attendance_photos = query('employee_recent_photos', (employee_id, EMPLOYEE_DETAIL_ROWS)).fetchall()
+    
+    return render_template('admin_employee_entries.html',
+                         employee=employee,
+                         work_entries=work_entries.rows,
+                         payment_records=payments.rows,
+                         advances=advances,
+                         food_expenses=food_expenses,
+                         attendance_photos=attendance_photos)
+
+@app.route('/admin/employees/edit/<employee_id>', methods=['POST'])
+def edit_employee(employee_id):
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    try:
+        query('update_employee', (request.form.get('full_name'), request.form.get('email'), request.form.get('phone'),
+                                  float(request.form.get('hourly_rate')), request.form.get('passport_number', ''),
+                                  request.form.get('bank_name', ''), request.form.get('bank_account_name', ''),
+                                  request.form.get('bank_account_number', ''), request.form.get('status', 'Active'),
+                                  employee_id))
+        search.store_terms(employee_id)
+        get_db().commit()
+        invalidate_employee(employee_id)
+        flash('Employee updated successfully!', 'success')
+    except Exception as e:
+        get_db().rollback()
+        flash(f'Error updating employee: {str(e)}', 'error')
+    
+    return redirect(url_for('manage_employees'))
+
 @app.route('/admin/employees/delete/<employee_id>', methods=['POST'])
 def delete_employee(employee_id):
     if not session.get('logged_in') or session.get('user_type') != 'admin':
         return redirect(url_for('index'))
     
     try:
-        conn = get_db_connection()
-        if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
-            conn.execute('DELETE FROM employees WHERE employee_id = %s', (employee_id,))
-            conn.execute('DELETE FROM work_entries WHERE employee_id = %s', (employee_id,))
-            conn.execute('DELETE FROM advance_payments WHERE employee_id = %s', (employee_id,))
-            conn.execute('DELETE FROM food_expenses WHERE employee_id = %s', (employee_id,))
-            conn.execute('DELETE FROM attendance_photos WHERE employee_id = %s', (employee_id,))
-            conn.execute('DELETE FROM payment_records WHERE employee_id = %s', (employee_id,))
-        else:
-            conn.execute('DELETE FROM employees WHERE employee_id = ?', (employee_id,))
-            conn.execute('DELETE FROM work_entries WHERE employee_id = ?', (employee_id,))
-            conn.execute('DELETE FROM advance_payments WHERE employee_id = ?', (employee_id,))
-            conn.execute('DELETE FROM food_expenses WHERE employee_id = ?', (employee_id,))
-            conn.execute('DELETE FROM attendance_photos WHERE employee_id = ?', (employee_id,))
-            conn.execute('DELETE FROM payment_records WHERE employee_id = ?', (employee_id,))
-        conn.commit()
-        conn.close()
+        # One transaction: the employee and every row recorded for them
+        archive.delete_employee(employee_id)
+        get_db().commit()
+        invalidate_employee(employee_id)
         flash('Employee deleted successfully!', 'success')
     except Exception as e:
+        get_db().rollback()
         flash(f'Error deleting employee: {str(e)}', 'error')
     
     return redirect(url_for('manage_employees'))
 
+@app.route('/admin/employees/archive/<employee_id>', methods=['POST'])
+def archive_employee(employee_id):
+    """Queue moving a departed employee's history into the archive tables"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    if employee_record(employee_id) is None:
+        flash('Employee not found!', 'error')
+        return redirect(url_for('manage_employees'))
+    job_id = jobs.submit('archive_employee', {'employee_id': employee_id}, submitted_by=session.get('username'))
+    get_db().commit()
+    flash(f'Archiving {employee_id} in the background (job {job_id}).', 'success')
+    return redirect(url_for('manage_employees'))
+
+# ===== EXPORT ROUTES =====
+
+@app.route('/admin/export')
+@db.read_only
+def export_excel():
+    """Stream work entries with pay for ?month=YYYY-MM (full history without it)"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    month = request.args.get('month', '').strip()
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in exports.CONTENT_TYPES:
+        flash('Unsupported export format!', 'error')
+        return redirect(url_for('admin_dashboard'))
+    
+    if month:
+        try:
+            start, end = month_range(month)
+        except ValueError:
+            flash('Invalid month!', 'error')
+            return redirect(url_for('admin_dashboard'))
+    else:
+        start, end = exports.ALL_TIME
+        month = 'all'
+    
+    # Streamed after the view returns; keep reading from the view's connection
+    body = exports.encode(exports.payroll_rows(start, end, conn=get_db()), export_format)
+    
+    # The rows are fetched while the response is being sent
+    response = Response(stream_with_context(body), mimetype=exports.CONTENT_TYPES[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=payroll_{month}.{export_format}'
+    return response
+
+@app.route('/admin/reports')
+@db.read_only
+def reports():
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    selected_month = request.args.get('month') or datetime.now().strftime('%Y-%m')
+    try:
+        month_range(selected_month)
+    except ValueError:
+        flash('Invalid month!', 'error')
+        selected_month = datetime.now().strftime('%Y-%m')
+    
+    # Read from payroll_monthly_summary; the file export goes through the job queue
+    payroll_report = month_payroll(selected_month)
+    # Workforce totals for the year to the selected month, from the report rollup
+    months = rollups.last_periods('month', 12, today=datetime.strptime(selected_month, '%Y-%m').date())
+    trend = rollups.trend('month', months)
+    
+    return render_template('reports.html', payroll_report=payroll_report, selected_month=selected_month, trend=trend)
+
+@app.route('/admin/reports/weekly')
+@db.read_only
+def weekly_report():
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    weeks = rollups.last_periods('week', 4)
+    employee_weeks = [(employee, week) for employee, _, rows in rollups.by_employee('week', weeks) for week in rows]
+    
+    return render_template('weekly_report.html', weekly_data=rollups.trend('week', weeks),
+                           employee_weeks=employee_weeks, weeks=weeks, now=datetime.now())
+
+@app.route('/admin/reports/monthly')
+@db.read_only
+def monthly_report():
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    months = rollups.last_periods('month', 12)
+    
+    return render_template('admin_monthly.html', monthly_data=rollups.trend('month', months),
+                           employee_reports=rollups.by_employee('month', months), months=months, now=datetime.now())
+
+@app.route('/admin/reports/export')
+@db.read_only
+def export_report():
+    """Stream per-employee rollup rows for the last ?periods= weeks or months (?grain=week|month)"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    grain = request.args.get('grain', 'month')
+    export_format = request.args.get('format', 'csv').lower()
+    try:
+        count = int(request.args.get('periods', 12))
+    except ValueError:
+        count = 0
+    if grain not in rollups.GRAINS or export_format not in exports.CONTENT_TYPES or not 0 < count <= 366:
+        flash('Unsupported report export!', 'error')
+        return redirect(url_for('reports'))
+    
+    periods = rollups.last_periods(grain, count)
+    body = exports.encode(exports.rollup_rows(grain, periods[0], periods[-1], conn=get_db()), export_format,
+                          header=exports.ROLLUP_HEADER, sheet='Report')
+    
+    response = Response(stream_with_context(body), mimetype=exports.CONTENT_TYPES[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=report_{grain}_{periods[0]}_{periods[-1]}.{export_format}'
+    return response
+
+# ===== IMPORT ROUTES =====
+
+@app.route('/admin/import/<kind>', methods=['POST'])
+def import_records(kind):
+    """Bulk load work entries, advances or food expenses from a CSV/JSON Lines upload"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return jsonify(success=False, message='Please log in again.'), 401
+    
+    upload = request.files.get('file')
+    if kind not in imports.KINDS:
+        return jsonify(success=False, message=f'Unknown import kind: {kind}'), 404
+    if upload is None or not upload.filename:
+        return jsonify(success=False, message='No file uploaded.'), 400
+    
+    file_format = request.form.get('format') or imports.detect_format(upload.filename)
+    mode = request.form.get('mode', 'insert')
+    if file_format not in imports.READERS or mode not in ('insert', 'upsert'):
+        return jsonify(success=False, message='Unsupported format or mode.'), 400
+    
+    try:
+        report = imports.import_file(kind, upload.stream, file_format, get_db(), upsert=mode == 'upsert')
+    except (ValueError, csv.Error) as e:
+        # Rows committed before the bad line stay; the report below is lost, so say so
+        get_db().rollback()
+        cache.invalidate('payroll_month')
+        return jsonify(success=False, message=f'Import stopped: {str(e)}'), 400
+    
+    cache.invalidate('payroll_month')
+    logger.info('bulk import', extra={'kind': kind, 'mode': mode, 'inserted': report.inserted,
+                                      'updated': report.updated, 'errors': report.error_count})
+    return jsonify(success=report.error_count == 0, **report.as_dict())
+
+# ===== BACKGROUND JOB ROUTES =====
+
+def job_json(row):
+    job = jobs.describe(row)
+    job['status_url'] = url_for('job_status', job_id=row['id'])
+    if row['status'] == 'done' and row['result_path']:
+        job['download_url'] = url_for('job_download', job_id=row['id'])
+    return job
+
+@app.route('/admin/jobs', methods=['POST'])
+def submit_job():
+    """Queue a background job; the response carries the URL to poll"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return jsonify(success=False, message='Please log in again.'), 401
+    
+    params = request.get_json(silent=True) or request.form.to_dict()
+    kind = params.pop('kind', None)
+    try:
+        job_id = jobs.submit(kind, params, submitted_by=session.get('username'))
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+    get_db().commit()
+    
+    return jsonify(success=True, job=job_json(jobs.get(job_id))), 202
+
+@app.route('/admin/jobs/<int:job_id>')
+def job_status(job_id):
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return jsonify(success=False, message='Please log in again.'), 401
+    
+    row = jobs.get(job_id)
+    if row is None:
+        return jsonify(success=False, message='Job not found.'), 404
+    return jsonify(success=True, job=job_json(row))
+
+@app.route('/admin/jobs/<int:job_id>/download')
+def job_download(job_id):
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    row = jobs.get(job_id)
+    if row is None or row['status'] != 'done' or not row['result_path'] or not os.path.exists(row['result_path']):
+        abort(404)
+    return send_file(row['result_path'], mimetype=row['content_type'],
+                     as_attachment=True, download_name=row['result_name'])
+
+# ===== MAINTENANCE COMMANDS =====
+
+@app.cli.command('rebuild-payroll-summary')
+@click.option('--check', is_flag=True, help='Only report drift; leave the summary table untouched.')
+def rebuild_payroll_summary(check):
+    """Recompute payroll_monthly_summary from the raw rows and report drift."""
+    drift = payroll.rebuild_summary(get_db(), check_only=check)
+    if not check:
+        cache.invalidate('payroll_month')
+    for employee_id, month in drift:
+        click.echo(f'drift: {employee_id} {month}')
+    click.echo(f'{len(drift)} summary rows drifted from the raw data'
+               + ('' if check else '; table rebuilt'))
+    if check and drift:
+        raise SystemExit(1)
+
+@app.cli.command('rebuild-report-rollup')
+def rebuild_report_rollup():
+    """Recompute the report rollup for every employee month (after changing the pay multipliers)."""
+    applied = rollups.rebuild(get_db(), progress=click.echo)
+    click.echo(f'{applied} changes applied to the report rollup')
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Recompute every employee's search terms (after changing how search.terms() reads them)."""
+    click.echo(f'{search.ensure(get_db(), rebuild=True)} employees reindexed')
+
+@app.cli.command('ledger-checkpoint')
+def ledger_checkpoint():
+    """Snapshot every running balance that moved since its last checkpoint."""
+    click.echo(f'{payroll.checkpoint_balances(get_db())} balances checkpointed')
+
+@app.cli.command('ledger-balance')
+@click.argument('employee_id')
+@click.option('--at', 'when', help="Balance as the ledger stood at 'YYYY-MM-DD HH:MM:SS' (default: now).")
+def ledger_balance(employee_id, when):
+    """Show an employee's earned, paid and pending amounts from the ledger."""
+    if when:
+        earned, paid = payroll.balance_at(employee_id, when, conn=get_db())
+    else:
+        lifetime = payroll.employee_lifetime_totals(employee_id, conn=get_db())
+        if lifetime is None:
+            raise click.ClickException(f'Employee {employee_id!r} not found')
+        earned, paid = lifetime['total_earnings'], lifetime['total_paid']
+    click.echo(f'earned {earned:.2f}  paid {paid:.2f}  pending {earned - paid:.2f}')
+
+@app.cli.command('sqlite-replica')
+@click.argument('path', type=click.Path(dir_okay=False))
+@click.option('--every', type=float, help='Keep refreshing the copy every this many seconds.')
+def sqlite_replica(path, every):
+    """Copy the SQLite database to PATH, to stand in for a read replica (DATABASE_REPLICA_URLS=sqlite:///PATH)."""
+    if db.backend() != 'sqlite':
+        raise click.ClickException('The primary is not SQLite')
+    while True:
+        target = db.connect_sqlite(path)
+        get_db().backup(target)
+        target.close()
+        click.echo(f'copied {db.SQLITE_PATH} to {path}')
+        if not every:
+            return
+        time.sleep(every)
+
+@app.cli.command('partition-tables')
+@click.option('--chunk-size', default=partitions.PARTITION_COPY_CHUNK, show_default=True,
+              help='Rows copied and committed per transaction.')
+@click.option('--pause', default=partitions.PARTITION_COPY_PAUSE, show_default=True,
+              help='Seconds to wait between transactions.')
+@click.option('--status', is_flag=True, help='Only list the partitions and their row counts.')
+def partition_tables(chunk_size, pause, status):
+    """Move work entries and attendance photos onto monthly partitions (Postgres) or year databases (SQLite)."""
+    if not status:
+        partitions.convert(get_db(), chunk_size, pause, progress=click.echo)
+    for table, parts in partitions.layout(get_db()).items():
+        click.echo(table)
+        for name, rows in parts:
+            click.echo(f'  {name:<40} {rows:>10}')
+
+@app.cli.command('migrate-photos')
+@click.option('--batch-size', default=100, show_default=True, help='Rows converted and committed per batch.')
+def migrate_photos(batch_size):
+    """Move base64 attendance photos from photo_data into the blob store."""
+    moved = photos.migrate_inline_photos(get_db(), batch_size, progress=click.echo)
+    click.echo(f'{moved} photos moved to {photos.PHOTO_STORAGE_DIR}')
+
+@app.cli.command('import-records')
+@click.argument('kind', type=click.Choice(sorted(imports.KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--upsert', is_flag=True, help='Update work entries that already exist for the same employee and date.')
+def import_records_command(kind, path, upsert):
+    """Bulk load a CSV or JSON Lines file into KIND."""
+    with open(path, 'rb') as f:
+        report = imports.import_file(kind, f, imports.detect_format(path), get_db(), upsert=upsert)
+    cache.invalidate('payroll_month')
+    for error in report.errors:
+        click.echo(f"line {error['line']}: {error['error']}")
+    click.echo(f'{report.rows_read} rows read: {report.inserted} inserted, {report.updated} updated, '
+               f'{report.error_count} rejected')
+
 # PRODUCTION FIX: Initialize database in both development and production
 if __name__ == '__main__':
     # Development
@@ -0,0 +1,145 @@
+import os
+import time
+
+import db
+import partitions
+import payroll
+from db import statement, query
+
+# Removing departed employees. delete_employee drops an employee and all of
+# their rows in one transaction; archive_employee moves the rows into the
+# *_archive tables instead, a chunk per transaction with a pause in between
+# so check-ins are not held up behind one long write (it runs as a
+# background job). The hot tables only keep current staff.
+#
+# On Postgres the child tables reference employees ON DELETE CASCADE and
+# every archive table is hash-partitioned on employee_id. Rows in detached
+# months or year databases (partitions.py) go the same way.
+ARCHIVE_CHUNK_SIZE = int(os.environ.get('ARCHIVE_CHUNK_SIZE', 500))
+ARCHIVE_CHUNK_PAUSE = float(os.environ.get('ARCHIVE_CHUNK_PAUSE', 0.2))
+ARCHIVE_PARTITIONS = 8
+
+# Table -> columns copied into its archive (archived_date is added)
+CHILD_TABLES = {
+    'work_entries': ('id', 'employee_id', 'work_date', 'start_time', 'end_time', 'break_minutes',
+                     'normal_hours', 'overtime_hours', 'holiday_hours', 'hourly_rate', 'created_date'),
+    'advance_payments': ('id', 'employee_id', 'amount', 'payment_date', 'reason', 'created_date'),
+    'food_expenses': ('id', 'employee_id', 'amount', 'expense_date', 'description', 'created_date'),
+    'attendance_photos': ('id', 'employee_id', 'work_date', 'photo_type', 'photo_data', 'photo_hash',
+                          'content_type', 'byte_size', 'created_date'),
+    'payment_records': ('id', 'employee_id', 'payment_date', 'amount_paid', 'payment_type', 'description',
+                        'status', 'created_date'),
+}
+EMPLOYEE_COLUMNS = ('id', 'employee_id', 'full_name', 'email', 'phone', 'hourly_rate', 'passport_number',
+                    'bank_name', 'bank_account_name', 'bank_account_number', 'status', 'created_date')
+
+
+def _copy_sql(table, columns, where, source=None, have=None):
+    """Copy ``source`` (default ``table``) rows into the archive; columns missing from ``have`` are NULL"""
+    column_list = ', '.join(columns)
+    select_list = ', '.join(c if have is None or c in have else f'NULL AS {c}' for c in columns)
+    return f'''
+        INSERT INTO {table}_archive ({column_list}, archived_date)
+        SELECT {select_list}, CURRENT_TIMESTAMP FROM {source or table} WHERE {where}
+    '''
+
+
+for _table, _columns in CHILD_TABLES.items():
+    statement(f'archive_chunk_{_table}', f'SELECT id FROM {_table} WHERE employee_id = ? ORDER BY id LIMIT ?')
+    statement(f'copy_to_archive_{_table}', _copy_sql(_table, _columns, 'employee_id = ? AND id <= ?'))
+    statement(f'delete_archived_{_table}', f'DELETE FROM {_table} WHERE employee_id = ? AND id <= ?')
+
+statement('copy_to_archive_employees', _copy_sql('employees', EMPLOYEE_COLUMNS, 'employee_id = ?'))
+
+
+def migration_steps():
+    """Archive tables (and Postgres cascading foreign keys) for migrations.MIGRATIONS"""
+    postgres, sqlite = [], []
+    for table in ('employees', *CHILD_TABLES):
+        postgres.append(f'''
+            CREATE TABLE IF NOT EXISTS {table}_archive (LIKE {table}, archived_date TIMESTAMP)
+            PARTITION BY HASH (employee_id)
+        ''')
+        postgres.extend(f'''
+            CREATE TABLE IF NOT EXISTS {table}_archive_p{i} PARTITION OF {table}_archive
+            FOR VALUES WITH (MODULUS {ARCHIVE_PARTITIONS}, REMAINDER {i})
+        ''' for i in range(ARCHIVE_PARTITIONS))
+        sqlite.append(f'''
+            CREATE TABLE IF NOT EXISTS {table}_archive AS
+            SELECT *, CURRENT_TIMESTAMP AS archived_date FROM {table} WHERE 0
+        ''')
+        index = f'CREATE INDEX IF NOT EXISTS idx_{table}_archive_employee ON {table}_archive (employee_id)'
+        postgres.append(index)
+        sqlite.append(index)
+    # NOT VALID: rows orphaned by older deletes must not block the migration
+    postgres.extend(f'''
+        ALTER TABLE {table} ADD CONSTRAINT fk_{table}_employee FOREIGN KEY (employee_id)
+        REFERENCES employees (employee_id) ON DELETE CASCADE NOT VALID
+    ''' for table in CHILD_TABLES)
+    return {'postgres': postgres, 'sqlite': sqlite}
+
+
+def delete_employee(employee_id, conn=None):
+    """Delete an employee with all of their rows; the caller commits"""
+    conn = conn if conn is not None else db.get_db()
+    if db.backend() != 'postgres':
+        # SQLite tables predate the foreign keys, so cascade by hand
+        for table in CHILD_TABLES:
+            query(f'delete_employee_{table}', (employee_id,), conn=conn)
+        for table in partitions.PARTITIONED_TABLES:
+            for source, _ in partitions.archived_sources(table, conn):
+                db.execute(f'DELETE FROM {source} WHERE employee_id = ?', (employee_id,), conn=conn)
+    payroll.forget_employee(employee_id, conn=conn)
+    query('delete_employee', (employee_id,), conn=conn)
+
+
+def _move_chunk(table, employee_id, chunk_size, conn):
+    """Move up to ``chunk_size`` of the employee's oldest ``table`` rows into the archive"""
+    ids = query(f'archive_chunk_{table}', (employee_id, chunk_size), conn=conn).fetchall()
+    if not ids:
+        return 0
+    bounds = (employee_id, ids[-1]['id'])
+    query(f'copy_to_archive_{table}', bounds, conn=conn)
+    query(f'delete_archived_{table}', bounds, conn=conn)
+    return len(ids)
+
+
+def archive_employee(employee_id, conn, chunk_size=ARCHIVE_CHUNK_SIZE, pause=ARCHIVE_CHUNK_PAUSE, progress=None):
+    """Move an employee and their history into the archive tables; returns the rows moved.
+
+    Each chunk commits on its own, so an interrupted run leaves the rest in
+    the hot tables and can simply be started again.
+    """
+    if query('employee_by_id', (employee_id,), conn=conn).fetchone() is None:
+        raise ValueError(f'Employee {employee_id!r} not found')
+
+    moved = 0
+    for table in CHILD_TABLES:
+        while True:
+            count = _move_chunk(table, employee_id, chunk_size, conn)
+            if not count:
+                break
+            conn.commit()
+            moved += count
+            if progress:
+                progress(f'{moved} rows archived ({table})')
+            time.sleep(pause)
+
+    # Rows written since (a late check-in) go with the employee row itself
+    for table in CHILD_TABLES:
+        while True:
+            count = _move_chunk(table, employee_id, chunk_size, conn)
+            if not count:
+                break
+            moved += count
+    # Closed periods are small per employee and read-only, so they go in one step
+    for table in partitions.PARTITIONED_TABLES:
+        for source, have in partitions.archived_sources(table, conn):
+            moved += db.execute(_copy_sql(table, CHILD_TABLES[table], 'employee_id = ?', source, have),
+                                (employee_id,), conn=conn).rowcount
+    query('copy_to_archive_employees', (employee_id,), conn=conn)
+    delete_employee(employee_id, conn=conn)
+    conn.commit()
+    if progress:
+        progress(f'{moved} rows archived')
+    return moved
@@ -0,0 +1,1016 @@
+"""Query benchmarks against a generated dataset.
+
+    python bench.py dashboard --employees 200 --years 1 2 4 8
+    python bench.py payroll --employees 50 --years 2
+    python bench.py export --employees 200 --years 2
+    python bench.py hours --entries 1000000
+    python bench.py import --entries 100000
+    python bench.py load --employees 200 --years 2 --iterations 200 --save-baseline baseline.json
+    python bench.py load --employees 200 --years 2 --iterations 200 --baseline baseline.json
+    SESSION_STORE=cookie python bench.py load --employees 200 --iterations 200   # session cost before
+    python bench.py writes --writers 1 4 16 --checkins 200
+    SQLITE_JOURNAL_MODE=DELETE SQLITE_WRITE_BATCH=0 python bench.py writes   # without WAL and the write queue
+    python bench.py reports --employees 200 --years 2
+    python bench.py search --employees 5000 --queries 2000
+    python bench.py upgrade --employees 2000
+
+Runs against a throwaway SQLite file unless --database-url or --sqlite-path
+is given.
+"""
+import argparse
+import csv
+import http.cookiejar
+import json
+import os
+import platform
+import re
+import threading
+import uuid
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from io import BytesIO, StringIO
+from urllib import error, parse, request
+
+
+def setup(args):
+    """Point the app at the benchmark database and import it (creates the schema)"""
+    data_dir = tempfile.mkdtemp(prefix='ems-bench-')
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        # Never benchmark against whatever DATABASE_URL the shell happens to carry
+        os.environ.pop('DATABASE_URL', None)
+        os.environ['SQLITE_PATH'] = args.sqlite_path or os.path.join(data_dir, 'bench.db')
+    # Photos and job results stay out of the working copy too
+    os.environ.setdefault('PHOTO_STORAGE_DIR', os.path.join(data_dir, 'photo_store'))
+    os.environ.setdefault('JOB_RESULTS_DIR', os.path.join(data_dir, 'job_results'))
+    import app  # noqa: F401  (init_db runs on import)
+    import db
+    return db
+
+
+def insert_many(db, conn, sql, rows):
+    conn.cursor().executemany(db.dialect().render(sql), rows)
+
+
+def generate_employees(db, conn, count):
+    employee_ids = [f'EMP{i:05d}' for i in range(count)]
+    insert_many(db, conn, '''
+        INSERT INTO employees (employee_id, full_name, email, phone, hourly_rate, status)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(emp, f'Worker {emp}', f'{emp.lower()}@example.com', '0100000000',
+           9.0 + (i % 7), 'Active' if i % 10 else 'Inactive') for i, emp in enumerate(employee_ids)])
+    conn.commit()
+    return employee_ids
+
+
+def generate_history(db, conn, employee_ids, start, end, rng):
+    """Weekday work entries, weekly food, monthly advances and salary payments in [start, end)"""
+    work, advances, food, payments = [], [], [], []
+    day = start
+    while day < end:
+        iso = day.isoformat()
+        if day.weekday() < 5:
+            for emp in employee_ids:
+                end_hour = rng.choice((17, 18, 19, 20))
+                work.append((emp, iso, '08:00', f'{end_hour}:00', 60,
+                             8.0, float(end_hour - 17), 0.0))
+        if day.weekday() == 4:
+            food.extend((emp, round(rng.uniform(5, 25), 2), iso, 'Canteen') for emp in employee_ids)
+        if day.day == 15:
+            advances.extend((emp, 50.0, iso, 'Advance') for emp in employee_ids)
+        if day.day == 28:
+            payments.extend((emp, iso, round(rng.uniform(800, 1500), 2), 'salary') for emp in employee_ids)
+        day += timedelta(days=1)
+
+    insert_many(db, conn, '''
+        INSERT INTO work_entries (employee_id, work_date, start_time, end_time, break_minutes,
+                                  normal_hours, overtime_hours, holiday_hours)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', work)
+    insert_many(db, conn, 'INSERT INTO food_expenses (employee_id, amount, expense_date, description) VALUES (?, ?, ?, ?)', food)
+    insert_many(db, conn, 'INSERT INTO advance_payments (employee_id, amount, payment_date, reason) VALUES (?, ?, ?, ?)', advances)
+    insert_many(db, conn, 'INSERT INTO payment_records (employee_id, payment_date, amount_paid, payment_type) VALUES (?, ?, ?, ?)', payments)
+    conn.commit()
+    # Bulk inserts bypass the per-write summary refresh; recompute it once
+    import payroll
+    payroll.rebuild_summary(conn)
+    return len(work) + len(food) + len(advances) + len(payments)
+
+
+def timed(fn, repeat):
+    fn()  # warm the statement cache and page cache
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def bench_dashboard(args):
+    """Monthly dashboard query latency as years of history pile up behind the current month"""
+    db = setup(args)
+    import payroll
+    conn = db.get_pool().getconn()
+    rng = random.Random(args.seed)
+
+    employee_ids = generate_employees(db, conn, args.employees)
+    current_month = datetime.now().strftime('%Y-%m')
+    month_start, month_end = db.month_range(current_month)
+    sample = employee_ids[len(employee_ids) // 2]
+
+    cases = {
+        'admin payroll_month': lambda: payroll.month_totals(current_month, conn=conn),
+        'employee month entries': lambda: db.query('employee_month_work_entries', (sample, month_start, month_end), conn=conn).fetchall(),
+        'employee payroll_month': lambda: payroll.employee_month_totals(sample, current_month, conn=conn),
+    }
+
+    # The current month is generated once; each step adds older history behind it
+    history_end = date.fromisoformat(month_start)
+    rows = generate_history(db, conn, employee_ids, history_end, date.fromisoformat(month_end), rng)
+    print(f"{'years':>5} {'rows':>10}  " + '  '.join(f'{name:>24}' for name in cases))
+    for years in sorted(args.years):
+        history_start = history_end.replace(year=date.fromisoformat(month_start).year - years)
+        rows += generate_history(db, conn, employee_ids, history_start, history_end, rng)
+        history_end = history_start
+        results = [timed(fn, args.repeat) for fn in cases.values()]
+        print(f'{years:>5} {rows:>10}  ' + '  '.join(f'{ms:>21.2f} ms' for ms in results))
+
+    db.get_pool().putconn(conn)
+
+
+# The pre-CTE payroll query: joins every child row before SUM (kept for comparison)
+LEGACY_PAYROLL_MONTH = '''
+    SELECT e.employee_id, e.full_name, e.hourly_rate,
+           COALESCE(SUM(w.normal_hours), 0) as total_normal_hours,
+           COALESCE(SUM(w.overtime_hours), 0) as total_overtime_hours,
+           COALESCE(SUM(w.holiday_hours), 0) as total_holiday_hours,
+           COALESCE(SUM(a.amount), 0) as total_advances,
+           COALESCE(SUM(f.amount), 0) as total_food_expenses
+    FROM employees e
+    LEFT JOIN work_entries w ON e.employee_id = w.employee_id AND w.work_date >= ? AND w.work_date < ?
+    LEFT JOIN advance_payments a ON e.employee_id = a.employee_id AND a.payment_date >= ? AND a.payment_date < ?
+    LEFT JOIN food_expenses f ON e.employee_id = f.employee_id AND f.expense_date >= ? AND f.expense_date < ?
+    GROUP BY e.employee_id, e.full_name, e.hourly_rate
+'''
+
+
+def expected_totals(db, conn, month):
+    """Per-employee month and lifetime totals summed in Python from the raw rows"""
+    start, end = db.month_range(month)
+    month_rows, lifetime = {}, {}
+    for emp, rate in conn.execute('SELECT employee_id, hourly_rate FROM employees').fetchall():
+        month_rows[emp] = [0.0] * 5
+        lifetime[emp] = [0.0, 0.0, rate]
+    for emp, day, normal, overtime, holiday in conn.execute(
+            'SELECT employee_id, work_date, normal_hours, overtime_hours, holiday_hours FROM work_entries').fetchall():
+        lifetime[emp][0] += normal + overtime + holiday
+        if start <= str(day) < end:
+            month_rows[emp][0] += normal
+            month_rows[emp][1] += overtime
+            month_rows[emp][2] += holiday
+    for column, table, date_column in ((3, 'advance_payments', 'payment_date'), (4, 'food_expenses', 'expense_date')):
+        for emp, day, amount in conn.execute(f'SELECT employee_id, {date_column}, amount FROM {table}').fetchall():
+            if start <= str(day) < end:
+                month_rows[emp][column] += amount
+    for emp, amount in conn.execute('SELECT employee_id, amount_paid FROM payment_records').fetchall():
+        lifetime[emp][1] += amount
+    return month_rows, {emp: (hours * rate, paid) for emp, (hours, paid, rate) in lifetime.items()}
+
+
+def bench_payroll(args):
+    """Check the payroll aggregates against raw rows, then time them against the fan-out join"""
+    db = setup(args)
+    import payroll
+    conn = db.get_pool().getconn()
+    rng = random.Random(args.seed)
+
+    employee_ids = generate_employees(db, conn, args.employees)
+    month_start, month_end = db.month_range(datetime.now().strftime('%Y-%m'))
+    first = date.fromisoformat(month_start)
+    rows = generate_history(db, conn, employee_ids, first.replace(year=first.year - args.years),
+                            date.fromisoformat(month_end), rng)
+    print(f'{args.employees} employees, {rows} rows')
+
+    # Correctness: every employee, month and lifetime, must match the raw data
+    month = month_start[:7]
+    expected_month, expected_lifetime = expected_totals(db, conn, month)
+    columns = ('total_normal_hours', 'total_overtime_hours', 'total_holiday_hours',
+               'total_advances', 'total_food_expenses')
+    mismatches = []
+    for row in payroll.month_totals(month, conn=conn):
+        got = [row[c] for c in columns]
+        if any(abs(a - b) > 1e-6 for a, b in zip(got, expected_month[row['employee_id']])):
+            mismatches.append(('month', row['employee_id'], got, expected_month[row['employee_id']]))
+    for row in payroll.lifetime_totals(conn=conn):
+        got = (row['total_earnings'], row['total_paid'])
+        if any(abs(a - b) > 1e-6 for a, b in zip(got, expected_lifetime[row['employee_id']])):
+            mismatches.append(('lifetime', row['employee_id'], got, expected_lifetime[row['employee_id']]))
+    sample = employee_ids[0]
+    single = payroll.employee_month_totals(sample, month, conn=conn)
+    if any(abs(single[c] - e) > 1e-6 for c, e in zip(columns, expected_month[sample])):
+        mismatches.append(('employee month', sample, [single[c] for c in columns], expected_month[sample]))
+    single = payroll.employee_lifetime_totals(sample, conn=conn)
+    if any(abs(a - b) > 1e-6 for a, b in zip((single['total_earnings'], single['total_paid']), expected_lifetime[sample])):
+        mismatches.append(('employee lifetime', sample, tuple(single), expected_lifetime[sample]))
+
+    # Incremental maintenance: random writes followed by refresh_summary must leave no drift
+    entries = conn.execute('SELECT id, employee_id, work_date FROM work_entries').fetchall()
+    for entry_id, emp, day in rng.sample(entries, min(200, len(entries))):
+        db.query('delete_work_entry', (entry_id,), conn=conn)
+        payroll.refresh_summary(emp, day, conn=conn)
+    for emp in rng.sample(employee_ids, min(20, len(employee_ids))):
+        day = (first - timedelta(days=rng.randrange(365 * args.years))).isoformat()
+        db.query('insert_advance_payment', (emp, 10.0, day, 'bench'), conn=conn)
+        db.query('insert_payment', (emp, day, 25.0, 'bonus', 'bench'), conn=conn)
+        payroll.refresh_summary(emp, day, conn=conn)
+    conn.commit()
+    drift = payroll.rebuild_summary(conn, check_only=True)
+    mismatches.extend(('summary drift', emp, month, None) for emp, month in drift)
+
+    legacy_sql = db.dialect().render(LEGACY_PAYROLL_MONTH)
+    cases = {
+        'legacy fan-out payroll_month': lambda: conn.execute(legacy_sql, (month_start, month_end) * 3).fetchall(),
+        'payroll.month_totals': lambda: payroll.month_totals(month, conn=conn),
+        'payroll.lifetime_totals': lambda: payroll.lifetime_totals(conn=conn),
+        'payroll.employee_month_totals': lambda: payroll.employee_month_totals(sample, month, conn=conn),
+        'payroll.employee_lifetime_totals': lambda: payroll.employee_lifetime_totals(sample, conn=conn),
+    }
+    for name, fn in cases.items():
+        print(f'{name:>34}  {timed(fn, args.repeat):8.2f} ms')
+
+    db.get_pool().putconn(conn)
+    if mismatches:
+        for mismatch in mismatches[:10]:
+            print('MISMATCH', *mismatch)
+        raise SystemExit(f'{len(mismatches)} payroll totals disagree with the raw data')
+    print('payroll totals match the raw data')
+
+
+# A 12-month workforce trend aggregated from the raw rows on every view (what the rollup replaces)
+RAW_MONTH_TREND = '''
+    SELECT month, SUM(entries), SUM(normal_hours), SUM(overtime_hours), SUM(holiday_hours),
+           SUM(normal_pay), SUM(overtime_pay), SUM(holiday_pay), SUM(advances), SUM(food_expenses), SUM(amount_paid)
+    FROM (
+        SELECT {month(work_date)} AS month, 1 AS entries, normal_hours, overtime_hours, holiday_hours,
+               normal_hours * hourly_rate AS normal_pay, overtime_hours * hourly_rate * ? AS overtime_pay,
+               holiday_hours * hourly_rate * ? AS holiday_pay, 0 AS advances, 0 AS food_expenses, 0 AS amount_paid
+        FROM {history(work_entries)} WHERE work_date >= ? AND work_date < ?
+        UNION ALL
+        SELECT {month(payment_date)}, 0, 0, 0, 0, 0, 0, 0, amount, 0, 0
+        FROM advance_payments WHERE payment_date >= ? AND payment_date < ?
+        UNION ALL
+        SELECT {month(expense_date)}, 0, 0, 0, 0, 0, 0, 0, 0, amount, 0
+        FROM food_expenses WHERE expense_date >= ? AND expense_date < ?
+        UNION ALL
+        SELECT {month(payment_date)}, 0, 0, 0, 0, 0, 0, 0, 0, 0, amount_paid
+        FROM payment_records WHERE payment_date >= ? AND payment_date < ?
+    ) source
+    GROUP BY month
+    ORDER BY month
+'''
+
+
+def bench_reports(args):
+    """Check the report rollup against the raw rows, then time the 12-month trend from each"""
+    db = setup(args)
+    import payroll
+    import payroll_engine
+    import rollups
+    conn = db.get_pool().getconn()
+    rng = random.Random(args.seed)
+
+    employee_ids = generate_employees(db, conn, args.employees)
+    month_start, month_end = db.month_range(datetime.now().strftime('%Y-%m'))
+    first = date.fromisoformat(month_start)
+    rows = generate_history(db, conn, employee_ids, first.replace(year=first.year - args.years),
+                            date.fromisoformat(month_end), rng)
+    start = time.perf_counter()
+    rollups.rebuild(conn)
+    print(f'{args.employees} employees, {rows} rows, rollup built in {time.perf_counter() - start:.2f} s')
+
+    months = rollups.last_periods('month', 12)
+    bounds = (db.month_range(months[0])[0], month_end)
+    raw_sql = db.dialect().render(RAW_MONTH_TREND)
+    raw_params = (payroll_engine.RULES.overtime_multiplier, payroll_engine.RULES.holiday_multiplier) + bounds * 4
+
+    def check(stage):
+        expected = {row[0]: row[1:] for row in conn.execute(raw_sql, raw_params).fetchall()}
+        found = {row['period']: tuple(row[c] for c in rollups.TOTAL_COLUMNS)
+                 for row in db.query('report_rollup_series', ('month', rollups.ALL, months[0], months[-1]), conn=conn)}
+        return [(stage, month, found.get(month), expected.get(month)) for month in months
+                if any(abs((a or 0) - (b or 0)) > 1e-6
+                       for a, b in zip(found.get(month, (0,) * 10), expected.get(month, (0,) * 10)))]
+
+    mismatches = check('rebuild')
+    # Incremental: random deletes and payments, logged by refresh_summary and applied by refresh()
+    entries = conn.execute('SELECT id, employee_id, work_date FROM work_entries WHERE work_date >= ?',
+                           (bounds[0],)).fetchall()
+    for entry_id, emp, day in rng.sample(entries, min(200, len(entries))):
+        db.query('delete_work_entry', (entry_id,), conn=conn)
+        payroll.refresh_summary(emp, day, conn=conn)
+    for emp in rng.sample(employee_ids, min(20, len(employee_ids))):
+        day = (first - timedelta(days=rng.randrange(300))).isoformat()
+        db.query('insert_advance_payment', (emp, 10.0, day, 'bench'), conn=conn)
+        db.query('insert_payment', (emp, day, 25.0, 'bonus', 'bench'), conn=conn)
+        payroll.refresh_summary(emp, day, conn=conn)
+    conn.commit()
+    start = time.perf_counter()
+    applied = rollups.refresh(conn)
+    print(f'{applied} logged changes applied in {(time.perf_counter() - start) * 1000:.1f} ms')
+    mismatches += check('incremental')
+
+    cases = {
+        'raw 12-month trend': lambda: conn.execute(raw_sql, raw_params).fetchall(),
+        'rollups.trend month x 12': lambda: rollups.trend('month', months, conn=conn),
+        'rollups.trend week x 52': lambda: rollups.trend('week', rollups.last_periods('week', 52), conn=conn),
+        'rollups.by_employee month x 12': lambda: rollups.by_employee('month', months, conn=conn),
+    }
+    for name, fn in cases.items():
+        print(f'{name:>34}  {timed(fn, args.repeat):8.2f} ms')
+
+    db.get_pool().putconn(conn)
+    if mismatches:
+        for mismatch in mismatches[:10]:
+            print('MISMATCH', *mismatch)
+        raise SystemExit(f'{len(mismatches)} rollup months disagree with the raw data')
+    print('report rollup matches the raw data')
+
+
+def bench_export(args):
+    """Time to first byte, total time and peak memory of the streamed full-history export"""
+    db = setup(args)
+    import exports
+    from app import app
+    conn = db.get_pool().getconn()
+    rng = random.Random(args.seed)
+
+    employee_ids = generate_employees(db, conn, args.employees)
+    today = date.today()
+    rows = generate_history(db, conn, employee_ids, today.replace(year=today.year - args.years), today, rng)
+    db.get_pool().putconn(conn)
+    print(f'{args.employees} employees, {rows} rows')
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+        session['user_type'] = 'admin'
+
+    print(f"{'format':>6} {'first byte':>12} {'total':>12} {'size':>10} {'peak memory':>12}")
+    for export_format in ('csv', 'xlsx'):
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = client.get(f'/admin/export?format={export_format}', buffered=False)
+        chunks = iter(response.response)
+        size = len(next(chunks))
+        first_byte = time.perf_counter() - start
+        for chunk in chunks:
+            size += len(chunk)
+        total = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        response.close()
+        print(f'{export_format:>6} {first_byte * 1000:>9.1f} ms {total * 1000:>9.1f} ms '
+              f'{size / 2 ** 20:>7.1f} MB {peak / 2 ** 20:>9.1f} MB')
+
+    # What building the export in memory would have cost
+    conn = db.get_pool().getconn()
+    tracemalloc.start()
+    start = time.perf_counter()
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(exports.HEADER)
+    for batch in exports.payroll_rows(*exports.ALL_TIME, conn=conn):
+        writer.writerows(batch)
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    db.get_pool().putconn(conn)
+    print(f"{'in-memory csv':>19} {total * 1000:>9.1f} ms {len(buffer.getvalue()) / 2 ** 20:>7.1f} MB "
+          f"{peak / 2 ** 20:>9.1f} MB")
+
+
+def legacy_calculate_hours(start_time, end_time, break_minutes=60, is_holiday=False):
+    """The per-row strptime version of app.calculate_hours (kept for comparison)"""
+    start = datetime.strptime(start_time, '%H:%M')
+    end = datetime.strptime(end_time, '%H:%M')
+    total_hours = ((end - start).total_seconds() / 60 - break_minutes) / 60
+    if is_holiday:
+        return 0, 0, total_hours
+    return min(total_hours, 8), max(total_hours - 8, 0), 0
+
+
+def bench_hours(args):
+    """Batch payroll engine against per-row strptime over synthetic entries"""
+    import payroll_engine
+    rng = random.Random(args.seed)
+    starts, ends, breaks, holidays, rates = [], [], [], [], []
+    for _ in range(args.entries):
+        start = rng.randrange(5 * 60, 10 * 60, 5)
+        end = start + rng.randrange(6 * 60, 13 * 60, 5)
+        starts.append(f'{start // 60:02d}:{start % 60:02d}')
+        ends.append(f'{end // 60:02d}:{end % 60:02d}')
+        breaks.append(rng.choice((30, 45, 60)))
+        holidays.append(rng.random() < 0.05)
+        rates.append(9.0 + rng.randrange(7))
+    print(f'{args.entries} entries, numpy {"available" if payroll_engine.NUMPY_AVAILABLE else "not installed"}')
+
+    def legacy():
+        return [legacy_calculate_hours(*entry) for entry in zip(starts, ends, breaks, holidays)]
+
+    def engine():
+        hours = payroll_engine.compute_hours(starts, ends, breaks, holidays)
+        payroll_engine.compute_pay(hours['normal_hours'], hours['overtime_hours'], hours['holiday_hours'], rates)
+        return hours
+
+    def engine_without_numpy():
+        available = payroll_engine.NUMPY_AVAILABLE
+        payroll_engine.NUMPY_AVAILABLE = False
+        try:
+            return engine()
+        finally:
+            payroll_engine.NUMPY_AVAILABLE = available
+
+    # No overnight shifts are generated, so all three must agree exactly
+    expected = legacy()
+    for name, fn in (('engine', engine), ('engine without numpy', engine_without_numpy)):
+        hours = fn()
+        got = list(zip(hours['normal_hours'], hours['overtime_hours'], hours['holiday_hours']))
+        bad = sum(1 for a, b in zip(got, expected) if any(abs(x - y) > 1e-9 for x, y in zip(a, b)))
+        if bad:
+            raise SystemExit(f'{name}: {bad} entries disagree with calculate_hours')
+
+    cases = {
+        'per-row strptime': legacy,
+        'engine, plain python': engine_without_numpy,
+        'engine': engine,
+    }
+    for name, fn in cases.items():
+        print(f'{name:>22}  {timed(fn, args.repeat):10.1f} ms')
+
+
+def bench_import(args):
+    """Bulk import of a generated work entry CSV, then the same file again as an upsert"""
+    db = setup(args)
+    import imports
+    conn = db.get_pool().getconn()
+    rng = random.Random(args.seed)
+
+    employee_ids = generate_employees(db, conn, args.employees)
+    days_needed = -(-args.entries // len(employee_ids))
+    first_day = date.today() - timedelta(days=days_needed)
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('employee_id', 'work_date', 'start_time', 'end_time', 'break_minutes', 'is_holiday'))
+    for i in range(args.entries):
+        start = rng.randrange(5 * 60, 10 * 60, 5)
+        end = start + rng.randrange(6 * 60, 13 * 60, 5)
+        writer.writerow((employee_ids[i % len(employee_ids)], (first_day + timedelta(days=i // len(employee_ids))).isoformat(),
+                         f'{start // 60:02d}:{start % 60:02d}', f'{end // 60 % 24:02d}:{end % 60:02d}',
+                         rng.choice((30, 45, 60)), 'yes' if rng.random() < 0.05 else ''))
+    data = buffer.getvalue().encode()
+    print(f'{args.entries} entries, {len(data) / 2 ** 20:.1f} MB of CSV')
+
+    for mode in ('insert', 'upsert'):
+        start = time.perf_counter()
+        report = imports.import_file('work_entries', BytesIO(data), 'csv', conn, upsert=mode == 'upsert')
+        total = time.perf_counter() - start
+        print(f'{mode:>7}  {total * 1000:10.1f} ms  {args.entries / total:10.0f} rows/s  '
+              f'inserted {report.inserted}, updated {report.updated}, rejected {report.error_count}')
+    db.get_pool().putconn(conn)
+
+
+def make_photo(rng, size=(320, 240)):
+    """A JPEG selfie stand-in; noise compresses about as badly as a real photo"""
+    import photos
+    if not photos.PIL_AVAILABLE:
+        return rng.randbytes(40000)
+    from PIL import Image
+    buffer = BytesIO()
+    Image.frombytes('RGB', size, rng.randbytes(size[0] * size[1] * 3)).save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def generate_photos(db, conn, employee_ids, days, rng, variants=32):
+    """Check-in and check-out photos for the last ``days`` weekdays (a pool of distinct images)"""
+    import photos
+    images = [make_photo(rng) for _ in range(variants)]
+    count = 0
+    for back in range(1, days + 1):
+        day = date.today() - timedelta(days=back)
+        if day.weekday() >= 5:
+            continue
+        for emp in employee_ids:
+            for photo_type in ('check_in', 'check_out'):
+                photos.save_photo(emp, day.isoformat(), photo_type, rng.choice(images), 'image/jpeg', conn=conn)
+                count += 1
+        conn.commit()
+    return count
+
+
+class NoRedirect(request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def multipart(fields):
+    """multipart/form-data body and content type; bytes values are sent as JPEG files"""
+    boundary = uuid.uuid4().hex
+    body = BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\n'.encode())
+        if isinstance(value, bytes):
+            body.write(f'Content-Disposition: form-data; name="{name}"; filename="{name}.jpg"\r\n'
+                       'Content-Type: image/jpeg\r\n\r\n'.encode())
+            body.write(value)
+        else:
+            body.write(f'Content-Disposition: form-data; name="{name}"\r\n\r\n{value}'.encode())
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+class TestClientDriver:
+    """Requests through Flask's test client, in this process"""
+
+    def __init__(self):
+        import app
+        self.client = app.app.test_client()
+
+    def request(self, method, path, data=None):
+        if data is not None:
+            # bytes values are file uploads
+            data = {key: (BytesIO(value), key, 'image/jpeg') if isinstance(value, bytes) else value
+                    for key, value in data.items()}
+        response = self.client.open(path, method=method, data=data)
+        body = response.get_data()
+        return response.status_code, body
+
+
+class HttpDriver:
+    """Requests over HTTP to a running server, keeping its session cookie"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = request.build_opener(request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect)
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if data is not None and any(isinstance(value, bytes) for value in data.values()):
+            body, headers['Content-Type'] = multipart(data)
+        elif data is not None:
+            body = parse.urlencode(data).encode()
+        try:
+            with self.opener.open(request.Request(self.base_url + path, data=body, headers=headers,
+                                                  method=method)) as response:
+                return response.status, response.read()
+        except error.HTTPError as e:
+            # Redirects (login) land here too, as NoRedirect declines to follow them
+            return e.code, e.read()
+
+
+def scenario(employee_id, photo):
+    """One admin and one employee session over the hot routes; yields (route, method, path, data)"""
+    yield 'login', 'POST', '/login', {'user_type': 'admin', 'username': 'admin', 'password': 'admin'}
+    yield 'admin_dashboard', 'GET', '/admin', None
+    yield 'admin_payments', 'GET', '/admin/payments', None
+    yield 'make_payment', 'GET', f'/admin/make_payment/{employee_id}', None
+    yield 'login', 'POST', '/login', {'user_type': 'employee', 'username': employee_id}
+    yield 'employee_dashboard', 'GET', '/employee', None
+    yield 'check_in_with_photo', 'POST', '/employee/check_in_with_photo', {'photo': photo}
+
+
+def run_load(make_driver, employee_ids, photo, iterations, concurrency):
+    """Run ``iterations`` scenarios over ``concurrency`` threads; returns (samples, errors, seconds)"""
+    samples = {}  # route -> [ms]
+    errors = []
+    lock = threading.Lock()
+    work = iter(range(iterations))
+
+    def worker():
+        driver = make_driver()
+        while True:
+            with lock:
+                i = next(work, None)
+            if i is None:
+                return
+            for route, method, path, data in scenario(employee_ids[i % len(employee_ids)], photo):
+                start = time.perf_counter()
+                status, body = driver.request(method, path, data)
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    samples.setdefault(route, []).append(elapsed)
+                    if status >= 400:
+                        errors.append(f'{method} {path}: {status}')
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors, time.perf_counter() - start
+
+
+QUERY_SAMPLE = re.compile(r'^ems_http_request_db_queries_(sum|count)\{endpoint="([^"]*)"\} (\S+)$', re.M)
+SESSION_SAMPLE = re.compile(r'^ems_session_(cookie_bytes|load_seconds)_(sum|count)\{store="([^"]*)"\} (\S+)$', re.M)
+
+
+def query_totals(driver):
+    """(queries, requests) per endpoint from the server's /admin/metrics"""
+    status, body = driver.request('GET', '/admin/metrics')
+    if status != 200:
+        return {}
+    totals = {}
+    for kind, endpoint, value in QUERY_SAMPLE.findall(body.decode()):
+        totals.setdefault(endpoint, [0.0, 0.0])[kind == 'count'] = float(value)
+    return totals
+
+
+def session_totals(driver):
+    """(sum, count) of the session cookie size and load time, and the store that served them"""
+    status, body = driver.request('GET', '/admin/metrics')
+    totals = {}
+    if status != 200:
+        return totals
+    for metric, kind, store, value in SESSION_SAMPLE.findall(body.decode()):
+        totals.setdefault(metric, [0.0, 0.0])[kind == 'count'] += float(value)
+        totals['store'] = store
+    return totals
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+def compare(results, baseline, tolerance):
+    """Routes whose p50 grew beyond ``tolerance`` or that now run more queries"""
+    regressions = []
+    for route, now in results['routes'].items():
+        before = baseline['routes'].get(route)
+        if before is None:
+            continue
+        if now['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+            regressions.append(f"{route}: p50 {before['p50_ms']:.2f} -> {now['p50_ms']:.2f} ms")
+        # Cache hits make the average wobble a little; an N+1 adds whole queries
+        if now['queries'] is not None and before['queries'] is not None and now['queries'] > before['queries'] + 0.5:
+            regressions.append(f"{route}: {before['queries']:.1f} -> {now['queries']:.1f} queries per request")
+    return regressions
+
+
+def bench_load(args):
+    """Login, dashboards, payments and photo check-ins through the real routes: p50/p99, throughput, memory"""
+    db = setup(args)
+    rng = random.Random(args.seed)
+    make_driver = (lambda: HttpDriver(args.url)) if args.url else TestClientDriver
+
+    if not args.no_generate:
+        conn = db.get_pool().getconn()
+        employee_ids = generate_employees(db, conn, args.employees)
+        today = date.today()
+        # History stops yesterday, so the scenario's check-ins are real inserts
+        rows = generate_history(db, conn, employee_ids, today.replace(year=today.year - args.years), today, rng)
+        rows += generate_photos(db, conn, employee_ids, args.photo_days, rng)
+        db.get_pool().putconn(conn)
+        print(f'{args.employees} employees, {args.years} years: {rows} rows')
+    # generate_employees marks every tenth employee Inactive, and they cannot log in
+    active = [f'EMP{i:05d}' for i in range(args.employees) if i % 10]
+    if args.iterations > len(active):
+        print(f'note: {args.iterations} iterations over {len(active)} active employees; '
+              'repeat check-ins take the "already checked in" path')
+    photo = make_photo(rng)
+
+    admin = make_driver()
+    admin.request('POST', '/login', {'user_type': 'admin', 'username': 'admin', 'password': 'admin'})
+    queries_before = query_totals(admin)
+    sessions_before = session_totals(admin)
+    tracemalloc.start()
+    samples, errors, seconds = run_load(make_driver, active, photo, args.iterations, args.concurrency)
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    queries_after = query_totals(admin)
+    sessions_after = session_totals(admin)
+
+    results = {
+        'meta': {'backend': db.backend(), 'mode': 'http' if args.url else 'test-client', 'employees': args.employees,
+                 'years': args.years, 'iterations': args.iterations, 'concurrency': args.concurrency,
+                 'python': platform.python_version(), 'at': datetime.now().isoformat(timespec='seconds')},
+        'routes': {},
+        'requests_per_second': round(sum(map(len, samples.values())) / seconds, 1),
+        # The server's memory when --url is given is not visible from here
+        'peak_traced_mb': round(peak_traced / 2 ** 20, 1),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    print(f"{'route':>20} {'n':>6} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'queries':>8}")
+    for route, route_samples in samples.items():
+        queries = None
+        if route in queries_after:
+            before = queries_before.get(route, [0.0, 0.0])
+            done = queries_after[route][1] - before[1]
+            queries = round((queries_after[route][0] - before[0]) / done, 2) if done else None
+        results['routes'][route] = {
+            'count': len(route_samples),
+            'p50_ms': round(statistics.median(route_samples), 2),
+            'p99_ms': round(percentile(route_samples, 0.99), 2),
+            'mean_ms': round(statistics.fmean(route_samples), 2),
+            'queries': queries,
+        }
+        row = results['routes'][route]
+        print(f"{route:>20} {row['count']:>6} {row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['mean_ms']:>9.2f} "
+              f"{'-' if queries is None else f'{queries:.1f}':>8}")
+    if 'store' in sessions_after:
+        # Mean over the requests of this run: the cookie the browser sent and the time to load its session
+        session_means = {}
+        for metric in ('cookie_bytes', 'load_seconds'):
+            total, count = sessions_after.get(metric, [0.0, 0.0])
+            before = sessions_before.get(metric, [0.0, 0.0])
+            count -= before[1]
+            session_means[metric] = (total - before[0]) / count if count else None
+        results['session'] = {
+            'store': sessions_after['store'],
+            'cookie_bytes': None if session_means['cookie_bytes'] is None else round(session_means['cookie_bytes'], 1),
+            'load_ms': None if session_means['load_seconds'] is None else round(session_means['load_seconds'] * 1000, 3),
+        }
+        print(f"session store {results['session']['store']}: cookie {results['session']['cookie_bytes']} bytes, "
+              f"load {results['session']['load_ms']} ms per request")
+    print(f"{results['requests_per_second']} requests/s, peak traced {results['peak_traced_mb']} MB, "
+          f"peak RSS {results['peak_rss_mb']} MB")
+    if errors:
+        print(f'{len(errors)} failed requests, e.g. {errors[0]}')
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'baseline saved to {args.save_baseline}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            raise SystemExit(1)
+        print(f'no regressions against {args.baseline}')
+
+
+def bench_writes(args):
+    """Check-in/check-out throughput with N concurrent writers through the real routes"""
+    db = setup(args)
+    rng = random.Random(args.seed)
+    make_driver = (lambda: HttpDriver(args.url)) if args.url else TestClientDriver
+    conn = db.get_pool().getconn()
+    # Every check-in needs an employee who has not checked in today; every tenth one is Inactive
+    employee_ids = generate_employees(db, conn, args.checkins * 10 // 9 + 10)
+    active = [emp for i, emp in enumerate(employee_ids) if i % 10][:args.checkins]
+    photo = make_photo(rng)
+    admin = make_driver()
+    admin.request('POST', '/login', {'user_type': 'admin', 'username': 'admin', 'password': 'admin'})
+    print(f"backend {db.backend()}, journal_mode {conn.execute('PRAGMA journal_mode').fetchone()[0]}"
+          if db.backend() == 'sqlite' else f'backend {db.backend()}')
+    print(f"{'writers':>8} {'requests':>9} {'per s':>8} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7} {'batch':>6}")
+
+    for writers in args.writers:
+        # Each round starts from an empty day
+        conn.execute("DELETE FROM attendance_uploads WHERE work_date = ?", (date.today().isoformat(),))
+        conn.execute("DELETE FROM work_entries WHERE work_date = ?", (date.today().isoformat(),))
+        conn.commit()
+        before = json.loads(admin.request('GET', '/debug_db/writes')[1] or b'{}')
+        samples, errors = [], []
+        lock = threading.Lock()
+        work = iter(active)
+
+        def writer():
+            driver = make_driver()
+            while True:
+                with lock:
+                    employee_id = next(work, None)
+                if employee_id is None:
+                    return
+                driver.request('POST', '/login', {'user_type': 'employee', 'username': employee_id})
+                for path in ('/employee/check_in_with_photo', '/employee/check_out_with_photo'):
+                    start = time.perf_counter()
+                    status, body = driver.request('POST', path, {'photo': photo})
+                    elapsed = (time.perf_counter() - start) * 1000
+                    with lock:
+                        samples.append(elapsed)
+                        if status != 202:
+                            errors.append(f'{path}: {status} {body[:80]!r}')
+
+        threads = [threading.Thread(target=writer) for _ in range(writers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+        after = json.loads(admin.request('GET', '/debug_db/writes')[1] or b'{}')
+        batches = after.get('batches', 0) - before.get('batches', 0)
+        batch = f"{(after['writes'] - before['writes']) / batches:.1f}" if batches else '-'
+        print(f'{writers:>8} {len(samples):>9} {len(samples) / seconds:>8.1f} {statistics.median(samples):>9.2f} '
+              f'{percentile(samples, 0.99):>9.2f} {len(errors):>7} {batch:>6}')
+        if errors:
+            print(f'    e.g. {errors[0]}')
+    db.get_pool().putconn(conn)
+
+
+FIRST_NAMES = ('Ahmad', 'Siti', 'Muhammad', 'Nur', 'Raj', 'Priya', 'Wei', 'Mei', 'John', 'Maria', 'Ali', 'Fatimah',
+               'Kumar', 'Lakshmi', 'Chen', 'Ling', 'David', 'Sarah', 'Hassan', 'Aisyah')
+LAST_NAMES = ('Abdullah', 'Tan', 'Lim', 'Wong', 'Singh', 'Kaur', 'Ibrahim', 'Rahman', 'Lee', 'Ng', 'Smith', 'Garcia',
+              'Pillai', 'Nair', 'Hussain', 'Ong', 'Chong', 'Yusof', 'Ismail', 'Teo')
+
+
+def bench_search(args):
+    """Employee type-ahead latency from the in-process index and from the database index"""
+    db = setup(args)
+    import search
+    conn = db.get_pool().getconn()
+    rng = random.Random(args.seed)
+
+    employee_ids = generate_employees(db, conn, args.employees)
+    people = {}
+    for emp in employee_ids:
+        people[emp] = (f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                       f'01{rng.randrange(10)}-{rng.randrange(1000):03d} {rng.randrange(10000):04d}',
+                       f'{rng.choice("ABHK")}{rng.randrange(10 ** 7):07d}',
+                       ' '.join(f'{rng.randrange(10000):04d}' for _ in range(3)))
+    insert_many(db, conn, '''
+        UPDATE employees SET full_name = ?, phone = ?, passport_number = ?, bank_account_number = ? WHERE employee_id = ?
+    ''', [values + (emp,) for emp, values in people.items()])
+    start = time.perf_counter()
+    search.ensure(conn, rebuild=True)
+    print(f'{args.employees} employees, search terms written in {time.perf_counter() - start:.2f} s')
+
+    # What the front desk types: the first few letters of a name, an ID, a phone or account number
+    queries = []
+    for _ in range(args.queries):
+        emp = rng.choice(employee_ids)
+        name, phone, passport, account = people[emp]
+        source = rng.choice((name.split()[0], name.split()[-1], name, emp, phone.replace('-', '').replace(' ', ''),
+                             passport, account.split()[0]))
+        queries.append(source[:rng.randint(1, min(len(source), 6))])
+
+    mismatches = []
+    print(f"{'index':>10} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    answers = {}
+    for mode in ('memory', 'database'):
+        search.SEARCH_INDEX = mode
+        search.search(queries[0], conn=conn)  # loads the in-process index
+        samples, results = [], []
+        for text in queries:
+            started = time.perf_counter()
+            results.append(search.search(text, conn=conn))
+            samples.append((time.perf_counter() - started) * 1000)
+        answers[mode] = results
+        print(f'{mode:>10} {statistics.median(samples):>9.3f} {percentile(samples, 0.99):>9.3f} {max(samples):>9.3f}')
+    for text, memory, database in zip(queries, answers['memory'], answers['database']):
+        if [r['employee_id'] for r in memory] != [r['employee_id'] for r in database]:
+            mismatches.append((text, [r['employee_id'] for r in memory], [r['employee_id'] for r in database]))
+
+    db.get_pool().putconn(conn)
+    if mismatches:
+        for mismatch in mismatches[:10]:
+            print('MISMATCH', *mismatch)
+        raise SystemExit(f'{len(mismatches)} queries answered differently by the two indexes')
+    print('both indexes return the same employees')
+
+
+# What migration 13 adds, dropped again to stand for a database from before them
+PRE_SEARCH_SQL = {
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS employee_search_insert',
+        'DROP TRIGGER IF EXISTS employee_search_delete',
+        'DROP TRIGGER IF EXISTS employee_search_update',
+        'DROP TABLE IF EXISTS employee_search',
+    ],
+    'postgres': [],
+}
+
+
+def bench_upgrade(args):
+    """Boot the app on a database whose employees predate the search index, then find every one of them"""
+    db = setup(args)
+    import app
+    import search
+    conn = db.get_pool().getconn()
+
+    for sql in PRE_SEARCH_SQL[db.backend()] + [
+            'DROP INDEX IF EXISTS idx_employees_lower_id',
+            'ALTER TABLE employees DROP COLUMN search_terms',
+            'DELETE FROM schema_migrations WHERE version >= 13']:
+        db.execute(sql, conn=conn)
+    conn.commit()
+    employee_ids = generate_employees(db, conn, args.employees)
+
+    start = time.perf_counter()
+    app.init_db()
+    print(f'{args.employees} employees, upgraded and indexed in {time.perf_counter() - start:.2f} s')
+
+    mismatches = []
+    if db.backend() == 'sqlite':
+        try:
+            db.execute("INSERT INTO employee_search (employee_search) VALUES ('integrity-check')", conn=conn)
+        except Exception as exc:
+            mismatches.append(('integrity-check', None, str(exc)))
+    for mode in ('memory', 'database'):
+        search.SEARCH_INDEX = mode
+        for emp in employee_ids:
+            found = [r['employee_id'] for r in search.search(emp, conn=conn)]
+            if found[:1] != [emp]:
+                mismatches.append((mode, emp, found))
+
+    db.get_pool().putconn(conn)
+    if mismatches:
+        for mismatch in mismatches[:10]:
+            print('MISMATCH', *mismatch)
+        raise SystemExit(f'{len(mismatches)} employees not found after the upgrade')
+    print('every employee is found after the upgrade')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='benchmark a (disposable!) Postgres database instead of SQLite')
+    parser.add_argument('--sqlite-path', help='use this SQLite file (e.g. the one a local gunicorn serves) instead of a throwaway one')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    dashboard = commands.add_parser('dashboard', help=bench_dashboard.__doc__)
+    dashboard.add_argument('--employees', type=int, default=200)
+    dashboard.add_argument('--years', type=int, nargs='+', default=[1, 2, 4])
+    dashboard.set_defaults(func=bench_dashboard)
+
+    payroll = commands.add_parser('payroll', help=bench_payroll.__doc__)
+    payroll.add_argument('--employees', type=int, default=50)
+    payroll.add_argument('--years', type=int, default=2)
+    payroll.set_defaults(func=bench_payroll)
+
+    reports = commands.add_parser('reports', help=bench_reports.__doc__)
+    reports.add_argument('--employees', type=int, default=200)
+    reports.add_argument('--years', type=int, default=2)
+    reports.set_defaults(func=bench_reports)
+
+    employee_search = commands.add_parser('search', help=bench_search.__doc__)
+    employee_search.add_argument('--employees', type=int, default=5000)
+    employee_search.add_argument('--queries', type=int, default=2000)
+    employee_search.set_defaults(func=bench_search)
+
+    upgrade = commands.add_parser('upgrade', help=bench_upgrade.__doc__)
+    upgrade.add_argument('--employees', type=int, default=2000)
+    upgrade.set_defaults(func=bench_upgrade)
+
+    export = commands.add_parser('export', help=bench_export.__doc__)
+    export.add_argument('--employees', type=int, default=200)
+    export.add_argument('--years', type=int, default=2)
+    export.set_defaults(func=bench_export)
+
+    hours = commands.add_parser('hours', help=bench_hours.__doc__)
+    hours.add_argument('--entries', type=int, default=1000000)
+    hours.set_defaults(func=bench_hours)
+
+    bulk_import = commands.add_parser('import', help=bench_import.__doc__)
+    bulk_import.add_argument('--employees', type=int, default=200)
+    bulk_import.add_argument('--entries', type=int, default=100000)
+    bulk_import.set_defaults(func=bench_import)
+
+    load = commands.add_parser('load', help=bench_load.__doc__)
+    load.add_argument('--employees', type=int, default=200)
+    load.add_argument('--years', type=int, default=1)
+    load.add_argument('--photo-days', type=int, default=10, help='days of check-in photos to generate')
+    load.add_argument('--iterations', type=int, default=100, help='scenarios (7 requests each) to run')
+    load.add_argument('--concurrency', type=int, default=1)
+    load.add_argument('--url', help='drive a running server (e.g. a local gunicorn) instead of the test client')
+    load.add_argument('--no-generate', action='store_true', help='reuse the data already in the database')
+    load.add_argument('--save-baseline', metavar='FILE')
+    load.add_argument('--baseline', metavar='FILE', help='fail on regressions against this saved run')
+    load.add_argument('--tolerance', type=float, default=0.25, help='allowed p50 growth (0.25 = 25%%)')
+    load.set_defaults(func=bench_load)
+
+    writes = commands.add_parser('writes', help=bench_writes.__doc__)
+    writes.add_argument('--writers', type=int, nargs='+', default=[1, 4, 16])
+    writes.add_argument('--checkins', type=int, default=200, help='employees checking in and out per round')
+    writes.add_argument('--url', help='drive a running server (with --sqlite-path pointing at its database)')
+    writes.set_defaults(func=bench_writes)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
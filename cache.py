@@ -0,0 +1,235 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from logs import get_logger
+
+# Redis import with fallback: without it every worker keeps its own cache
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+# Read-through cache for hot lookups (employee records, headcounts, the
+# current month's payroll rows). Values are grouped in namespaces; writes
+# invalidate a single key or bump the namespace generation, which orphans
+# every key cached under the old one.
+#
+# CACHE_URL picks the backend: unset for an in-process LRU per gunicorn
+# worker, redis://... to share one cache between workers, 'none' to turn
+# caching off. With the in-process backend another worker's write only
+# reaches this worker after CACHE_DEFAULT_TTL, so keep that short.
+CACHE_URL = os.environ.get('CACHE_URL', '')
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+CACHE_DEFAULT_TTL = float(os.environ.get('CACHE_DEFAULT_TTL', 60))
+
+MISSING = object()
+
+logger = get_logger('cache')
+
+
+class LocalBackend:
+    """Thread-safe in-process LRU with per-entry expiry"""
+
+    name = 'local'
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def generation(self, namespace):
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            # Entries of the old generation can never be read again
+            prefix = f'{namespace}:'
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'evictions': self.evictions, 'expirations': self.expirations}
+
+
+class RedisBackend:
+    """Shared cache in Redis; expiry and eviction are left to the server"""
+
+    name = 'redis'
+
+    def __init__(self, url, prefix='ems:'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        return MISSING if data is None else pickle.loads(data)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value), px=int(ttl * 1000))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def generation(self, namespace):
+        return int(self.client.get(f'{self.prefix}generation:{namespace}') or 0)
+
+    def bump(self, namespace):
+        self.client.incr(f'{self.prefix}generation:{namespace}')
+
+    def stats(self):
+        return {'entries': self.client.dbsize()}
+
+
+class NullBackend:
+    """Caching disabled: every lookup is a miss"""
+
+    name = 'none'
+
+    def get(self, key):
+        return MISSING
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def generation(self, namespace):
+        return 0
+
+    def bump(self, namespace):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class ReadThroughCache:
+    """Namespaced read-through cache with hit/miss counters per namespace.
+
+    Cached values are shared between requests: store plain dicts/tuples
+    and treat what comes back as read-only.
+    """
+
+    def __init__(self, backend, default_ttl=CACHE_DEFAULT_TTL):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self._counters = {}  # namespace -> {'hits': n, 'misses': n, ...}
+        self._lock = threading.Lock()
+
+    def _count(self, namespace, counter):
+        with self._lock:
+            counters = self._counters.setdefault(namespace, {'hits': 0, 'misses': 0, 'invalidations': 0, 'errors': 0})
+            counters[counter] += 1
+
+    def _key(self, namespace, key):
+        return f'{namespace}:{self.backend.generation(namespace)}:{key}'
+
+    def fetch(self, namespace, key, loader, ttl=None):
+        """Return the cached value for (namespace, key), calling ``loader()`` on a miss"""
+        try:
+            full_key = self._key(namespace, key)
+            value = self.backend.get(full_key)
+        except Exception as e:
+            # A cache outage must not take the page down with it
+            logger.warning('cache read failed', extra={'namespace': namespace, 'error': str(e)})
+            self._count(namespace, 'errors')
+            return loader()
+        if value is not MISSING:
+            self._count(namespace, 'hits')
+            return value
+
+        self._count(namespace, 'misses')
+        value = loader()
+        try:
+            self.backend.set(full_key, value, ttl or self.default_ttl)
+        except Exception as e:
+            logger.warning('cache write failed', extra={'namespace': namespace, 'error': str(e)})
+            self._count(namespace, 'errors')
+        return value
+
+    def generation(self, namespace):
+        """The namespace's current generation, for state kept outside the cache (0 when unreachable)"""
+        try:
+            return self.backend.generation(namespace)
+        except Exception as e:
+            logger.warning('cache read failed', extra={'namespace': namespace, 'error': str(e)})
+            self._count(namespace, 'errors')
+            return 0
+
+    def invalidate(self, namespace, key=MISSING):
+        """Forget one key, or the whole namespace when no key is given.
+
+        Call after the write has been committed, or a concurrent reader
+        can cache the old rows again.
+        """
+        self._count(namespace, 'invalidations')
+        try:
+            if key is MISSING:
+                self.backend.bump(namespace)
+            else:
+                self.backend.delete(self._key(namespace, key))
+        except Exception as e:
+            logger.warning('cache invalidation failed', extra={'namespace': namespace, 'error': str(e)})
+            self._count(namespace, 'errors')
+
+    def stats(self):
+        with self._lock:
+            namespaces = {name: dict(counters) for name, counters in self._counters.items()}
+        for counters in namespaces.values():
+            lookups = counters['hits'] + counters['misses']
+            counters['hit_ratio'] = round(counters['hits'] / lookups, 3) if lookups else None
+        try:
+            backend_stats = self.backend.stats()
+        except Exception as e:
+            backend_stats = {'error': str(e)}
+        return {'backend': self.backend.name, 'default_ttl': self.default_ttl,
+                'namespaces': namespaces, **backend_stats}
+
+
+def create_backend(url=CACHE_URL):
+    if url == 'none':
+        return NullBackend()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        if REDIS_AVAILABLE:
+            return RedisBackend(url)
+        logger.warning('redis is not installed, using the in-process cache')
+    return LocalBackend()
+
+
+cache = ReadThroughCache(create_backend())
@@ -0,0 +1,931 @@
+import contextvars
+import functools
+import itertools
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import date
+from urllib.parse import urlsplit
+
+from flask import g, has_request_context, request
+
+import metrics
+from logs import get_logger
+
+logger = get_logger('db')
+
+# PostgreSQL import with fallback
+try:
+    import psycopg
+    POSTGRES_AVAILABLE = True
+except ImportError:
+    POSTGRES_AVAILABLE = False
+
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'employees.db')
+
+# SQLite settings. In WAL mode readers (dashboards, the other gunicorn
+# workers) carry on while one connection writes, and a commit only syncs
+# the log: with synchronous=NORMAL a power cut can lose the last
+# transactions but never corrupts the file. Writers queue on the lock for
+# up to SQLITE_BUSY_TIMEOUT ms instead of failing with "database is locked".
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 10000))
+# Page cache per connection in KiB, and how much of the file to map
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', 16384))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 2 ** 20))
+# Writes handed to db.write() are applied by one thread per process, up to
+# this many per transaction; 0 applies them on the caller's connection
+SQLITE_WRITE_BATCH = int(os.environ.get('SQLITE_WRITE_BATCH', 64))
+
+# Read replicas of the primary, comma separated: postgresql:// URLs, or
+# sqlite:///path/to/copy.db standing in for one locally (see `flask
+# sqlite-replica`). Views marked db.read_only read from them in turn,
+# skipping any that lags more than REPLICA_MAX_LAG seconds or cannot be
+# reached, and fall back to the primary when none is left. After a write
+# (any request other than GET/HEAD) the browser reads from the primary for
+# REPLICA_STICKY_SECONDS, so the page it is redirected to shows the write.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 5))
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+PRIMARY_COOKIE = 'read_primary'
+
+# Pool settings (per gunicorn worker)
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 5))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 300))
+POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', 30))
+
+
+READS = metrics.register(metrics.Counter(
+    'ems_db_read_only_requests_total', 'Read-only views by the database they read from', ('target',)))
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be borrowed within the pool timeout"""
+
+
+class _PoolStats:
+    def __init__(self):
+        self.checked_out = 0
+        self.checkouts = 0
+        self.connections_opened = 0
+        self.connection_errors = 0
+        self.health_check_failures = 0
+        self.evicted = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record_wait(self, waited):
+        self.checkouts += 1
+        self.checked_out += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+    def as_dict(self):
+        stats = dict(vars(self))
+        stats['wait_time_avg'] = self.wait_time_total / self.checkouts if self.checkouts else 0.0
+        return stats
+
+
+class ConnectionPool:
+    """Bounded pool of connections shared by the threads of one worker process.
+
+    Idle connections are health checked before reuse once they have sat
+    unused for ``check_after`` seconds and closed after ``max_idle`` seconds.
+    """
+
+    def __init__(self, connect, backend, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                 max_idle=POOL_MAX_IDLE, check_after=POOL_CHECK_AFTER):
+        self.backend = backend
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self._connect = connect
+        self._idle = deque()  # (connection, returned_at), most recently used on the right
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = _PoolStats()
+
+    def _open(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._stats.connection_errors += 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats.connections_opened += 1
+        return conn
+
+    def _evict_idle(self, now):
+        # Oldest connections sit on the left; stop at the first one still fresh
+        while self._idle and now - self._idle[0][1] > self.max_idle:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._stats.evicted += 1
+            _close_quietly(conn)
+
+    def _healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def warm(self, count=1):
+        """Open ``count`` connections up front; raises if the database is unreachable"""
+        for _ in range(count):
+            conn = self.getconn()
+            self.putconn(conn)
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = None
+        returned_at = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout('Connection pool is closed')
+                self._evict_idle(time.monotonic())
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats.timeouts += 1
+                    raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                self._cond.wait(remaining)
+
+        if conn is None:
+            conn = self._open()
+        elif time.monotonic() - returned_at > self.check_after and not self._healthy(conn):
+            _close_quietly(conn)
+            with self._cond:
+                self._stats.health_check_failures += 1
+            conn = self._open()
+
+        with self._cond:
+            self._stats.record_wait(time.monotonic() - start)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard:
+            try:
+                conn.rollback()  # never hand out a connection mid-transaction
+            except Exception:
+                discard = True
+        with self._cond:
+            self._stats.checked_out -= 1
+            if discard or self._closed:
+                self._size -= 1
+                _close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                _close_quietly(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = self._stats.as_dict()
+            stats.update(backend=self.backend, size=self._size, idle=len(self._idle),
+                         max_size=self.max_size)
+        return stats
+
+
+class ThreadLocalPool:
+    """One SQLite connection per thread, reused across requests on that thread.
+
+    Connections left behind by threads that have exited are closed on the
+    next checkout.
+    """
+
+    def __init__(self, connect, backend='sqlite'):
+        self.backend = backend
+        self._connect = connect
+        self._local = threading.local()
+        self._owners = {}  # thread -> connection
+        self._lock = threading.Lock()
+        self._stats = _PoolStats()
+
+    def _evict_dead_threads(self):
+        for thread in [t for t in self._owners if not t.is_alive()]:
+            _close_quietly(self._owners.pop(thread))
+            self._stats.evicted += 1
+
+    def warm(self, count=1):
+        self.putconn(self.getconn())
+
+    def getconn(self):
+        start = time.monotonic()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._stats.connection_errors += 1
+                raise
+            self._local.conn = conn
+            with self._lock:
+                self._evict_dead_threads()
+                self._owners[threading.current_thread()] = conn
+                self._stats.connections_opened += 1
+        _run_checkout_hooks(conn)
+        with self._lock:
+            self._stats.record_wait(time.monotonic() - start)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self._lock:
+            self._stats.checked_out -= 1
+            if discard:
+                self._owners.pop(threading.current_thread(), None)
+                self._local.conn = None
+                _close_quietly(conn)
+
+    def close(self):
+        with self._lock:
+            for conn in self._owners.values():
+                _close_quietly(conn)
+            self._owners.clear()
+        self._local = threading.local()
+
+    def stats(self):
+        with self._lock:
+            stats = self._stats.as_dict()
+            stats.update(backend=self.backend, size=len(self._owners), idle=None, max_size=None)
+        return stats
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class PgRow(tuple):
+    """Postgres row readable by position or column name, like sqlite3.Row"""
+
+    def __new__(cls, values, index):
+        row = super().__new__(cls, values)
+        row._index = index
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self._index)
+
+
+def pg_row_factory(cursor):
+    index = {col.name: i for i, col in enumerate(cursor.description or ())}
+    return lambda values: PgRow(values, index)
+
+
+def connect_postgres(database_url):
+    return psycopg.connect(database_url, row_factory=pg_row_factory)
+
+
+class SQLiteConnection(sqlite3.Connection):
+    """sqlite3 connection that checkout hooks can keep their own state on"""
+
+    layout = None
+
+
+# fn(conn) run on every SQLite connection as it is checked out of a pool
+# and before each write-queue batch, outside any transaction
+SQLITE_CHECKOUT_HOOKS = []
+
+
+def on_sqlite_checkout(fn):
+    SQLITE_CHECKOUT_HOOKS.append(fn)
+    return fn
+
+
+def _run_checkout_hooks(conn):
+    for hook in SQLITE_CHECKOUT_HOOKS:
+        hook(conn)
+
+
+def connect_sqlite(path=None, read_only=False):
+    # Each connection is only ever used by the thread that opened it, but it
+    # may be closed from another thread once that thread has exited
+    conn = sqlite3.connect(path or SQLITE_PATH, timeout=SQLITE_BUSY_TIMEOUT / 1000, check_same_thread=False,
+                           cached_statements=256, factory=SQLiteConnection)
+    conn.row_factory = sqlite3.Row
+    # journal_mode is stored in the database file; the others are per connection
+    conn.execute(f'PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}')
+    conn.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}')
+    conn.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_SIZE}')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+    if read_only:
+        conn.execute('PRAGMA query_only = ON')
+    return conn
+
+
+# ===== READ REPLICAS =====
+
+# Zero on a server that is not replaying WAL (a primary standing in for a
+# replica) or that has replayed everything it received
+POSTGRES_REPLICA_LAG_SQL = '''
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+'''
+
+
+def _last_modified(path):
+    return max((os.path.getmtime(p) for p in (path, path + '-wal') if os.path.exists(p)), default=0.0)
+
+
+class Replica:
+    """One read replica: its pool and its lag, measured at most every REPLICA_CHECK_INTERVAL seconds"""
+
+    def __init__(self, url):
+        if url.startswith('sqlite:///'):
+            self.backend = 'sqlite'
+            self.path = url[len('sqlite:///'):]
+            self.name = self.path
+            self.pool = ThreadLocalPool(lambda: connect_sqlite(self.path, read_only=True))
+        else:
+            parts = urlsplit(url)
+            self.backend = 'postgres'
+            self.name = f'{parts.hostname}:{parts.port or 5432}{parts.path}'
+            self.pool = ConnectionPool(lambda: connect_postgres(url), 'postgres')
+        self.lag = None  # seconds; None until measured or while unreachable
+        self.reachable = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _measure(self):
+        if self.backend == 'sqlite':
+            # A copy is as far behind as the primary's last change after its own
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(self.path)
+            return max(0.0, _last_modified(SQLITE_PATH) - _last_modified(self.path))
+        conn = self.pool.getconn()
+        try:
+            return float(conn.execute(POSTGRES_REPLICA_LAG_SQL).fetchone()[0] or 0)
+        finally:
+            self.pool.putconn(conn)
+
+    def usable(self):
+        with self._lock:
+            due = time.monotonic() - self._checked_at >= REPLICA_CHECK_INTERVAL
+            if due:
+                self._checked_at = time.monotonic()
+        if due:
+            was_usable = self.status()['usable']
+            try:
+                self.lag = self._measure()
+                self.reachable = True
+            except Exception as e:
+                self.lag = None
+                self.reachable = False
+                error = str(e)
+            # Log when a replica drops out of rotation or comes back, not on every check
+            if was_usable and not self.status()['usable']:
+                logger.warning('replica out of rotation, reading from the primary',
+                               extra={'replica': self.name, 'lag': self.lag,
+                                      'error': None if self.reachable else error})
+            elif self.status()['usable'] and not was_usable:
+                logger.info('replica in rotation', extra={'replica': self.name, 'lag': round(self.lag, 3)})
+        return self.status()['usable']
+
+    def status(self):
+        return {'name': self.name, 'backend': self.backend, 'reachable': self.reachable, 'lag': self.lag,
+                'usable': self.reachable is True and self.lag <= REPLICA_MAX_LAG}
+
+
+def _create_replicas(backend):
+    replicas = []
+    for url in DATABASE_REPLICA_URLS:
+        replica = Replica(url)
+        if replica.backend != backend:
+            # Statements are rendered for the primary's dialect
+            logger.error('replica backend differs from the primary, ignoring it',
+                         extra={'replica': replica.name, 'backend': backend})
+            continue
+        replicas.append(replica)
+    return replicas
+
+
+# ===== SQL DIALECTS =====
+
+_MACRO = re.compile(r'\{(\w+)(?:\(([^)]*)\))?\}')
+
+
+class Dialect:
+    """Renders backend-neutral SQL for one backend.
+
+    Statements are written with ``?`` placeholders and ``{macro}`` /
+    ``{macro(arg)}`` fields for the few spots where the backends disagree.
+    """
+
+    def __init__(self, name, placeholder, macros):
+        self.name = name
+        self.placeholder = placeholder
+        self.macros = macros
+
+    def render(self, sql):
+        if self.placeholder != '?':
+            sql = sql.replace('%', '%%').replace('?', self.placeholder)
+        return _MACRO.sub(lambda m: self._expand(m.group(1), m.group(2)), sql)
+
+    def _expand(self, macro, arg):
+        value = self.macros[macro]
+        return value(arg.strip()) if arg is not None else value
+
+
+POSTGRES = Dialect('postgres', '%s', {
+    'pk': 'SERIAL PRIMARY KEY',
+    'timestamp': 'TIMESTAMP',
+    'month': lambda col: f"to_char({col}, 'YYYY-MM')",
+    'day': lambda col: f"to_char({col}, 'YYYY-MM-DD')",
+    'returning_id': 'RETURNING id',
+    'date': 'DATE',
+    'history': lambda table: f'{table}_history',  # see partitions.py
+})
+
+SQLITE = Dialect('sqlite', '?', {
+    'pk': 'INTEGER PRIMARY KEY AUTOINCREMENT',
+    'timestamp': 'TEXT',
+    'month': lambda col: f"substr({col}, 1, 7)",
+    'day': lambda col: f"substr({col}, 1, 10)",
+    'returning_id': '',  # cursor.lastrowid instead
+    'date': 'TEXT',  # ISO 'YYYY-MM-DD'
+    'history': lambda table: f'{table}_history',  # temporary view, see partitions.py
+})
+
+DIALECTS = {'postgres': POSTGRES, 'sqlite': SQLITE}
+
+
+_pool = None
+_pool_pid = None
+_read_pool = None
+_replicas = None
+_replica_turn = itertools.count()
+_write_queue = None
+_pool_lock = threading.Lock()
+
+
+def _create_pool():
+    database_url = os.environ.get('DATABASE_URL')
+    if database_url and POSTGRES_AVAILABLE:
+        pool = ConnectionPool(lambda: connect_postgres(database_url), 'postgres')
+        try:
+            pool.warm()
+            return pool
+        except Exception as e:
+            pool.close()
+            logger.error('PostgreSQL connection failed, falling back to SQLite', extra={'error': str(e)})
+    elif database_url:
+        logger.error('DATABASE_URL is set but psycopg is not installed, using SQLite')
+    return ThreadLocalPool(connect_sqlite)
+
+
+def get_pool():
+    """Return this process's pool, creating it after a fork if needed"""
+    global _pool, _pool_pid, _read_pool, _replicas, _write_queue
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = _create_pool()
+                _read_pool = None
+                _replicas = None
+                _write_queue = None
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def replicas():
+    """This process's replicas of the primary (empty without DATABASE_REPLICA_URLS)"""
+    global _replicas
+    pool = get_pool()
+    with _pool_lock:
+        if _replicas is None:
+            _replicas = _create_replicas(pool.backend)
+        return _replicas
+
+
+def read_target():
+    """(name, pool) for a read-only view: the next replica that keeps up, else the primary.
+
+    On SQLite the primary is read through query_only connections.
+    """
+    global _read_pool
+    pool = get_pool()
+    available = replicas()
+    if available and not (has_request_context() and request.cookies.get(PRIMARY_COOKIE)):
+        turn = next(_replica_turn)
+        for i in range(len(available)):
+            replica = available[(turn + i) % len(available)]
+            if replica.usable():
+                return replica.name, replica.pool
+    if pool.backend != 'sqlite':
+        return 'primary', pool
+    with _pool_lock:
+        if _read_pool is None:
+            _read_pool = ThreadLocalPool(lambda: connect_sqlite(read_only=True))
+        return 'primary', _read_pool
+
+
+def backend():
+    """Name of the backend this process resolved at startup"""
+    return get_pool().backend
+
+
+def dialect():
+    return DIALECTS[backend()]
+
+
+def get_db():
+    """Borrow a connection for the current app context; returned on teardown"""
+    if g.get('read_only'):
+        if 'read_db' not in g:
+            target, g.read_pool = read_target()
+            g.read_db = g.read_pool.getconn()
+            READS.inc(target)
+        return g.read_db
+    return primary_db()
+
+
+def primary_db():
+    """The app context's connection to the primary, also inside a read-only view"""
+    if 'db' not in g:
+        g.db = get_pool().getconn()
+    return g.db
+
+
+def close_db(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().putconn(conn)
+    conn = g.pop('read_db', None)
+    if conn is not None:
+        g.pop('read_pool').putconn(conn)
+
+
+def read_only(view):
+    """Decorator: the view's queries go to a replica, or a read-only connection to the primary.
+
+    Only the view itself; the session is still loaded and saved on the
+    primary around it. A response streamed after the view returns must be
+    handed the view's connection (get_db()) to keep reading from it.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.read_only = False
+    return wrapper
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+
+    @app.after_request
+    def read_own_writes(response):
+        if DATABASE_REPLICA_URLS and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 500:
+            response.set_cookie(PRIMARY_COOKIE, '1', max_age=REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+
+# ===== SERIALISED WRITES =====
+
+class _QueuedWrite:
+    def __init__(self, fn):
+        self.fn = fn
+        # Runs in the caller's context, so its queries count towards the caller's request
+        self.context = contextvars.copy_context()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class WriteQueue:
+    """One writer thread per process applying queued writes to SQLite.
+
+    Whatever queued up while the previous transaction committed goes into
+    the next one (up to ``max_batch``), each write in its own savepoint so a
+    failing write only undoes itself. The writers of different processes
+    still take turns on the database lock, but each process holds it once
+    per batch instead of once per request.
+    """
+
+    def __init__(self, max_batch=SQLITE_WRITE_BATCH):
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._stats = {'writes': 0, 'batches': 0, 'failed_writes': 0, 'failed_batches': 0}
+
+    def submit(self, fn):
+        with self._lock:
+            if not self._started:
+                threading.Thread(target=self._run, name='sqlite-writer', daemon=True).start()
+                self._started = True
+        write = _QueuedWrite(fn)
+        self._queue.put(write)
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def _run(self):
+        conn = connect_sqlite()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._apply(conn, batch)
+            for write in batch:
+                write.done.set()
+
+    def _apply(self, conn, batch):
+        failed = 0
+        try:
+            _run_checkout_hooks(conn)
+            # Take the write lock up front; a deferred transaction that
+            # upgrades from reading fails at once instead of waiting
+            conn.execute('BEGIN IMMEDIATE')
+            for write in batch:
+                conn.execute('SAVEPOINT queued_write')
+                try:
+                    write.result = write.context.run(write.fn, conn)
+                    conn.execute('RELEASE queued_write')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO queued_write')
+                    conn.execute('RELEASE queued_write')
+                    write.error = e
+                    failed += 1
+            conn.commit()
+        except Exception as e:
+            # Lock wait timed out or the commit failed: nothing in the batch was written
+            logger.error('queued write batch failed', extra={'writes': len(batch), 'error': str(e)})
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            for write in batch:
+                write.error = write.error or e
+            failed = len(batch)
+            with self._lock:
+                self._stats['failed_batches'] += 1
+        with self._lock:
+            self._stats['writes'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['failed_writes'] += failed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queued'] = self._queue.qsize()
+            stats['avg_batch'] = stats['writes'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+
+def get_write_queue():
+    """This process's writer, or None when writes are applied in place (Postgres, SQLITE_WRITE_BATCH=0)"""
+    global _write_queue
+    pool = get_pool()
+    if pool.backend != 'sqlite' or SQLITE_WRITE_BATCH <= 0:
+        return None
+    with _pool_lock:
+        if _write_queue is None:
+            _write_queue = WriteQueue()
+        return _write_queue
+
+
+def write(fn):
+    """Run ``fn(conn)`` in a committed transaction and return its result.
+
+    On SQLite the write queue runs it on the writer's connection, grouped
+    with other small writes; elsewhere it runs on the request's connection,
+    which is committed (or rolled back if ``fn`` raises). ``fn`` must do
+    all its database work through ``conn``, and the caller must not hold an
+    uncommitted write of its own or the writer waits for it.
+    """
+    writer = get_write_queue()
+    if writer is not None:
+        return writer.submit(fn)
+    conn = primary_db()
+    try:
+        result = fn(conn)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return result
+
+
+def month_range(month):
+    """Half-open [first day, first day of next month) bounds for a 'YYYY-MM' month.
+
+    Comparing the raw date column against these bounds lets both backends
+    use the (employee_id, date) indexes instead of scanning every row.
+    """
+    year, mon = (int(part) for part in month.split('-'))
+    start = date(year, mon, 1)
+    end = date(year + mon // 12, mon % 12 + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+
+# ===== NAMED STATEMENTS =====
+
+class Statement:
+    def __init__(self, name, sql, prepare=False):
+        self.name = name
+        self.sql = sql
+        self.prepare = prepare
+        self._rendered = {}
+
+    def render(self, dialect):
+        sql = self._rendered.get(dialect.name)
+        if sql is None:
+            sql = self._rendered[dialect.name] = dialect.render(self.sql)
+        return sql
+
+
+STATEMENTS = {}
+
+
+def statement(name, sql, prepare=False):
+    """Register a named statement; ``prepare`` asks Postgres for a server-side plan"""
+    if name in STATEMENTS:
+        raise ValueError(f'Statement {name!r} is already registered')
+    STATEMENTS[name] = Statement(name, sql, prepare)
+    return name
+
+
+class TimedCursor:
+    """Cursor wrapper that reports execute and fetch time to metrics.
+
+    Time is charged to the statement as rows are fetched (SQLite steps
+    lazily), and a statement is logged as slow once its total crosses
+    metrics.SLOW_QUERY_SECONDS.
+    """
+
+    def __init__(self, cursor, name, sql, elapsed):
+        self._cursor = cursor
+        self._name = name
+        self._sql = sql
+        self._elapsed = elapsed
+        self._slow = False
+        metrics.record_query(name, sql, elapsed)
+        self._check_slow()
+
+    def _check_slow(self):
+        if not self._slow and self._elapsed >= metrics.SLOW_QUERY_SECONDS:
+            self._slow = True
+            metrics.record_slow_query(self._name, self._sql, self._elapsed)
+
+    def _timed(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        elapsed = time.perf_counter() - start
+        self._elapsed += elapsed
+        metrics.record_query(self._name, self._sql, elapsed, executed=False)
+        self._check_slow()
+        return result
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed(self._cursor.fetchmany, *(() if size is None else (size,)))
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(100)
+            if not rows:
+                return
+            yield from rows
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+
+def _timed_execute(name, sql, execute, *args, **kwargs):
+    start = time.perf_counter()
+    cursor = execute(*args, **kwargs)
+    return TimedCursor(cursor, name, sql, time.perf_counter() - start)
+
+
+def query(name, params=(), conn=None):
+    """Execute a registered statement and return its cursor"""
+    stmt = STATEMENTS[name]
+    conn = conn if conn is not None else get_db()
+    current = dialect()
+    sql = stmt.render(current)
+    if current is POSTGRES and stmt.prepare:
+        return _timed_execute(name, sql, conn.execute, sql, params, prepare=True)
+    return _timed_execute(name, sql, conn.execute, sql, params)
+
+
+def stream(name, params=(), conn=None, batch_size=1000):
+    """Yield a registered statement's rows in lists of at most ``batch_size``.
+
+    Postgres reads through a named (server-side) cursor so the result set
+    stays on the server; SQLite already steps its cursor lazily. Either way
+    only one batch is held in memory.
+    """
+    stmt = STATEMENTS[name]
+    conn = conn if conn is not None else get_db()
+    current = dialect()
+    sql = stmt.render(current)
+    if current is POSTGRES:
+        with conn.cursor(name=f'stream_{name}') as named:
+            named.itersize = batch_size
+            cursor = _timed_execute(name, sql, named.execute, sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+    else:
+        cursor = _timed_execute(name, sql, conn.execute, sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+
+def bulk_insert(table, columns, rows, conn=None):
+    """Insert many rows in one round trip: COPY on Postgres, executemany on SQLite"""
+    conn = conn if conn is not None else get_db()
+    column_list = ', '.join(columns)
+    start = time.perf_counter()
+    if backend() == 'postgres':
+        sql = f'COPY {table} ({column_list}) FROM STDIN'
+        with conn.cursor() as cursor:
+            with cursor.copy(sql) as copy:
+                for row in rows:
+                    copy.write_row(row)
+    else:
+        placeholders = ', '.join('?' for _ in columns)
+        sql = f'INSERT INTO {table} ({column_list}) VALUES ({placeholders})'
+        conn.executemany(sql, rows)
+    elapsed = time.perf_counter() - start
+    metrics.record_query(f'bulk_insert_{table}', sql, elapsed)
+    if elapsed >= metrics.SLOW_QUERY_SECONDS:
+        metrics.record_slow_query(f'bulk_insert_{table}', sql, elapsed)
+
+
+def inserted_id(cursor):
+    """Primary key of the row added by an INSERT ending in ``{returning_id}``"""
+    if backend() == 'postgres':
+        return cursor.fetchone()[0]
+    return cursor.lastrowid
+
+
+def execute(sql, params=(), conn=None, name='adhoc'):
+    """Execute ad-hoc backend-neutral SQL (DDL, one-off maintenance, built listings)"""
+    conn = conn if conn is not None else get_db()
+    sql = dialect().render(sql)
+    return _timed_execute(name, sql, conn.execute, sql, params)
@@ -0,0 +1,180 @@
+import csv
+import zipfile
+from io import StringIO
+from xml.sax.saxutils import escape
+
+import payroll_engine
+import rollups
+from db import statement, stream
+
+# Payroll exports are generated while they are sent: rows come off a
+# server-side cursor one batch at a time and each batch is encoded and
+# yielded before the next is fetched, so memory stays flat however many
+# months are exported.
+
+# Bounds used when no month is given (full history)
+ALL_TIME = ('0001-01-01', '9999-12-31')
+
+BATCH_SIZE = 1000
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+HEADER = ('Employee ID', 'Employee Name', 'Date', 'Start Time', 'End Time', 'Break (min)',
+          'Normal Hours', 'Overtime Hours', 'Holiday Hours', 'Hourly Rate',
+          'Normal Pay', 'Overtime Pay', 'Holiday Pay', 'Total Pay')
+
+# Report rollup rows, one per employee and period (see rollups.py)
+ROLLUP_HEADER = ('Period', 'Employee ID', 'Employee Name', 'Entries', 'Normal Hours', 'Overtime Hours',
+                 'Holiday Hours', 'Normal Pay', 'Overtime Pay', 'Holiday Pay', 'Total Pay', 'Advances',
+                 'Food Expenses', 'Amount Paid', 'Grand Total')
+
+# Ordered by work_date so both backends walk idx_work_entries_date
+# instead of sorting the whole range first. Entries are paid at the rate
+# stamped on them; the employee's current rate only covers entries the
+# summary refresh has not stamped yet.
+statement('export_work_entries', '''
+    SELECT w.employee_id, e.full_name, w.work_date, w.start_time, w.end_time, w.break_minutes,
+           w.normal_hours, w.overtime_hours, w.holiday_hours, COALESCE(w.hourly_rate, e.hourly_rate) AS hourly_rate
+    FROM {history(work_entries)} w
+    JOIN employees e ON e.employee_id = w.employee_id
+    WHERE w.work_date >= ? AND w.work_date < ?
+    ORDER BY w.work_date, w.employee_id, w.id
+''')
+
+
+def payroll_rows(start, end, conn=None):
+    """Yield batches of export rows (see HEADER) for work dates in [start, end)"""
+    for batch in stream('export_work_entries', (start, end), conn=conn, batch_size=BATCH_SIZE):
+        pay = payroll_engine.compute_pay([row['normal_hours'] for row in batch], [row['overtime_hours'] for row in batch],
+                                         [row['holiday_hours'] for row in batch], [row['hourly_rate'] for row in batch])
+        yield [(row['employee_id'], row['full_name'], str(row['work_date']),
+                row['start_time'], row['end_time'], row['break_minutes'],
+                row['normal_hours'] or 0, row['overtime_hours'] or 0, row['holiday_hours'] or 0, row['hourly_rate'] or 0,
+                round(normal_pay, 2), round(overtime_pay, 2), round(holiday_pay, 2), round(total_pay, 2))
+               for row, normal_pay, overtime_pay, holiday_pay, total_pay
+               in zip(batch, pay['normal_pay'], pay['overtime_pay'], pay['holiday_pay'], pay['total_pay'])]
+
+
+def rollup_rows(grain, first, last, conn=None):
+    """Yield batches of export rows (see ROLLUP_HEADER) for ``grain`` periods from ``first`` to ``last``"""
+    for batch in rollups.employee_rows(grain, first, last, conn=conn, batch_size=BATCH_SIZE):
+        rows = []
+        for row in batch:
+            pay = row['normal_pay'] + row['overtime_pay'] + row['holiday_pay']
+            rows.append((row['period'], row['employee_id'], row['full_name'], row['entries'],
+                         round(row['normal_hours'], 2), round(row['overtime_hours'], 2), round(row['holiday_hours'], 2),
+                         round(row['normal_pay'], 2), round(row['overtime_pay'], 2), round(row['holiday_pay'], 2),
+                         round(pay, 2), round(row['advances'], 2), round(row['food_expenses'], 2),
+                         round(row['amount_paid'], 2), round(pay - row['advances'] - row['food_expenses'], 2)))
+        yield rows
+
+
+def encode(batches, export_format, header=HEADER, sheet='Payroll'):
+    """Chunks of the export in ``export_format`` (a CONTENT_TYPES key)"""
+    if export_format == 'xlsx':
+        return xlsx_chunks(batches, header, sheet)
+    return csv_chunks(batches, header)
+
+
+def csv_chunks(batches, header=HEADER):
+    """Encode row batches as CSV, one chunk of text per batch"""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+# ===== STREAMING XLSX =====
+
+CONTENT_TYPES_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+</Types>'''
+
+ROOT_RELS_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+
+WORKBOOK_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="{sheet}" sheetId="1" r:id="rId1"/></sheets>
+</workbook>'''
+
+WORKBOOK_RELS_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+</Relationships>'''
+
+SHEET_START_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'''
+
+SHEET_END_XML = '</sheetData></worksheet>'
+
+
+class _ChunkSink:
+    """Write-only file for zipfile; whatever it has written is drained between batches.
+
+    It has no tell()/seek(), so zipfile writes sizes in data descriptors
+    after each member instead of seeking back to patch the headers.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def _cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def _row(values):
+    return '<row>' + ''.join(_cell(value) for value in values) + '</row>'
+
+
+def xlsx_chunks(batches, header=HEADER, sheet='Payroll'):
+    """Encode row batches as a single-sheet .xlsx, yielding zip bytes as they are compressed.
+
+    Strings are written inline rather than through a shared-strings table,
+    which would have to be complete before the sheet could be written.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+        archive.writestr('_rels/.rels', ROOT_RELS_XML)
+        archive.writestr('xl/workbook.xml', WORKBOOK_XML.format(sheet=escape(sheet)))
+        archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS_XML)
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as worksheet:
+            worksheet.write((SHEET_START_XML + _row(header)).encode('utf-8'))
+            yield sink.drain()
+            for rows in batches:
+                worksheet.write(''.join(_row(values) for values in rows).encode('utf-8'))
+                yield sink.drain()
+            worksheet.write(SHEET_END_XML.encode('utf-8'))
+    yield sink.drain()
@@ -0,0 +1,319 @@
+import csv
+import json
+import re
+from datetime import date
+
+import payroll
+import payroll_engine
+from db import statement, query, execute, bulk_insert
+
+# Bulk loading of work entries, advances and food expenses from CSV or
+# JSON Lines. Records are read one at a time from the upload, validated
+# and collected into chunks of CHUNK_SIZE; each chunk is written with a
+# single COPY/executemany and committed together with its payroll summary
+# refresh. A bad record is reported by line number and skipped; a chunk
+# the database rejects is rolled back and reported as a whole.
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+
+TIME_FORMAT = re.compile(r'^([01]\d|2[0-3]):[0-5]\d$')
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+
+WORK_ENTRY_COLUMNS = ('employee_id', 'work_date', 'start_time', 'end_time', 'break_minutes',
+                      'normal_hours', 'overtime_hours', 'holiday_hours')
+
+# Upsert staging: one chunk of work entries, matched against work_entries
+# on (employee_id, work_date) through idx_work_entries_employee_date
+STAGE_WORK_ENTRIES = '''
+    CREATE TEMP TABLE IF NOT EXISTS import_work_entries (
+        employee_id TEXT,
+        work_date {date},
+        start_time TEXT,
+        end_time TEXT,
+        break_minutes INTEGER,
+        normal_hours REAL,
+        overtime_hours REAL,
+        holiday_hours REAL
+    )
+'''
+
+statement('clear_import_work_entries', 'DELETE FROM import_work_entries')
+
+statement('update_work_entries_from_import', '''
+    UPDATE work_entries
+    SET start_time = s.start_time, end_time = s.end_time, break_minutes = s.break_minutes,
+        normal_hours = s.normal_hours, overtime_hours = s.overtime_hours, holiday_hours = s.holiday_hours
+    FROM import_work_entries s
+    WHERE work_entries.employee_id = s.employee_id AND work_entries.work_date = s.work_date
+''')
+
+# A day already recorded in a detached month or moved year is left alone;
+# those periods are read-only (see partitions.py)
+statement('insert_work_entries_from_import', f'''
+    INSERT INTO work_entries ({', '.join(WORK_ENTRY_COLUMNS)})
+    SELECT {', '.join('s.' + column for column in WORK_ENTRY_COLUMNS)}
+    FROM import_work_entries s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {{history(work_entries)}} w
+        WHERE w.employee_id = s.employee_id AND w.work_date = s.work_date
+    )
+''')
+
+
+# ===== RECORD READERS =====
+
+def _text_lines(binary):
+    """Decode an uploaded file line by line (a leading BOM is dropped)"""
+    first = True
+    for line in binary:
+        text = line.decode('utf-8')
+        if first:
+            text = text.lstrip('﻿')
+            first = False
+        yield text
+
+
+def read_csv(binary):
+    """Yield (line number, record dict) from a CSV file with a header row"""
+    reader = csv.DictReader(_text_lines(binary))
+    for record in reader:
+        yield reader.line_num, {key.strip(): (value or '').strip() for key, value in record.items() if key}
+
+
+def read_jsonl(binary):
+    """Yield (line number, record dict) from a JSON Lines file; bad lines yield the error instead"""
+    for line_no, line in enumerate(_text_lines(binary), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError(f'invalid JSON: {e}')
+            continue
+        if not isinstance(record, dict):
+            yield line_no, ValueError('expected a JSON object')
+            continue
+        yield line_no, record
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def detect_format(filename):
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+# ===== FIELD PARSERS =====
+
+def _required(record, field):
+    value = record.get(field)
+    if value is None or str(value).strip() == '':
+        raise ValueError(f'{field} is required')
+    return str(value).strip()
+
+
+def _date(record, field):
+    value = _required(record, field)
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f'{field} must be YYYY-MM-DD')
+
+
+def _time(record, field):
+    value = _required(record, field)
+    if not TIME_FORMAT.match(value):
+        raise ValueError(f'{field} must be HH:MM')
+    return value
+
+
+def _number(record, field, default=None):
+    value = record.get(field)
+    if value is None or str(value).strip() == '':
+        if default is None:
+            raise ValueError(f'{field} is required')
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be a number')
+
+
+def _flag(record, field):
+    value = record.get(field)
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in TRUE_VALUES
+
+
+# ===== IMPORT KINDS =====
+
+class ImportKind:
+    """How one table is imported: record parser, target columns and the date used for the payroll summary"""
+
+    def __init__(self, table, columns, parse, date_column, upsert=False):
+        self.table = table
+        self.columns = columns
+        self.parse = parse
+        self.date_column = date_column
+        self.upsert = upsert
+
+    def prepare(self, parsed, rules):
+        """Turn a chunk of parsed records into rows for ``columns``"""
+        return parsed
+
+
+class WorkEntryImport(ImportKind):
+    def prepare(self, parsed, rules):
+        # Hours for the whole chunk in one engine call
+        hours = payroll_engine.compute_hours([p['start_time'] for p in parsed], [p['end_time'] for p in parsed],
+                                             [p['break_minutes'] for p in parsed], [p['is_holiday'] for p in parsed],
+                                             rules)
+        return [(p['employee_id'], p['work_date'], p['start_time'], p['end_time'], int(p['break_minutes']),
+                 normal, overtime, holiday)
+                for p, normal, overtime, holiday
+                in zip(parsed, hours['normal_hours'], hours['overtime_hours'], hours['holiday_hours'])]
+
+
+def parse_work_entry(record, rules):
+    return {
+        'employee_id': _required(record, 'employee_id'),
+        'work_date': _date(record, 'work_date'),
+        'start_time': _time(record, 'start_time'),
+        'end_time': _time(record, 'end_time'),
+        'break_minutes': _number(record, 'break_minutes', rules.default_break_minutes),
+        'is_holiday': _flag(record, 'is_holiday'),
+    }
+
+
+def parse_advance_payment(record, rules):
+    return (_required(record, 'employee_id'), _number(record, 'amount'), _date(record, 'payment_date'),
+            str(record.get('reason') or ''))
+
+
+def parse_food_expense(record, rules):
+    return (_required(record, 'employee_id'), _number(record, 'amount'), _date(record, 'expense_date'),
+            str(record.get('description') or ''))
+
+
+KINDS = {
+    'work_entries': WorkEntryImport('work_entries', WORK_ENTRY_COLUMNS, parse_work_entry, 'work_date', upsert=True),
+    'advance_payments': ImportKind('advance_payments', ('employee_id', 'amount', 'payment_date', 'reason'),
+                                   parse_advance_payment, 'payment_date'),
+    'food_expenses': ImportKind('food_expenses', ('employee_id', 'amount', 'expense_date', 'description'),
+                                parse_food_expense, 'expense_date'),
+}
+
+
+# ===== IMPORT =====
+
+class ImportReport:
+    def __init__(self, kind, mode):
+        self.kind = kind
+        self.mode = mode
+        self.rows_read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        return {
+            'kind': self.kind,
+            'mode': self.mode,
+            'rows_read': self.rows_read,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'errors_truncated': self.error_count > len(self.errors),
+        }
+
+
+def _write_chunk(kind, rows, upsert, conn):
+    """Write one chunk; returns (inserted, updated)"""
+    if not upsert:
+        bulk_insert(kind.table, kind.columns, rows, conn=conn)
+        return len(rows), 0
+
+    # Last record wins when a key repeats inside the chunk
+    latest = {}
+    for row in rows:
+        latest[(row[0], row[1])] = row
+    rows = list(latest.values())
+    execute(STAGE_WORK_ENTRIES, conn=conn)
+    query('clear_import_work_entries', conn=conn)
+    bulk_insert('import_work_entries', kind.columns, rows, conn=conn)
+    updated = query('update_work_entries_from_import', conn=conn).rowcount
+    inserted = query('insert_work_entries_from_import', conn=conn).rowcount
+    query('clear_import_work_entries', conn=conn)
+    return inserted, updated
+
+
+def import_records(kind_name, records, conn, upsert=False, rules=payroll_engine.RULES, chunk_size=None):
+    """Validate and write ``records`` ((line, dict) pairs) in committed chunks.
+
+    Returns an ImportReport; invalid records are reported and skipped.
+    """
+    kind = KINDS[kind_name]
+    if upsert and not kind.upsert:
+        raise ValueError(f'{kind_name} cannot be upserted')
+    chunk_size = chunk_size or CHUNK_SIZE
+    report = ImportReport(kind_name, 'upsert' if upsert else 'insert')
+    employee_ids = {row['employee_id'] for row in query('employee_choices', conn=conn).fetchall()}
+
+    def flush(lines, parsed):
+        try:
+            rows = kind.prepare(parsed, rules)
+            inserted, updated = _write_chunk(kind, rows, upsert, conn)
+            date_index = kind.columns.index(kind.date_column)
+            touched = {}
+            for row in rows:
+                touched.setdefault(row[0], set()).add(row[date_index][:7])
+            for employee_id, months in touched.items():
+                payroll.refresh_summary(employee_id, *months, conn=conn)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for line in lines:
+                report.error(line, f'chunk rejected by the database: {e}')
+            return
+        report.inserted += inserted
+        report.updated += updated
+
+    lines, parsed = [], []
+    for line, record in records:
+        report.rows_read += 1
+        if isinstance(record, Exception):
+            report.error(line, str(record))
+            continue
+        try:
+            item = kind.parse(record, rules)
+            employee_id = item['employee_id'] if isinstance(item, dict) else item[0]
+            if employee_id not in employee_ids:
+                raise ValueError(f'unknown employee_id {employee_id!r}')
+        except ValueError as e:
+            report.error(line, str(e))
+            continue
+        lines.append(line)
+        parsed.append(item)
+        if len(parsed) >= chunk_size:
+            flush(lines, parsed)
+            lines, parsed = [], []
+    if parsed:
+        flush(lines, parsed)
+    return report
+
+
+def import_file(kind_name, binary, file_format='csv', conn=None, upsert=False, **kwargs):
+    """Import an uploaded CSV/JSON Lines file object (read as bytes, line by line)"""
+    return import_records(kind_name, READERS[file_format](binary), conn, upsert=upsert, **kwargs)
@@ -0,0 +1,230 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import photos
+from db import statement, query, get_pool, inserted_id
+from logs import get_logger
+
+# Check-in/check-out photo ingestion. The request only spools the upload
+# to disk and records an attendance_uploads row in the same transaction as
+# the work entry, so the employee gets an answer as soon as both are
+# durable. A pool of threads in each process then decodes the photo, puts
+# it in the blob store (re-encoded to the capture profile when the client
+# did not keep to it), renders its thumbnails and inserts the
+# attendance_photos row.
+#
+# Every process (web workers and worker.py) also sweeps for uploads left
+# behind by a process that died before finishing them.
+INGEST_THREADS = int(os.environ.get('INGEST_THREADS', 2))
+# Uploads queued in one process before check-ins are refused with 503
+INGEST_MAX_PENDING = int(os.environ.get('INGEST_MAX_PENDING', 200))
+INGEST_SWEEP_INTERVAL = float(os.environ.get('INGEST_SWEEP_INTERVAL', 30))
+# An upload still pending (or processing) after this long lost its process
+INGEST_STALE_AFTER = float(os.environ.get('INGEST_STALE_AFTER', 120))
+INGEST_MAX_ATTEMPTS = int(os.environ.get('INGEST_MAX_ATTEMPTS', 3))
+INGEST_SPOOL_DIR = os.path.abspath(os.environ.get('INGEST_SPOOL_DIR', os.path.join(photos.PHOTO_STORAGE_DIR, 'spool')))
+
+# How the spooled bytes are encoded: multipart uploads are the image itself,
+# the older url-encoded form sent a base64 data URL
+BINARY = 'binary'
+DATA_URL = 'data_url'
+
+logger = get_logger('ingest')
+
+statement('insert_attendance_upload', '''
+    INSERT INTO attendance_uploads (employee_id, work_date, photo_type, idempotency_key, spool_path,
+                                    encoding, content_type, byte_size, message)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (employee_id, idempotency_key) DO NOTHING
+    {returning_id}
+''')
+
+statement('attendance_upload_by_key', '''
+    SELECT id, status, message FROM attendance_uploads WHERE employee_id = ? AND idempotency_key = ?
+''')
+
+statement('attendance_upload_by_id', 'SELECT * FROM attendance_uploads WHERE id = ?')
+
+# Only one thread's UPDATE can still see status = 'pending'
+statement('claim_attendance_upload', '''
+    UPDATE attendance_uploads
+    SET status = 'processing', attempts = attempts + 1, claimed_date = ?
+    WHERE id = ? AND status = 'pending'
+''')
+
+statement('finish_attendance_upload', '''
+    UPDATE attendance_uploads SET status = ?, error = ?, processed_date = ? WHERE id = ?
+''')
+
+statement('requeue_stale_attendance_uploads', '''
+    UPDATE attendance_uploads SET status = 'pending'
+    WHERE status = 'processing' AND claimed_date < ? AND attempts < ?
+''')
+
+statement('fail_stale_attendance_uploads', '''
+    UPDATE attendance_uploads SET status = 'failed', error = 'Ingestion stopped responding', processed_date = ?
+    WHERE status = 'processing' AND claimed_date < ?
+''')
+
+statement('stale_attendance_uploads', '''
+    SELECT id FROM attendance_uploads WHERE status = 'pending' AND created_date < ? ORDER BY id LIMIT ?
+''')
+
+
+def _now():
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _ago(seconds):
+    return (datetime.utcnow() - timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def spool(data):
+    """Durably write the raw upload and return its path"""
+    path = os.path.join(INGEST_SPOOL_DIR, uuid.uuid4().hex)
+    photos.store.write(path, data)
+    return path
+
+
+def discard(path):
+    if path and os.path.exists(path):
+        os.unlink(path)
+
+
+def previous(employee_id, idempotency_key, conn=None):
+    """The upload already accepted under ``idempotency_key`` (None for a new key)"""
+    if not idempotency_key:
+        return None
+    return query('attendance_upload_by_key', (employee_id, idempotency_key), conn=conn).fetchone()
+
+
+def accept(employee_id, work_date, photo_type, idempotency_key, spool_path, encoding, content_type, byte_size,
+           message, conn=None):
+    """Record a spooled upload; returns its id, or None when the key was taken meanwhile.
+
+    The caller commits, then hands the id to ``pool.submit``.
+    """
+    cursor = query('insert_attendance_upload', (employee_id, work_date, photo_type, idempotency_key or None,
+                                                spool_path, encoding, content_type, byte_size, message), conn=conn)
+    if not cursor.rowcount:
+        return None
+    return inserted_id(cursor)
+
+
+def process(upload_id, conn):
+    """Decode, store and record one upload; returns its final status (None if another thread has it)"""
+    claimed = query('claim_attendance_upload', (_now(), upload_id), conn=conn).rowcount
+    conn.commit()
+    if not claimed:
+        return None
+    upload = query('attendance_upload_by_id', (upload_id,), conn=conn).fetchone()
+    try:
+        with open(upload['spool_path'], 'rb') as f:
+            raw = f.read()
+        if upload['encoding'] == DATA_URL:
+            data, content_type = photos.decode_data_url(raw.decode('ascii', 'replace'))
+        else:
+            data, content_type = raw, upload['content_type']
+        data, content_type = photos.fit_capture(data, content_type)
+        photos.save_photo(upload['employee_id'], str(upload['work_date']), upload['photo_type'], data, content_type,
+                          conn=conn)
+        query('finish_attendance_upload', ('done', None, _now(), upload_id), conn=conn)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        # A photo that cannot be decoded will not decode next time either
+        retry = not isinstance(e, ValueError) and upload['attempts'] < INGEST_MAX_ATTEMPTS
+        status = 'pending' if retry else 'failed'
+        logger.warning('photo ingestion failed', extra={'upload_id': upload_id, 'error': str(e), 'status': status})
+        query('finish_attendance_upload', (status, str(e) or e.__class__.__name__, None if retry else _now(), upload_id),
+              conn=conn)
+        conn.commit()
+        if status == 'failed':
+            discard(upload['spool_path'])
+        return status
+    discard(upload['spool_path'])
+    return 'done'
+
+
+def recover_stale(conn, limit=500):
+    """Ids of uploads orphaned by a dead process, made claimable again"""
+    cutoff = _ago(INGEST_STALE_AFTER)
+    query('requeue_stale_attendance_uploads', (cutoff, INGEST_MAX_ATTEMPTS), conn=conn)
+    query('fail_stale_attendance_uploads', (_now(), cutoff), conn=conn)
+    conn.commit()
+    return [row['id'] for row in query('stale_attendance_uploads', (cutoff, limit), conn=conn).fetchall()]
+
+
+class IngestPool:
+    """``threads`` ingestion threads fed by an in-process queue, plus the stale-upload sweeper.
+
+    Threads start on first use in each process, so a forking server never
+    inherits them.
+    """
+
+    def __init__(self, threads=INGEST_THREADS, max_pending=INGEST_MAX_PENDING):
+        self.threads = threads
+        self.max_pending = max_pending
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.queue = queue.Queue()
+            for i in range(self.threads):
+                threading.Thread(target=self._run, name=f'ingest-{i}', daemon=True).start()
+            threading.Thread(target=self._sweep, name='ingest-sweeper', daemon=True).start()
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def has_capacity(self):
+        return self.pending() < self.max_pending
+
+    def submit(self, upload_id):
+        self.start()
+        self.queue.put(upload_id)
+
+    def _run(self):
+        pool = get_pool()
+        while True:
+            upload_id = self.queue.get()
+            conn = pool.getconn()
+            try:
+                process(upload_id, conn)
+            except Exception:
+                # Database trouble; the sweeper retries the upload later
+                logger.exception('photo ingestion error', extra={'upload_id': upload_id})
+                conn.rollback()
+            finally:
+                pool.putconn(conn)
+
+    def _sweep(self):
+        pool = get_pool()
+        while True:
+            time.sleep(INGEST_SWEEP_INTERVAL)
+            conn = pool.getconn()
+            try:
+                stale = recover_stale(conn)
+                conn.rollback()
+                for upload_id in stale:
+                    self.queue.put(upload_id)
+                if stale:
+                    logger.info('requeued stale photo uploads', extra={'count': len(stale)})
+            except Exception as e:
+                # Usually a locked SQLite database; try again next sweep
+                logger.warning('photo upload sweep failed', extra={'error': str(e)})
+                conn.rollback()
+            finally:
+                pool.putconn(conn)
+
+
+pool = IngestPool()
@@ -0,0 +1,328 @@
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+import archive
+import exports
+import partitions
+import payroll
+import rollups
+from cache import cache
+from db import statement, query, get_pool, inserted_id, month_range
+from logs import get_logger
+
+# Slow work (full exports, payroll rebuilds) runs outside the web workers.
+# The web tier inserts a row into jobs and returns at once; `python
+# worker.py` claims queued rows, runs the registered handler and records
+# the outcome. Pages poll the status endpoint and fetch the result file
+# once the job is done.
+
+# Finished job files; the web process serves them, so both must see it
+JOB_RESULTS_DIR = os.path.abspath(os.environ.get('JOB_RESULTS_DIR', 'job_results'))
+
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 10))
+# A running job without a heartbeat for this long lost its worker
+JOB_STALE_AFTER = float(os.environ.get('JOB_STALE_AFTER', 120))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_RETENTION_DAYS = float(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+logger = get_logger('jobs')
+
+statement('insert_job', '''
+    INSERT INTO jobs (kind, params, submitted_by) VALUES (?, ?, ?) {returning_id}
+''')
+
+statement('job_by_id', 'SELECT * FROM jobs WHERE id = ?')
+
+statement('next_queued_job', "SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1")
+
+# Only one worker's UPDATE can still see status = 'queued'
+statement('claim_job', '''
+    UPDATE jobs
+    SET status = 'running', worker = ?, attempts = attempts + 1,
+        started_date = ?, heartbeat_date = ?, error = NULL
+    WHERE id = ? AND status = 'queued'
+''')
+
+statement('job_heartbeat', 'UPDATE jobs SET heartbeat_date = ?, progress = ? WHERE id = ? AND worker = ?')
+
+statement('finish_job', '''
+    UPDATE jobs
+    SET status = ?, progress = ?, error = ?, result_path = ?, result_name = ?, content_type = ?, finished_date = ?
+    WHERE id = ?
+''')
+
+statement('requeue_stale_jobs', '''
+    UPDATE jobs SET status = 'queued', worker = NULL
+    WHERE status = 'running' AND heartbeat_date < ? AND attempts < ?
+''')
+
+statement('fail_stale_jobs', '''
+    UPDATE jobs SET status = 'failed', error = 'Worker stopped responding', finished_date = ?
+    WHERE status = 'running' AND heartbeat_date < ?
+''')
+
+statement('expired_job_files', "SELECT result_path FROM jobs WHERE finished_date < ? AND result_path IS NOT NULL")
+
+statement('delete_expired_jobs', "DELETE FROM jobs WHERE finished_date < ?")
+
+HANDLERS = {}
+
+
+def handler(kind, params=()):
+    """Register ``fn(job, conn)`` for ``kind``; only the named ``params`` are accepted on submit"""
+    def register(fn):
+        HANDLERS[kind] = (fn, tuple(params))
+        return fn
+    return register
+
+
+def _now():
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _ago(seconds):
+    return (datetime.utcnow() - timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class Job:
+    def __init__(self, row):
+        self.id = row['id']
+        self.kind = row['kind']
+        self.params = json.loads(row['params'] or '{}')
+        self.progress = row['progress']
+
+    def result_file(self, name):
+        """Path to write this job's downloadable result to"""
+        os.makedirs(JOB_RESULTS_DIR, exist_ok=True)
+        return os.path.join(JOB_RESULTS_DIR, f'{self.id}-{name}')
+
+
+def submit(kind, params=None, submitted_by=None, conn=None):
+    """Queue a job and return its id; the caller commits"""
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind {kind!r}')
+    allowed = HANDLERS[kind][1]
+    params = {key: value for key, value in (params or {}).items() if key in allowed and value not in (None, '')}
+    cursor = query('insert_job', (kind, json.dumps(params), submitted_by), conn=conn)
+    return inserted_id(cursor)
+
+
+def get(job_id, conn=None):
+    return query('job_by_id', (job_id,), conn=conn).fetchone()
+
+
+def describe(row):
+    """JSON-friendly view of a jobs row"""
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'params': json.loads(row['params'] or '{}'),
+        'status': row['status'],
+        'progress': row['progress'],
+        'error': row['error'],
+        'result_name': row['result_name'],
+        'attempts': row['attempts'],
+        'created_date': str(row['created_date']) if row['created_date'] else None,
+        'started_date': str(row['started_date']) if row['started_date'] else None,
+        'finished_date': str(row['finished_date']) if row['finished_date'] else None,
+    }
+
+
+def claim(worker, conn):
+    """Mark the oldest queued job as running for ``worker`` and return it (None when idle)"""
+    while True:
+        row = query('next_queued_job', conn=conn).fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        now = _now()
+        claimed = query('claim_job', (worker, now, now, row['id']), conn=conn).rowcount
+        conn.commit()
+        if claimed:
+            return Job(row)
+
+
+def run(job, conn):
+    """Run ``job`` on ``conn`` and record whether it finished or failed"""
+    result_path = result_name = content_type = error = None
+    try:
+        fn = HANDLERS[job.kind][0]
+        result = fn(job, conn)
+        conn.commit()
+        if result:
+            result_path, result_name, content_type = result
+        status = 'done'
+    except Exception as e:
+        conn.rollback()
+        logger.exception('job failed', extra={'job_id': job.id, 'kind': job.kind})
+        status, error = 'failed', str(e) or e.__class__.__name__
+    query('finish_job', (status, job.progress, error, result_path, result_name, content_type, _now(), job.id),
+          conn=conn)
+    conn.commit()
+    logger.info('job finished', extra={'job_id': job.id, 'kind': job.kind, 'status': status})
+    return status
+
+
+def recover_stale(conn):
+    """Requeue jobs whose worker died; give up after JOB_MAX_ATTEMPTS"""
+    cutoff = _ago(JOB_STALE_AFTER)
+    requeued = query('requeue_stale_jobs', (cutoff, JOB_MAX_ATTEMPTS), conn=conn).rowcount
+    failed = query('fail_stale_jobs', (_now(), cutoff), conn=conn).rowcount
+    conn.commit()
+    return requeued, failed
+
+
+def prune(conn):
+    """Drop finished jobs older than JOB_RETENTION_DAYS together with their files"""
+    cutoff = _ago(JOB_RETENTION_DAYS * 24 * 3600)
+    for row in query('expired_job_files', (cutoff,), conn=conn).fetchall():
+        if os.path.exists(row['result_path']):
+            os.unlink(row['result_path'])
+    query('delete_expired_jobs', (cutoff,), conn=conn)
+    conn.commit()
+
+
+# ===== HANDLERS =====
+
+@handler('export', params=('month', 'format'))
+def export_job(job, conn):
+    """Write the payroll export for ``month`` (full history without it) to a result file"""
+    month = job.params.get('month')
+    export_format = job.params.get('format', 'csv')
+    if export_format not in exports.CONTENT_TYPES:
+        raise ValueError(f'Unsupported export format {export_format!r}')
+    try:
+        start, end = month_range(month) if month else exports.ALL_TIME
+    except ValueError:
+        raise ValueError(f'Invalid month {month!r}')
+
+    rows = 0
+
+    def counted(batches):
+        nonlocal rows
+        for batch in batches:
+            rows += len(batch)
+            job.progress = f'{rows} rows exported'
+            yield batch
+
+    batches = counted(exports.payroll_rows(start, end, conn=conn))
+    chunks = exports.encode(batches, export_format)
+    name = f'payroll_{month or "all"}.{export_format}'
+    path = job.result_file(name)
+    partial = path + '.part'
+    with open(partial, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    os.replace(partial, path)
+    job.progress = f'{rows} rows exported'
+    return path, name, exports.CONTENT_TYPES[export_format]
+
+
+@handler('rebuild_payroll_summary')
+def rebuild_payroll_summary_job(job, conn):
+    """Recompute payroll_monthly_summary from the raw rows"""
+    drift = payroll.rebuild_summary(conn)
+    job.progress = f'{len(drift)} drifted employee-months corrected'
+
+
+@handler('checkpoint_ledger')
+def checkpoint_ledger_job(job, conn):
+    """Snapshot the running balances that moved since their last checkpoint"""
+    job.progress = f'{payroll.checkpoint_balances(conn)} balances checkpointed'
+
+
+@handler('archive_employee', params=('employee_id',))
+def archive_employee_job(job, conn):
+    """Move a departed employee's history into the archive tables, a throttled chunk at a time"""
+    def progress(message):
+        job.progress = message
+
+    archive.archive_employee(job.params.get('employee_id'), conn, progress=progress)
+    # Web workers drop the employee from their search index (at once with a shared cache)
+    cache.invalidate('employee_search')
+
+
+# ===== WORKER =====
+
+class Worker:
+    """``threads`` job runners plus one thread that heartbeats their jobs and recovers stale ones"""
+
+    def __init__(self, threads=2, name=None):
+        self.threads = threads
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.running = {}  # job id -> Job
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda *_: self.stopping.set())
+        signal.signal(signal.SIGINT, lambda *_: self.stopping.set())
+        runners = [threading.Thread(target=self._run_jobs, name=f'job-runner-{i}') for i in range(self.threads)]
+        runners.append(threading.Thread(target=self._heartbeat, name='job-heartbeat'))
+        for thread in runners:
+            thread.start()
+        logger.info('job worker started', extra={'worker': self.name, 'threads': self.threads})
+        # Wait in short slices so the signal handlers get to run
+        while not self.stopping.wait(1):
+            pass
+        logger.info('job worker stopping after the current jobs', extra={'worker': self.name})
+        for thread in runners:
+            thread.join()
+
+    def _run_jobs(self):
+        pool = get_pool()
+        while not self.stopping.is_set():
+            conn = pool.getconn()
+            try:
+                job = claim(self.name, conn)
+                if job is None:
+                    self.stopping.wait(JOB_POLL_INTERVAL)
+                    continue
+                with self.lock:
+                    self.running[job.id] = job
+                try:
+                    run(job, conn)
+                finally:
+                    with self.lock:
+                        self.running.pop(job.id, None)
+            except Exception:
+                logger.exception('job runner error')
+                self.stopping.wait(JOB_POLL_INTERVAL)
+            finally:
+                pool.putconn(conn)
+
+    def _heartbeat(self):
+        pool = get_pool()
+        last_prune = last_checkpoint = last_partitioning = 0
+        while not self.stopping.wait(JOB_HEARTBEAT_INTERVAL):
+            conn = pool.getconn()
+            try:
+                with self.lock:
+                    running = list(self.running.values())
+                now = _now()
+                for job in running:
+                    query('job_heartbeat', (now, job.progress, job.id, self.name), conn=conn)
+                conn.commit()
+                recover_stale(conn)
+                rollups.refresh(conn, deadline=time.monotonic() + JOB_HEARTBEAT_INTERVAL / 2)
+                if time.monotonic() - last_prune > 3600:
+                    prune(conn)
+                    last_prune = time.monotonic()
+                if time.monotonic() - last_checkpoint > payroll.LEDGER_CHECKPOINT_HOURS * 3600:
+                    payroll.checkpoint_balances(conn)
+                    last_checkpoint = time.monotonic()
+                if time.monotonic() - last_partitioning > 3600:
+                    # A beat's worth of rows at a time; what is left goes on the next beat
+                    if partitions.maintain(conn, deadline=time.monotonic() + JOB_HEARTBEAT_INTERVAL):
+                        last_partitioning = time.monotonic()
+            except Exception as e:
+                # Usually a locked SQLite database; try again next beat
+                logger.warning('job heartbeat failed', extra={'error': str(e)})
+            finally:
+                pool.putconn(conn)
@@ -0,0 +1,86 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+# Levelled, structured logging for the web and worker processes. Loggers
+# only put records on a queue; a listener thread formats them and writes
+# to stderr, so a request never waits on log I/O. Below LOG_LEVEL a call
+# costs one level check.
+#
+# LOG_FORMAT=json writes one JSON object per line (for a log collector);
+# the default is plain text. Pass structured fields with
+# ``logger.info('message', extra={'key': value})``.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+
+# LogRecord attributes that are not ``extra`` fields
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+
+
+def _extra(record):
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(_extra(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra(record)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+def configure(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Route the 'ems' loggers through a queue to ``stream`` (stderr); safe to call again"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+
+    logger = logging.getLogger('ems')
+    logger.handlers[:] = [logging.handlers.QueueHandler(records)]
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def _stop():
+    # Drains the queue, so records logged just before exit are not lost
+    if _listener is not None:
+        _listener.stop()
+
+
+def get_logger(name):
+    return logging.getLogger(f'ems.{name}')
+
+
+configure()
+atexit.register(_stop)
@@ -0,0 +1,213 @@
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from logs import get_logger
+
+# Per-process request and query instrumentation, rendered in the Prometheus
+# text format by /admin/metrics. Every gunicorn worker keeps its own
+# numbers: scrape each worker, or sum over the instances in the query.
+#
+# The request hooks (init_app) time each route; db.TimedCursor reports
+# every statement here, and the totals of the current request are kept in
+# a context variable so background threads (job workers) do not mix into
+# a request's query count.
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', 0.25))
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 1.0))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('SLOW_QUERY_LOG_SIZE', 100))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+logger = get_logger('metrics')
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        samples = []
+        for key, counts in values.items():
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', dict(labels, le=str(bound)), cumulative))
+            samples.append((f'{self.name}_sum', labels, counts[-1]))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+class Gauges:
+    """Point-in-time values read from ``collect()`` at scrape time"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, collect, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def samples(self):
+        try:
+            return [(self.name, dict(zip(self.labels, key)), value) for key, value in self.collect()]
+        except Exception as e:
+            logger.warning('gauge collection failed', extra={'metric': self.name, 'error': str(e)})
+            return []
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+REQUEST_DURATION = register(Histogram(
+    'ems_http_request_duration_seconds', 'Time spent handling a request', ('endpoint', 'method', 'status')))
+REQUEST_QUERIES = register(Histogram(
+    'ems_http_request_db_queries', 'Database statements executed per request', ('endpoint',), QUERY_COUNT_BUCKETS))
+REQUEST_DB_TIME = register(Histogram(
+    'ems_http_request_db_seconds', 'Database time (execute and fetch) per request', ('endpoint',)))
+QUERIES = register(Counter(
+    'ems_db_queries_total', 'Statements executed, by named statement', ('statement',)))
+QUERY_TIME = register(Counter(
+    'ems_db_query_seconds_total', 'Time spent executing and fetching, by named statement', ('statement',)))
+SLOW_QUERIES = register(Counter(
+    'ems_db_slow_queries_total', 'Statements slower than SLOW_QUERY_SECONDS', ('statement',)))
+
+# Most recent slow statements with their SQL, newest last
+slow_query_log = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+
+# ===== PER-REQUEST TOTALS =====
+
+class RequestStats:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def record_query(name, sql, elapsed, executed=True):
+    """Called by db.TimedCursor after an execute (``executed``) or a fetch"""
+    if executed:
+        QUERIES.inc(name)
+    QUERY_TIME.inc(name, amount=elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += executed
+        stats.db_time += elapsed
+
+
+def record_slow_query(name, sql, elapsed):
+    stats = _current.get()
+    endpoint = stats.endpoint if stats is not None else None
+    SLOW_QUERIES.inc(name)
+    slow_query_log.append({'statement': name, 'sql': ' '.join(sql.split()), 'seconds': round(elapsed, 4),
+                           'endpoint': endpoint, 'at': time.strftime('%Y-%m-%d %H:%M:%S')})
+    logger.warning('slow query', extra={'statement': name, 'seconds': round(elapsed, 4), 'endpoint': endpoint})
+
+
+def init_app(app):
+    """Time every request and count its queries"""
+    from flask import g, request
+
+    @app.before_request
+    def start_request():
+        g.request_started = time.perf_counter()
+        g.request_stats_token = _current.set(RequestStats(request.endpoint or 'unmatched'))
+
+    @app.after_request
+    def finish_request(response):
+        started = g.pop('request_started', None)
+        token = g.pop('request_stats_token', None)
+        if started is None or token is None:
+            return response
+        elapsed = time.perf_counter() - started
+        stats = _current.get()
+        _current.reset(token)
+        REQUEST_DURATION.observe(elapsed, stats.endpoint, request.method, str(response.status_code))
+        REQUEST_QUERIES.observe(stats.queries, stats.endpoint)
+        REQUEST_DB_TIME.observe(stats.db_time, stats.endpoint)
+        fields = {'endpoint': stats.endpoint, 'method': request.method, 'status': response.status_code,
+                  'seconds': round(elapsed, 4), 'queries': stats.queries, 'db_seconds': round(stats.db_time, 4)}
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            logger.warning('slow request', extra=fields)
+        else:
+            logger.debug('request', extra=fields)
+        return response
+
+
+# ===== PROMETHEUS TEXT FORMAT =====
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labels, value in metric.samples():
+            if labels:
+                label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f'{name}{{{label_text}}} {_number(value)}')
+            else:
+                lines.append(f'{name} {_number(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,316 @@
+import archive
+import db
+import partitions
+import search
+from logs import get_logger
+
+logger = get_logger('migrations')
+
+# Versioned schema changes applied on top of app.SCHEMA. Each entry is
+# (version, description, steps) where steps is a list of statements for
+# every backend or a {backend: [statements]} dict. Never edit an applied
+# migration; append a new one.
+# payroll.REBUILD_SUMMARY_SQL as it stood for migration 3; the live one
+# reads columns added later
+SUMMARY_V3_SQL = '''
+    INSERT INTO payroll_monthly_summary
+        (employee_id, month, normal_hours, overtime_hours, holiday_hours, advances, food_expenses, amount_paid)
+    SELECT employee_id, month,
+           SUM(normal_hours), SUM(overtime_hours), SUM(holiday_hours),
+           SUM(advances), SUM(food_expenses), SUM(amount_paid)
+    FROM (
+        SELECT employee_id, {month(work_date)} AS month,
+               normal_hours, overtime_hours, holiday_hours,
+               0 AS advances, 0 AS food_expenses, 0 AS amount_paid
+        FROM work_entries
+        UNION ALL
+        SELECT employee_id, {month(payment_date)}, 0, 0, 0, amount, 0, 0
+        FROM advance_payments
+        UNION ALL
+        SELECT employee_id, {month(expense_date)}, 0, 0, 0, 0, amount, 0
+        FROM food_expenses
+        UNION ALL
+        SELECT employee_id, {month(payment_date)}, 0, 0, 0, 0, 0, amount_paid
+        FROM payment_records
+    ) source
+    GROUP BY employee_id, month
+'''
+
+MIGRATIONS = [
+    (1, 'Composite (employee_id, date) indexes on the child tables', [
+        'CREATE INDEX IF NOT EXISTS idx_work_entries_employee_date ON work_entries (employee_id, work_date)',
+        'CREATE INDEX IF NOT EXISTS idx_work_entries_date ON work_entries (work_date)',
+        'CREATE INDEX IF NOT EXISTS idx_advance_payments_employee_date ON advance_payments (employee_id, payment_date)',
+        'CREATE INDEX IF NOT EXISTS idx_food_expenses_employee_date ON food_expenses (employee_id, expense_date)',
+        'CREATE INDEX IF NOT EXISTS idx_attendance_photos_employee_date ON attendance_photos (employee_id, work_date)',
+        'CREATE INDEX IF NOT EXISTS idx_payment_records_employee_date ON payment_records (employee_id, payment_date)',
+    ]),
+    (2, 'Store work and payment dates as DATE on Postgres', {
+        'postgres': [
+            'ALTER TABLE work_entries ALTER COLUMN work_date TYPE DATE USING work_date::date',
+            'ALTER TABLE advance_payments ALTER COLUMN payment_date TYPE DATE USING payment_date::date',
+            'ALTER TABLE food_expenses ALTER COLUMN expense_date TYPE DATE USING expense_date::date',
+            'ALTER TABLE attendance_photos ALTER COLUMN work_date TYPE DATE USING work_date::date',
+            'ALTER TABLE payment_records ALTER COLUMN payment_date TYPE DATE USING payment_date::date',
+        ],
+        # ISO 'YYYY-MM-DD' text already sorts and range-compares correctly
+        'sqlite': [],
+    }),
+    (3, 'Monthly payroll summary table', [
+        '''
+        CREATE TABLE IF NOT EXISTS payroll_monthly_summary (
+            employee_id TEXT NOT NULL,
+            month TEXT NOT NULL,
+            normal_hours REAL DEFAULT 0,
+            overtime_hours REAL DEFAULT 0,
+            holiday_hours REAL DEFAULT 0,
+            advances REAL DEFAULT 0,
+            food_expenses REAL DEFAULT 0,
+            amount_paid REAL DEFAULT 0,
+            updated_date {timestamp} DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (employee_id, month)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_payroll_monthly_summary_month ON payroll_monthly_summary (month)',
+        SUMMARY_V3_SQL,
+    ]),
+    # Existing base64 rows are moved by `flask migrate-photos`
+    (4, 'Attendance photo blob hash and metadata columns', {
+        'postgres': [
+            'ALTER TABLE attendance_photos ADD COLUMN photo_hash TEXT',
+            'ALTER TABLE attendance_photos ADD COLUMN content_type TEXT',
+            'ALTER TABLE attendance_photos ADD COLUMN byte_size INTEGER',
+            'ALTER TABLE attendance_photos ALTER COLUMN photo_data DROP NOT NULL',
+        ],
+        'sqlite': [
+            'ALTER TABLE attendance_photos ADD COLUMN photo_hash TEXT',
+            'ALTER TABLE attendance_photos ADD COLUMN content_type TEXT',
+            'ALTER TABLE attendance_photos ADD COLUMN byte_size INTEGER',
+        ],
+    }),
+    (5, 'Background job queue', [
+        '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id {pk},
+            kind TEXT NOT NULL,
+            params TEXT,
+            status TEXT DEFAULT 'queued',
+            progress TEXT,
+            error TEXT,
+            result_path TEXT,
+            result_name TEXT,
+            content_type TEXT,
+            attempts INTEGER DEFAULT 0,
+            submitted_by TEXT,
+            worker TEXT,
+            created_date {timestamp} DEFAULT CURRENT_TIMESTAMP,
+            started_date {timestamp},
+            heartbeat_date {timestamp},
+            finished_date {timestamp}
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)',
+    ]),
+    (6, 'Employee archive tables and cascading employee foreign keys', archive.migration_steps()),
+    # The listings page on (date, id); these replace the date-only indexes
+    (7, 'Keyset pagination indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_employees_created ON employees (created_date, id)',
+        'CREATE INDEX IF NOT EXISTS idx_work_entries_date_id ON work_entries (work_date, id)',
+        'DROP INDEX IF EXISTS idx_work_entries_date',
+        'CREATE INDEX IF NOT EXISTS idx_payment_records_employee_date_id ON payment_records (employee_id, payment_date, id)',
+        'DROP INDEX IF EXISTS idx_payment_records_employee_date',
+    ]),
+    (8, 'Attendance photo upload queue with idempotency keys', [
+        '''
+        CREATE TABLE IF NOT EXISTS attendance_uploads (
+            id {pk},
+            employee_id TEXT NOT NULL,
+            work_date {date} NOT NULL,
+            photo_type TEXT NOT NULL,
+            idempotency_key TEXT,
+            spool_path TEXT NOT NULL,
+            encoding TEXT NOT NULL,
+            content_type TEXT,
+            byte_size INTEGER,
+            message TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            created_date {timestamp} DEFAULT CURRENT_TIMESTAMP,
+            claimed_date {timestamp},
+            processed_date {timestamp}
+        )
+        ''',
+        # Retries of one check-in carry the same key; NULL keys never collide
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_uploads_key ON attendance_uploads (employee_id, idempotency_key)',
+        'CREATE INDEX IF NOT EXISTS idx_attendance_uploads_status ON attendance_uploads (status, created_date)',
+    ]),
+    # Existing entries get today's rate; it is the best record there is
+    (9, 'Hourly rate per work entry, payroll ledger and running balances', [
+        'ALTER TABLE work_entries ADD COLUMN hourly_rate REAL',
+        'ALTER TABLE work_entries_archive ADD COLUMN hourly_rate REAL',
+        '''
+        UPDATE work_entries
+        SET hourly_rate = (SELECT e.hourly_rate FROM employees e WHERE e.employee_id = work_entries.employee_id)
+        WHERE hourly_rate IS NULL
+        ''',
+        'ALTER TABLE payroll_monthly_summary ADD COLUMN earnings REAL DEFAULT 0',
+        'ALTER TABLE payroll_monthly_summary ADD COLUMN normal_earnings REAL DEFAULT 0',
+        'ALTER TABLE payroll_monthly_summary ADD COLUMN overtime_earnings REAL DEFAULT 0',
+        'ALTER TABLE payroll_monthly_summary ADD COLUMN holiday_earnings REAL DEFAULT 0',
+        '''
+        UPDATE payroll_monthly_summary
+        SET (earnings, normal_earnings, overtime_earnings, holiday_earnings) = (
+            SELECT COALESCE(SUM((w.normal_hours + w.overtime_hours + w.holiday_hours) * w.hourly_rate), 0),
+                   COALESCE(SUM(w.normal_hours * w.hourly_rate), 0),
+                   COALESCE(SUM(w.overtime_hours * w.hourly_rate), 0),
+                   COALESCE(SUM(w.holiday_hours * w.hourly_rate), 0)
+            FROM work_entries w
+            WHERE w.employee_id = payroll_monthly_summary.employee_id
+              AND {month(w.work_date)} = payroll_monthly_summary.month
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS payroll_ledger (
+            id {pk},
+            employee_id TEXT NOT NULL,
+            month TEXT,
+            earned REAL DEFAULT 0,
+            paid REAL DEFAULT 0,
+            posted_date {timestamp} DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_payroll_ledger_employee ON payroll_ledger (employee_id, id)',
+        '''
+        CREATE TABLE IF NOT EXISTS employee_balances (
+            employee_id TEXT PRIMARY KEY,
+            earned REAL DEFAULT 0,
+            paid REAL DEFAULT 0,
+            last_posting_id INTEGER DEFAULT 0,
+            updated_date {timestamp} DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS payroll_ledger_checkpoints (
+            id {pk},
+            employee_id TEXT NOT NULL,
+            posting_id INTEGER NOT NULL,
+            earned REAL NOT NULL,
+            paid REAL NOT NULL,
+            created_date {timestamp} DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_payroll_ledger_checkpoints_employee ON payroll_ledger_checkpoints (employee_id, posting_id)',
+        # Opening balances: one posting per summary month, then a first checkpoint
+        '''
+        INSERT INTO payroll_ledger (employee_id, month, earned, paid)
+        SELECT employee_id, month, earnings, amount_paid FROM payroll_monthly_summary ORDER BY employee_id, month
+        ''',
+        '''
+        INSERT INTO employee_balances (employee_id, earned, paid, last_posting_id)
+        SELECT employee_id, SUM(earned), SUM(paid), MAX(id) FROM payroll_ledger GROUP BY employee_id
+        ''',
+        '''
+        INSERT INTO payroll_ledger_checkpoints (employee_id, posting_id, earned, paid)
+        SELECT employee_id, last_posting_id, earned, paid FROM employee_balances
+        ''',
+    ]),
+    (10, 'Server-side login sessions', [
+        # expires_at is a Unix time; DOUBLE PRECISION keeps it to the second on Postgres
+        '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at DOUBLE PRECISION NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)',
+    ]),
+    # Existing rows are moved across by `flask partition-tables`
+    (11, 'Monthly partitions of work entries and attendance photos', partitions.migration_steps()),
+    # Every summary month is queued; the job worker fills the rollup in
+    (12, 'Report rollups by day, week and month', [
+        '''
+        CREATE TABLE IF NOT EXISTS report_rollup (
+            grain TEXT NOT NULL,
+            period TEXT NOT NULL,
+            employee_id TEXT NOT NULL,
+            entries INTEGER DEFAULT 0,
+            normal_hours REAL DEFAULT 0,
+            overtime_hours REAL DEFAULT 0,
+            holiday_hours REAL DEFAULT 0,
+            normal_pay REAL DEFAULT 0,
+            overtime_pay REAL DEFAULT 0,
+            holiday_pay REAL DEFAULT 0,
+            advances REAL DEFAULT 0,
+            food_expenses REAL DEFAULT 0,
+            amount_paid REAL DEFAULT 0,
+            updated_date {timestamp} DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (grain, period, employee_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_report_rollup_employee ON report_rollup (employee_id, grain, period)',
+        '''
+        CREATE TABLE IF NOT EXISTS report_changes (
+            id {pk},
+            employee_id TEXT NOT NULL,
+            change_date TEXT NOT NULL,
+            logged_date {timestamp} DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Report pages look up what is still waiting in their periods
+        'CREATE INDEX IF NOT EXISTS idx_report_changes_date ON report_changes (change_date)',
+        '''
+        CREATE TABLE IF NOT EXISTS report_rollup_state (
+            id INTEGER PRIMARY KEY,
+            refreshed_date {timestamp}
+        )
+        ''',
+        'INSERT INTO report_rollup_state (id) VALUES (1)',
+        '''
+        INSERT INTO report_changes (employee_id, change_date)
+        SELECT employee_id, month FROM payroll_monthly_summary ORDER BY employee_id, month
+        ''',
+    ]),
+    # The terms of existing employees are written by search.ensure() at startup
+    (13, 'Employee search terms and their index', search.migration_steps()),
+]
+
+SCHEMA_MIGRATIONS = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_date {timestamp} DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+def _lock(conn, backend):
+    # Several gunicorn workers run init_db at once; only one may migrate
+    if backend == 'postgres':
+        conn.execute('LOCK TABLE schema_migrations IN SHARE ROW EXCLUSIVE MODE')
+    else:
+        conn.execute('BEGIN IMMEDIATE')
+
+
+def migrate(conn):
+    """Apply pending migrations, one transaction per version"""
+    backend = db.backend()
+    db.execute(SCHEMA_MIGRATIONS, conn=conn)
+    conn.commit()
+
+    for version, description, steps in MIGRATIONS:
+        _lock(conn, backend)
+        applied = db.execute('SELECT 1 FROM schema_migrations WHERE version = ?', (version,), conn=conn).fetchone()
+        if applied:
+            conn.rollback()
+            continue
+
+        if isinstance(steps, dict):
+            steps = steps.get(backend, [])
+        for sql in steps:
+            db.execute(sql, conn=conn)
+        db.execute('INSERT INTO schema_migrations (version, description) VALUES (?, ?)',
+                   (version, description), conn=conn)
+        conn.commit()
+        logger.info('applied migration', extra={'version': version, 'description': description})
@@ -0,0 +1,180 @@
+import base64
+import json
+from datetime import date, datetime
+
+import search
+from db import execute
+
+# Keyset (cursor) pagination for the long admin listings. Every listing is
+# sorted newest first on (sort column, id) and a page asks for the rows
+# strictly after the last one shown, so each page is an index range scan
+# however deep it is, and rows added meanwhile do not shift later pages.
+# The cursor is that last (sort value, id) pair, base64-encoded.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([str(sort_value), row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid page cursor')
+
+
+def _search(value):
+    """LIKE pattern matching ``value`` anywhere, case-insensitively"""
+    escaped = value.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _iso_date(value):
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f'Invalid date {value!r}, expected YYYY-MM-DD')
+
+
+class Page:
+    def __init__(self, rows, next_cursor, filters, limit):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.filters = filters
+        self.limit = limit
+
+    def next_args(self):
+        """Query-string arguments for the page after this one (None on the last page)"""
+        if self.next_cursor is None:
+            return None
+        return dict(self.filters, cursor=self.next_cursor, limit=self.limit)
+
+    def as_dict(self):
+        items = [{key: value.isoformat() if isinstance(value, (date, datetime)) else value
+                  for key, value in dict(row).items()} for row in self.rows]
+        return {'items': items, 'next_cursor': self.next_cursor, 'filters': self.filters, 'limit': self.limit}
+
+
+class Listing:
+    """A listing with fixed columns, optional filters and keyset paging.
+
+    ``filters`` maps a request argument to (SQL condition, params builder);
+    a condition only applies when the argument is given. A callable
+    condition builds both from the value: ``condition(value)`` returns
+    (SQL condition, params).
+    """
+
+    def __init__(self, name, select, sort_column, id_column, filters):
+        self.name = name
+        self.select = select
+        self.sort_column = sort_column
+        self.id_column = id_column
+        self.filters = filters
+
+    def page(self, args, conn=None, where=(), params=()):
+        """Fetch the page described by request ``args`` (filters, cursor, limit).
+
+        ``where``/``params`` add fixed conditions, e.g. one employee's rows.
+        Raises ValueError for malformed arguments.
+        """
+        conditions = list(where)
+        params = list(params)
+        filters = {}
+        for name, (condition, build) in self.filters.items():
+            value = (args.get(name) or '').strip()
+            if value:
+                if callable(condition):
+                    condition, values = condition(value)
+                else:
+                    values = build(value)
+                conditions.append(condition)
+                params.extend(values)
+                filters[name] = value
+
+        try:
+            limit = min(max(int(args.get('limit') or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            raise ValueError('Invalid page size')
+        cursor = args.get('cursor')
+        if cursor:
+            conditions.append(f'({self.sort_column}, {self.id_column}) < (?, ?)')
+            params.extend(decode_cursor(cursor))
+
+        sql = self.select
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        # One extra row tells whether there is a next page
+        sql += f' ORDER BY {self.sort_column} DESC, {self.id_column} DESC LIMIT {limit + 1}'
+        rows = execute(sql, params, conn=conn, name=f'listing_{self.name}').fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last[self.sort_column.split('.')[-1]], last[self.id_column.split('.')[-1]])
+        return Page(rows, next_cursor, filters, limit)
+
+
+def search_filter(*columns):
+    """Case-insensitive substring match on any of ``columns``"""
+    condition = '(' + ' OR '.join(f"LOWER({column}) LIKE ? ESCAPE '\\'" for column in columns) + ')'
+    return condition, lambda value: (_search(value),) * len(columns)
+
+
+def equals_filter(column):
+    return f'{column} = ?', lambda value: (value,)
+
+
+def date_from_filter(column):
+    return f'{column} >= ?', lambda value: (_iso_date(value),)
+
+
+def date_to_filter(column):
+    return f'{column} <= ?', lambda value: (_iso_date(value),)
+
+
+# ===== LISTINGS =====
+
+# Only what the pages show (and the edit forms pre-fill); no photo data
+EMPLOYEES = Listing(
+    'employees',
+    '''SELECT e.id, e.employee_id, e.full_name, e.email, e.phone, e.hourly_rate, e.passport_number,
+              e.bank_name, e.bank_account_name, e.bank_account_number, e.status, e.created_date
+       FROM employees e''',
+    'e.created_date', 'e.id',
+    {
+        'q': search.listing_filter('e'),
+        'status': equals_filter('e.status'),
+    },
+)
+
+WORK_ENTRIES = Listing(
+    'work_entries',
+    '''SELECT w.id, w.employee_id, w.work_date, w.start_time, w.end_time, w.break_minutes,
+              w.normal_hours, w.overtime_hours, w.holiday_hours, e.full_name
+       FROM {history(work_entries)} w
+       JOIN employees e ON e.employee_id = w.employee_id''',
+    'w.work_date', 'w.id',
+    {
+        'q': search_filter('e.full_name', 'e.employee_id'),
+        'employee_id': equals_filter('w.employee_id'),
+        'date_from': date_from_filter('w.work_date'),
+        'date_to': date_to_filter('w.work_date'),
+    },
+)
+
+PAYMENTS = Listing(
+    'payments',
+    '''SELECT p.id, p.employee_id, p.payment_date, p.amount_paid, p.payment_type, p.description, p.status
+       FROM payment_records p''',
+    'p.payment_date', 'p.id',
+    {
+        'status': equals_filter('p.status'),
+        'date_from': date_from_filter('p.payment_date'),
+        'date_to': date_to_filter('p.payment_date'),
+    },
+)
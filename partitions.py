@@ -0,0 +1,550 @@
+import os
+import re
+import time
+from datetime import date
+
+import db
+from logs import get_logger
+
+# Time partitioning of the two tables every check-in writes to. Nearly all
+# reads are for one month (payroll, dashboards, exports), so the rows of a
+# month are kept together and old ones out of the way.
+#
+# Postgres: work_entries and attendance_photos are range partitioned by
+# month of work_date (work_entries_y2026m10, ...), with a default partition
+# catching dates no month partition covers yet. A month-bounded query
+# (work_date >= ? AND work_date < ?) only scans the partitions it touches.
+# maintain() creates partitions PARTITION_MONTHS_AHEAD months out, gives
+# months that ended up in the default partition their own, and with
+# PARTITION_DETACH_AFTER_MONTHS set detaches older months into standalone
+# <table>_detached_yYYYYmMM tables that can be dumped and dropped.
+#
+# Databases created before partitioning keep the plain tables until
+# `flask partition-tables` converts them online: a trigger mirrors every
+# write into the partitioned copy while the existing rows are copied
+# across in chunks, then the two swap names in one short transaction. The
+# old table stays behind as <table>_unpartitioned. Empty tables (a new
+# install) are converted on startup.
+#
+# SQLite has no partitioning. With SQLITE_LIVE_YEARS set, rows from before
+# the last that many years move into one database per year under
+# SQLITE_YEAR_DIR, attached to every connection as yYYYY; the main file
+# only keeps the live years.
+#
+# Either way detached months and moved years are read-only, and only
+# reachable through <table>_history ({history(table)} in SQL): the live
+# table plus the archived periods. Reads that may reach back that far use
+# it; writes, and the check-in lookups for today, use the table itself.
+
+# Table -> indexes (name suffix, columns) of the partitioned table
+PARTITIONED_TABLES = {
+    'work_entries': (('employee_date', 'employee_id, work_date'), ('date_id', 'work_date, id')),
+    'attendance_photos': (('employee_date', 'employee_id, work_date'),),
+}
+
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 3))
+# Months older than this many before the current one are detached; 0 keeps every month attached
+PARTITION_DETACH_AFTER_MONTHS = int(os.environ.get('PARTITION_DETACH_AFTER_MONTHS', 0))
+# Rows copied or moved per transaction, and the pause between transactions
+PARTITION_COPY_CHUNK = int(os.environ.get('PARTITION_COPY_CHUNK', 5000))
+PARTITION_COPY_PAUSE = float(os.environ.get('PARTITION_COPY_PAUSE', 0.1))
+# The final rename waits this long for running queries before giving up
+PARTITION_SWAP_LOCK_TIMEOUT = int(os.environ.get('PARTITION_SWAP_LOCK_TIMEOUT', 5000))
+
+# Years kept in the main SQLite file (the current one included); 0 keeps everything there.
+# SQLite attaches at most 10 databases to a connection, so keep the number of year files under that.
+SQLITE_LIVE_YEARS = int(os.environ.get('SQLITE_LIVE_YEARS', 0))
+SQLITE_YEAR_DIR = os.environ.get('SQLITE_YEAR_DIR', os.path.splitext(db.SQLITE_PATH)[0] + '_years')
+
+# Postgres advisory lock held while maintaining partitions, so web workers
+# starting together and the job worker never race on the same DDL
+MAINTENANCE_LOCK = 0x656d7370
+
+MONTH_PARTITION = re.compile(r'_y(\d{4})m(\d{2})$')
+YEAR_FILE = re.compile(r'(\d{4})\.db')
+YEAR_SCHEMA = re.compile(r'y\d{4}')
+
+logger = get_logger('partitions')
+
+
+def _add_months(month, count):
+    year, mon = (int(part) for part in month.split('-'))
+    index = year * 12 + mon - 1 + count
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+
+def _months(first, last):
+    month = first
+    while month <= last:
+        yield month
+        month = _add_months(month, 1)
+
+
+def partition_name(table, month):
+    year, mon = month.split('-')
+    return f'{table}_y{year}m{mon}'
+
+
+def _select_list(columns, have):
+    return ', '.join(column if column in have else f'NULL AS {column}' for column in columns)
+
+
+def migration_steps():
+    """Partitioned copies of the tables (Postgres) and their history views, for migrations.MIGRATIONS.
+
+    The copies take over from the tables in _pg_convert(); until then the
+    history views read the plain tables.
+    """
+    postgres = []
+    for table, indexes in PARTITIONED_TABLES.items():
+        copy = f'{table}_partitioned'
+        postgres.append(f'''
+            CREATE TABLE IF NOT EXISTS {copy} (LIKE {table} INCLUDING DEFAULTS, PRIMARY KEY (id, work_date))
+            PARTITION BY RANGE (work_date)
+        ''')
+        postgres.append(f'CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {copy} DEFAULT')
+        postgres.extend(f'CREATE INDEX IF NOT EXISTS idx_{copy}_{suffix} ON {copy} ({columns})'
+                        for suffix, columns in indexes)
+        # The copy is empty, so the constraint is validated at once
+        postgres.append(f'''
+            ALTER TABLE {copy} ADD CONSTRAINT fk_{copy}_employee FOREIGN KEY (employee_id)
+            REFERENCES employees (employee_id) ON DELETE CASCADE
+        ''')
+        postgres.append(f'CREATE OR REPLACE VIEW {table}_history AS SELECT * FROM {table}')
+    # SQLite's views are temporary, created per connection by refresh_layout()
+    return {'postgres': postgres, 'sqlite': []}
+
+
+def maintain(conn, deadline=None, progress=None):
+    """Create upcoming partitions and detach (Postgres) or move (SQLite) old periods.
+
+    Stops moving rows once ``time.monotonic()`` passes ``deadline``;
+    returns False when work was left for the next run.
+    """
+    if db.backend() == 'postgres':
+        return _pg_maintain(conn, progress=progress)
+    return _sqlite_move_closed_years(conn, deadline=deadline, progress=progress)
+
+
+def ensure(conn):
+    """Startup check: partitions for the coming months on Postgres, converting still-empty tables"""
+    if db.backend() != 'postgres':
+        return
+    try:
+        _pg_maintain(conn, convert_empty=True)
+    except Exception as e:
+        conn.rollback()
+        logger.error('partition maintenance failed', extra={'error': str(e)})
+
+
+def convert(conn, chunk_size=PARTITION_COPY_CHUNK, pause=PARTITION_COPY_PAUSE, progress=None):
+    """Bring every table onto the partitioned layout (`flask partition-tables`)"""
+    if db.backend() != 'postgres':
+        return _sqlite_move_closed_years(conn, chunk_size=chunk_size, pause=pause, progress=progress)
+    for table in PARTITIONED_TABLES:
+        if not _pg_partitioned(conn, table):
+            _pg_convert(conn, table, chunk_size, pause, progress)
+    return _pg_maintain(conn, progress=progress)
+
+
+def archived_sources(table, conn):
+    """(source, columns) of every archived period of ``table``: detached partitions or year databases"""
+    if db.backend() == 'postgres':
+        return [(name, set(_pg_columns(conn, name))) for name in _pg_detached(conn, table)]
+    sources = []
+    for schema in _sqlite_year_schemas(conn):
+        columns = _sqlite_columns(conn, schema, table)
+        if columns:
+            sources.append((f'{schema}.{table}', set(columns)))
+    return sources
+
+
+def layout(conn):
+    """{table: [(part, rows)]} for `flask partition-tables --status`; row counts are estimates on Postgres"""
+    report = {}
+    for table in PARTITIONED_TABLES:
+        if db.backend() == 'postgres':
+            parts = db.execute('''
+                SELECT c.relname, c.reltuples FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = to_regclass(?) ORDER BY c.relname
+            ''', (table,), conn=conn).fetchall()
+            parts = [(row[0], max(int(row[1]), 0)) for row in parts]
+            parts += [(name, _pg_estimate(conn, name)) for name in _pg_detached(conn, table)]
+            if not _pg_partitioned(conn, table):
+                parts.insert(0, (f'{table} (not partitioned)', _pg_estimate(conn, table)))
+        else:
+            sources = [('main', table)] + [(schema, table) for schema in _sqlite_year_schemas(conn)]
+            parts = [(f'{schema}.{name}', db.execute(f'SELECT COUNT(*) FROM {schema}.{name}', conn=conn).fetchone()[0])
+                     for schema, name in sources if _sqlite_columns(conn, schema, name)]
+        report[table] = parts
+    return report
+
+
+# ===== POSTGRES =====
+
+def _pg_exists(conn, name):
+    return db.execute('SELECT to_regclass(?) IS NOT NULL', (name,), conn=conn).fetchone()[0]
+
+
+def _pg_partitioned(conn, table):
+    row = db.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(?)', (table,), conn=conn).fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def _pg_estimate(conn, table):
+    return max(int(db.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(?)',
+                              (table,), conn=conn).fetchone()[0]), 0)
+
+
+def _pg_columns(conn, table):
+    return [row[0] for row in db.execute('''
+        SELECT attname FROM pg_attribute
+        WHERE attrelid = to_regclass(?) AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+    ''', (table,), conn=conn)]
+
+
+def _pg_partitions(conn, parent):
+    """{month: partition} of the month partitions attached to ``parent``"""
+    rows = db.execute('''
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(?)
+    ''', (parent,), conn=conn)
+    partitions = {}
+    for row in rows:
+        match = MONTH_PARTITION.search(row[0])
+        if match:
+            partitions[f'{match.group(1)}-{match.group(2)}'] = row[0]
+    return partitions
+
+
+def _pg_detached(conn, table):
+    rows = db.execute('''
+        SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename LIKE ?
+        ORDER BY tablename
+    ''', (f'{table}_detached_y%',), conn=conn)
+    return [row[0] for row in rows if re.fullmatch(rf'{table}_detached_y\d{{4}}m\d{{2}}', row[0])]
+
+
+def _pg_create_partition(conn, parent, table, month):
+    """Attach a partition of ``parent`` for ``month``, taking over its rows from the default partition"""
+    name = partition_name(table, month)
+    start, end = db.month_range(month)
+    # Inserts landing in the default partition wait until the rows are moved out and the month attached
+    db.execute(f'LOCK TABLE {table}_default IN ACCESS EXCLUSIVE MODE', conn=conn)
+    db.execute(f'CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS)', conn=conn)
+    db.execute(f'''
+        WITH moved AS (
+            DELETE FROM {table}_default WHERE work_date >= ? AND work_date < ? RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    ''', (start, end), conn=conn)
+    db.execute(f"ALTER TABLE {parent} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')", conn=conn)
+    conn.commit()
+    logger.info('created partition', extra={'partition': name})
+    return name
+
+
+def _pg_create_partitions(conn, parent, table, months):
+    existing = _pg_partitions(conn, parent)
+    return [_pg_create_partition(conn, parent, table, month) for month in sorted(set(months)) if month not in existing]
+
+
+def _pg_detach_partition(conn, table, month, name):
+    detached = f'{table}_detached_{name[len(table) + 1:]}'
+    start, end = db.month_range(month)
+    db.execute(f'ALTER TABLE {table} DETACH PARTITION {name}', conn=conn)
+    if _pg_exists(conn, detached):
+        # The month was detached before and late rows came in since
+        db.execute(f'INSERT INTO {detached} SELECT * FROM {name}', conn=conn)
+        db.execute(f'DROP TABLE {name}', conn=conn)
+    else:
+        db.execute(f'ALTER TABLE {name} RENAME TO {detached}', conn=conn)
+        # Lets the planner skip the table when a query's dates fall outside the month
+        db.execute(f'''
+            ALTER TABLE {detached} ADD CONSTRAINT {detached}_month
+            CHECK (work_date >= '{start}' AND work_date < '{end}')
+        ''', conn=conn)
+    conn.commit()
+    logger.info('detached partition', extra={'partition': detached})
+
+
+def _pg_history_view(conn, table):
+    columns = _pg_columns(conn, table)
+    selects = [f'SELECT {", ".join(columns)} FROM {table}']
+    selects += [f'SELECT {_select_list(columns, set(_pg_columns(conn, name)))} FROM {name}'
+                for name in _pg_detached(conn, table)]
+    sql = ' UNION ALL '.join(selects)
+    # The definition is kept as the view's comment; replacing the view
+    # waits for every query reading it, so only do that when it changed
+    current = db.execute("SELECT obj_description(to_regclass(?), 'pg_class')", (f'{table}_history',),
+                         conn=conn).fetchone()[0]
+    if current != sql:
+        db.execute(f'CREATE OR REPLACE VIEW {table}_history AS {sql}', conn=conn)
+        db.execute(f'COMMENT ON VIEW {table}_history IS ' + "'" + sql.replace("'", "''") + "'", conn=conn)
+    conn.commit()
+
+
+def _pg_maintain(conn, convert_empty=False, progress=None):
+    locked = db.execute('SELECT pg_try_advisory_lock(?)', (MAINTENANCE_LOCK,), conn=conn).fetchone()[0]
+    conn.commit()
+    if not locked:
+        return True
+    try:
+        current = date.today().strftime('%Y-%m')
+        for table in PARTITIONED_TABLES:
+            if not _pg_partitioned(conn, table):
+                if not convert_empty or db.execute(f'SELECT 1 FROM {table} LIMIT 1', conn=conn).fetchone():
+                    logger.warning('table is not partitioned yet, run `flask partition-tables`',
+                                   extra={'table': table})
+                    _pg_history_view(conn, table)
+                    continue
+                _pg_convert(conn, table, PARTITION_COPY_CHUNK, 0, progress)
+
+            stray = [row[0] for row in db.execute(f'SELECT DISTINCT {{month(work_date)}} FROM {table}_default',
+                                                  conn=conn)]
+            upcoming = [_add_months(current, i) for i in range(PARTITION_MONTHS_AHEAD + 1)]
+            for name in _pg_create_partitions(conn, table, table, stray + upcoming):
+                if progress:
+                    progress(f'created {name}')
+
+            if PARTITION_DETACH_AFTER_MONTHS > 0:
+                cutoff = _add_months(current, -PARTITION_DETACH_AFTER_MONTHS)
+                for month, name in sorted(_pg_partitions(conn, table).items()):
+                    if month < cutoff:
+                        _pg_detach_partition(conn, table, month, name)
+                        if progress:
+                            progress(f'detached {name}')
+            _pg_history_view(conn, table)
+    finally:
+        conn.rollback()
+        db.execute('SELECT pg_advisory_unlock(?)', (MAINTENANCE_LOCK,), conn=conn)
+        conn.commit()
+    return True
+
+
+def _pg_convert(conn, table, chunk_size, pause, progress):
+    """Copy ``table`` into {table}_partitioned (migration 11) while it stays in use, then swap the two"""
+    copy = f'{table}_partitioned'
+    if not _pg_exists(conn, copy):
+        raise RuntimeError(f'{copy} is missing; run the migrations first')
+
+    first, last, max_id = db.execute(f'SELECT MIN(work_date), MAX(work_date), MAX(id) FROM {table}',
+                                     conn=conn).fetchone()
+    current = date.today().strftime('%Y-%m')
+    months = [_add_months(current, i) for i in range(PARTITION_MONTHS_AHEAD + 1)]
+    if first is not None:
+        months += _months(str(first)[:7], str(last)[:7])
+    _pg_create_partitions(conn, copy, table, months)
+
+    # Every write from now on reaches the copy; an update is a delete and
+    # an insert, since it may move the row to another month
+    db.execute(f'''
+        CREATE OR REPLACE FUNCTION {table}_mirror() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM {copy} WHERE id = OLD.id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO {copy} SELECT NEW.*
+                WHERE EXISTS (SELECT 1 FROM employees e WHERE e.employee_id = NEW.employee_id);
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    ''', conn=conn)
+    db.execute(f'DROP TRIGGER IF EXISTS {table}_mirror ON {table}', conn=conn)
+    db.execute(f'''
+        CREATE TRIGGER {table}_mirror AFTER INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION {table}_mirror()
+    ''', conn=conn)
+    conn.commit()
+
+    # Rows written before the trigger; FOR SHARE waits out a concurrent
+    # update so the trigger's newer version is the one that stays. Rows of
+    # employees deleted before the foreign keys existed are left behind.
+    copied, low = 0, 0
+    while max_id is not None and low < max_id:
+        high = low + chunk_size
+        copied += db.execute(f'''
+            INSERT INTO {copy}
+            SELECT * FROM {table} t
+            WHERE t.id > ? AND t.id <= ?
+              AND EXISTS (SELECT 1 FROM employees e WHERE e.employee_id = t.employee_id)
+            FOR SHARE OF t
+            ON CONFLICT DO NOTHING
+        ''', (low, high), conn=conn).rowcount
+        conn.commit()
+        low = high
+        if progress:
+            progress(f'{table}: copied {copied} rows (id {min(high, max_id)} of {max_id})')
+        time.sleep(pause)
+
+    for attempt in range(1, 6):
+        try:
+            db.execute(f"SET LOCAL lock_timeout = {PARTITION_SWAP_LOCK_TIMEOUT}", conn=conn)
+            db.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE', conn=conn)
+            sequence = db.execute("SELECT pg_get_serial_sequence(?, 'id')", (table,), conn=conn).fetchone()[0]
+            db.execute(f'DROP TRIGGER {table}_mirror ON {table}', conn=conn)
+            db.execute(f'DROP FUNCTION {table}_mirror()', conn=conn)
+            db.execute(f'ALTER TABLE {table} RENAME TO {table}_unpartitioned', conn=conn)
+            db.execute(f'ALTER TABLE {copy} RENAME TO {table}', conn=conn)
+            if sequence:
+                db.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id', conn=conn)
+            _pg_history_view(conn, table)
+            break
+        except Exception as e:
+            conn.rollback()
+            # 55P03: lock_not_available
+            if getattr(e, 'sqlstate', None) != '55P03' or attempt == 5:
+                raise
+            logger.warning('partition swap waited too long for a lock, retrying',
+                           extra={'table': table, 'attempt': attempt, 'error': str(e)})
+            time.sleep(attempt)
+
+    left = db.execute(f'''
+        SELECT COUNT(*) FROM {table}_unpartitioned t
+        WHERE NOT EXISTS (SELECT 1 FROM employees e WHERE e.employee_id = t.employee_id)
+    ''', conn=conn).fetchone()[0]
+    conn.commit()
+    logger.info('partitioned table', extra={'table': table, 'rows': copied, 'orphans_left': left})
+    if progress:
+        progress(f'{table}: partitioned, {copied} rows copied, {left} orphaned rows left in {table}_unpartitioned')
+
+
+# ===== SQLITE =====
+
+def _sqlite_columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+
+
+def _sqlite_year_schemas(conn):
+    return sorted(row[1] for row in conn.execute('PRAGMA database_list') if YEAR_SCHEMA.fullmatch(row[1]))
+
+
+def _year_files():
+    """[(year, path, mtime)] of the year databases, oldest first"""
+    try:
+        entries = list(os.scandir(SQLITE_YEAR_DIR))
+    except FileNotFoundError:
+        return []
+    files = [(match.group(1), entry.path, entry.stat().st_mtime_ns)
+             for entry in entries for match in [YEAR_FILE.fullmatch(entry.name)] if match]
+    return sorted(files)
+
+
+@db.on_sqlite_checkout
+def refresh_layout(conn):
+    """Attach the year databases and (re)create the temporary {table}_history views.
+
+    Cheap when nothing changed: the main schema version and the year files
+    are compared with what the connection last saw.
+    """
+    years = _year_files()
+    key = (conn.execute('PRAGMA main.schema_version').fetchone()[0], tuple(years))
+    if conn.layout == key:
+        return
+
+    wanted = {f'y{year}': path for year, path, _ in years}
+    attached = set(_sqlite_year_schemas(conn))
+    for schema in attached - set(wanted):
+        conn.execute(f'DETACH DATABASE {schema}')
+    for schema in sorted(set(wanted) - attached):
+        conn.execute(f'ATTACH DATABASE ? AS {schema}', (wanted[schema],))
+
+    # Temporary objects are writes as far as query_only is concerned
+    read_only = conn.execute('PRAGMA query_only').fetchone()[0]
+    if read_only:
+        conn.execute('PRAGMA query_only = OFF')
+    complete = True
+    try:
+        for table in PARTITIONED_TABLES:
+            conn.execute(f'DROP VIEW IF EXISTS temp.{table}_history')
+            columns = _sqlite_columns(conn, 'main', table)
+            if not columns:
+                # Not created yet (first startup); try again next checkout
+                complete = False
+                continue
+            selects = [f'SELECT {", ".join(columns)} FROM main.{table}']
+            for schema in sorted(wanted):
+                have = set(_sqlite_columns(conn, schema, table))
+                if have:
+                    selects.append(f'SELECT {_select_list(columns, have)} FROM {schema}.{table}')
+            conn.execute(f'CREATE TEMP VIEW {table}_history AS ' + ' UNION ALL '.join(selects))
+    finally:
+        if read_only:
+            conn.execute('PRAGMA query_only = ON')
+    conn.layout = key if complete else None
+
+
+def _sqlite_prepare_year(conn, table, year):
+    """Create (or catch up) ``table`` in the year database, then attach it here"""
+    os.makedirs(SQLITE_YEAR_DIR, exist_ok=True)
+    create = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                          (table,)).fetchone()[0]
+    indexes = conn.execute("SELECT name, sql FROM main.sqlite_master WHERE type = 'index' AND tbl_name = ? "
+                           "AND sql IS NOT NULL", (table,)).fetchall()
+    main_columns = conn.execute(f'PRAGMA main.table_info({table})').fetchall()
+
+    year_db = db.connect_sqlite(os.path.join(SQLITE_YEAR_DIR, f'{year}.db'))
+    try:
+        have = {row[1] for row in year_db.execute(f'PRAGMA table_info({table})')}
+        if not have:
+            year_db.execute(create)
+        else:
+            # Columns added to the main table since the year was started
+            for column in main_columns:
+                if column['name'] not in have:
+                    default = f" DEFAULT {column['dflt_value']}" if column['dflt_value'] is not None else ''
+                    year_db.execute(f"ALTER TABLE {table} ADD COLUMN {column['name']} {column['type']}{default}")
+        existing = {row[0] for row in year_db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        for name, sql in indexes:
+            if name not in existing:
+                year_db.execute(sql)
+        year_db.commit()
+    finally:
+        year_db.close()
+    refresh_layout(conn)
+
+
+def _sqlite_move_closed_years(conn, chunk_size=PARTITION_COPY_CHUNK, pause=PARTITION_COPY_PAUSE,
+                              deadline=None, progress=None):
+    """Move rows older than the live years into their year databases, a chunk per transaction.
+
+    The copy and the delete are one transaction, but WAL commits are only
+    atomic per file: after a crash in between a row can be in both, and
+    the next run simply copies it over again before deleting it.
+    """
+    if SQLITE_LIVE_YEARS <= 0:
+        return True
+    refresh_layout(conn)
+    horizon = date(date.today().year - SQLITE_LIVE_YEARS + 1, 1, 1).isoformat()
+    for table in PARTITIONED_TABLES:
+        columns = ', '.join(_sqlite_columns(conn, 'main', table))
+        years = [row[0] for row in conn.execute(
+            f'SELECT DISTINCT substr(work_date, 1, 4) FROM main.{table} WHERE work_date < ?', (horizon,))]
+        for year in years:
+            _sqlite_prepare_year(conn, table, year)
+            bounds = (f'{year}-01-01', f'{int(year) + 1}-01-01')
+            moved = 0
+            while True:
+                if deadline is not None and time.monotonic() > deadline:
+                    return False
+                chunk = conn.execute(f'''
+                    SELECT MAX(id), COUNT(*) FROM (
+                        SELECT id FROM main.{table} WHERE work_date >= ? AND work_date < ? ORDER BY id LIMIT ?
+                    )
+                ''', (*bounds, chunk_size)).fetchone()
+                if not chunk[1]:
+                    break
+                where = 'work_date >= ? AND work_date < ? AND id <= ?'
+                conn.execute(f'INSERT OR REPLACE INTO y{year}.{table} ({columns}) '
+                             f'SELECT {columns} FROM main.{table} WHERE {where}', (*bounds, chunk[0]))
+                conn.execute(f'DELETE FROM main.{table} WHERE {where}', (*bounds, chunk[0]))
+                conn.commit()
+                moved += chunk[1]
+                if progress:
+                    progress(f'{table}: moved {moved} rows into {year}')
+                time.sleep(pause)
+            logger.info('moved closed year', extra={'table': table, 'year': year, 'rows': moved})
+    return True
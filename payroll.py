@@ -0,0 +1,389 @@
+import os
+
+import rollups
+from db import statement, query, month_range, inserted_id
+
+# Payroll aggregates shared by the dashboards, payments pages and exports.
+#
+# Totals are read from payroll_monthly_summary, one row per employee and
+# month. Every write to work_entries, advance_payments, food_expenses or
+# payment_records calls refresh_summary() in the same transaction so the
+# summary never lags the raw rows; rebuild_summary() recomputes it from
+# scratch and reports any drift.
+#
+# Earnings use the hourly rate stamped on each work entry when it was
+# written, so changing an employee's rate only affects later entries. The
+# summary keeps normal, overtime and holiday hours priced at those rates
+# (before the multipliers), which month pay is computed from.
+# Every change refresh_summary() makes to a month's earnings or payments
+# is also posted to payroll_ledger, and added to the employee's running
+# balance in employee_balances, so the pending amount is a single-row
+# read. Balances are checkpointed periodically; balance_at() rebuilds a
+# past balance from the nearest checkpoint. The days themselves are logged
+# for the report rollups (see rollups.py).
+LEDGER_CHECKPOINT_HOURS = float(os.environ.get('LEDGER_CHECKPOINT_HOURS', 24))
+# Decimal places kept on postings, so float noise never posts a change
+LEDGER_PRECISION = 6
+
+# Raw rows per (employee, month). Each child table is reduced on its own
+# and stacked with UNION ALL, so rows never multiply across tables.
+SUMMARY_SOURCE_SQL = '''
+    SELECT employee_id, {month(work_date)} AS month,
+           normal_hours, overtime_hours, holiday_hours,
+           0 AS advances, 0 AS food_expenses, 0 AS amount_paid,
+           (normal_hours + overtime_hours + holiday_hours) * hourly_rate AS earnings,
+           normal_hours * hourly_rate AS normal_earnings,
+           overtime_hours * hourly_rate AS overtime_earnings,
+           holiday_hours * hourly_rate AS holiday_earnings
+    FROM {history(work_entries)}
+    UNION ALL
+    SELECT employee_id, {month(payment_date)}, 0, 0, 0, amount, 0, 0, 0, 0, 0, 0
+    FROM advance_payments
+    UNION ALL
+    SELECT employee_id, {month(expense_date)}, 0, 0, 0, 0, amount, 0, 0, 0, 0, 0
+    FROM food_expenses
+    UNION ALL
+    SELECT employee_id, {month(payment_date)}, 0, 0, 0, 0, 0, amount_paid, 0, 0, 0, 0
+    FROM payment_records
+'''
+
+SUMMARY_COLUMNS = ('normal_hours', 'overtime_hours', 'holiday_hours', 'advances', 'food_expenses', 'amount_paid',
+                   'earnings', 'normal_earnings', 'overtime_earnings', 'holiday_earnings')
+
+REBUILD_SUMMARY_SQL = f'''
+    INSERT INTO payroll_monthly_summary
+        (employee_id, month, normal_hours, overtime_hours, holiday_hours, advances, food_expenses, amount_paid,
+         earnings, normal_earnings, overtime_earnings, holiday_earnings)
+    SELECT employee_id, month,
+           SUM(normal_hours), SUM(overtime_hours), SUM(holiday_hours),
+           SUM(advances), SUM(food_expenses), SUM(amount_paid), COALESCE(SUM(earnings), 0),
+           COALESCE(SUM(normal_earnings), 0), COALESCE(SUM(overtime_earnings), 0), COALESCE(SUM(holiday_earnings), 0)
+    FROM ({SUMMARY_SOURCE_SQL}) source
+    GROUP BY employee_id, month
+'''
+
+# ===== SUMMARY READS =====
+
+statement('payroll_month', '''
+    SELECT e.employee_id, e.full_name, e.hourly_rate,
+           COALESCE(s.normal_hours, 0) as total_normal_hours,
+           COALESCE(s.overtime_hours, 0) as total_overtime_hours,
+           COALESCE(s.holiday_hours, 0) as total_holiday_hours,
+           COALESCE(s.normal_earnings, 0) as normal_earnings,
+           COALESCE(s.overtime_earnings, 0) as overtime_earnings,
+           COALESCE(s.holiday_earnings, 0) as holiday_earnings,
+           COALESCE(s.advances, 0) as total_advances,
+           COALESCE(s.food_expenses, 0) as total_food_expenses
+    FROM employees e
+    LEFT JOIN payroll_monthly_summary s ON s.employee_id = e.employee_id AND s.month = ?
+    ORDER BY e.employee_id
+''', prepare=True)
+
+statement('employee_payroll_month', '''
+    SELECT e.employee_id, e.full_name, e.hourly_rate,
+           COALESCE(s.normal_hours, 0) as total_normal_hours,
+           COALESCE(s.overtime_hours, 0) as total_overtime_hours,
+           COALESCE(s.holiday_hours, 0) as total_holiday_hours,
+           COALESCE(s.normal_earnings, 0) as normal_earnings,
+           COALESCE(s.overtime_earnings, 0) as overtime_earnings,
+           COALESCE(s.holiday_earnings, 0) as holiday_earnings,
+           COALESCE(s.advances, 0) as total_advances,
+           COALESCE(s.food_expenses, 0) as total_food_expenses
+    FROM employees e
+    LEFT JOIN payroll_monthly_summary s ON s.employee_id = e.employee_id AND s.month = ?
+    WHERE e.employee_id = ?
+''', prepare=True)
+
+statement('payroll_lifetime', '''
+    SELECT e.*,
+           COALESCE(b.earned, 0) as total_earnings,
+           COALESCE(b.paid, 0) as total_paid
+    FROM employees e
+    LEFT JOIN employee_balances b ON b.employee_id = e.employee_id
+    ORDER BY e.full_name
+''', prepare=True)
+
+statement('employee_payroll_lifetime', '''
+    SELECT e.employee_id,
+           COALESCE(b.earned, 0) as total_earnings,
+           COALESCE(b.paid, 0) as total_paid
+    FROM employees e
+    LEFT JOIN employee_balances b ON b.employee_id = e.employee_id
+    WHERE e.employee_id = ?
+''', prepare=True)
+
+# ===== SUMMARY MAINTENANCE =====
+
+statement('payroll_summary_key_from_raw', '''
+    SELECT COUNT(*) AS source_rows,
+           COALESCE(SUM(normal_hours), 0) AS normal_hours,
+           COALESCE(SUM(overtime_hours), 0) AS overtime_hours,
+           COALESCE(SUM(holiday_hours), 0) AS holiday_hours,
+           COALESCE(SUM(advances), 0) AS advances,
+           COALESCE(SUM(food_expenses), 0) AS food_expenses,
+           COALESCE(SUM(amount_paid), 0) AS amount_paid,
+           COALESCE(SUM(earnings), 0) AS earnings,
+           COALESCE(SUM(normal_earnings), 0) AS normal_earnings,
+           COALESCE(SUM(overtime_earnings), 0) AS overtime_earnings,
+           COALESCE(SUM(holiday_earnings), 0) AS holiday_earnings
+    FROM (
+        SELECT normal_hours, overtime_hours, holiday_hours,
+               0 AS advances, 0 AS food_expenses, 0 AS amount_paid,
+               (normal_hours + overtime_hours + holiday_hours) * hourly_rate AS earnings,
+               normal_hours * hourly_rate AS normal_earnings,
+               overtime_hours * hourly_rate AS overtime_earnings,
+               holiday_hours * hourly_rate AS holiday_earnings
+        FROM {history(work_entries)} WHERE employee_id = ? AND work_date >= ? AND work_date < ?
+        UNION ALL
+        SELECT 0, 0, 0, amount, 0, 0, 0, 0, 0, 0
+        FROM advance_payments WHERE employee_id = ? AND payment_date >= ? AND payment_date < ?
+        UNION ALL
+        SELECT 0, 0, 0, 0, amount, 0, 0, 0, 0, 0
+        FROM food_expenses WHERE employee_id = ? AND expense_date >= ? AND expense_date < ?
+        UNION ALL
+        SELECT 0, 0, 0, 0, 0, amount_paid, 0, 0, 0, 0
+        FROM payment_records WHERE employee_id = ? AND payment_date >= ? AND payment_date < ?
+    ) source
+''')
+
+statement('payroll_summary_key', '''
+    SELECT earnings, amount_paid FROM payroll_monthly_summary WHERE employee_id = ? AND month = ?
+''')
+
+# Entries written since the last refresh get the employee's current rate
+statement('stamp_work_entry_rates', '''
+    UPDATE work_entries
+    SET hourly_rate = (SELECT e.hourly_rate FROM employees e WHERE e.employee_id = work_entries.employee_id)
+    WHERE employee_id = ? AND work_date >= ? AND work_date < ? AND hourly_rate IS NULL
+''')
+
+statement('stamp_all_work_entry_rates', '''
+    UPDATE work_entries
+    SET hourly_rate = (SELECT e.hourly_rate FROM employees e WHERE e.employee_id = work_entries.employee_id)
+    WHERE hourly_rate IS NULL
+''')
+
+statement('upsert_payroll_summary', '''
+    INSERT INTO payroll_monthly_summary
+        (employee_id, month, normal_hours, overtime_hours, holiday_hours, advances, food_expenses, amount_paid,
+         earnings, normal_earnings, overtime_earnings, holiday_earnings, updated_date)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT (employee_id, month) DO UPDATE SET
+        normal_hours = excluded.normal_hours,
+        overtime_hours = excluded.overtime_hours,
+        holiday_hours = excluded.holiday_hours,
+        advances = excluded.advances,
+        food_expenses = excluded.food_expenses,
+        amount_paid = excluded.amount_paid,
+        earnings = excluded.earnings,
+        normal_earnings = excluded.normal_earnings,
+        overtime_earnings = excluded.overtime_earnings,
+        holiday_earnings = excluded.holiday_earnings,
+        updated_date = excluded.updated_date
+''')
+
+statement('delete_payroll_summary_key', 'DELETE FROM payroll_monthly_summary WHERE employee_id = ? AND month = ?')
+
+statement('delete_employee_payroll_summary', 'DELETE FROM payroll_monthly_summary WHERE employee_id = ?')
+
+statement('payroll_summary_rows', f'''
+    SELECT employee_id, month, {', '.join(SUMMARY_COLUMNS)}
+    FROM payroll_monthly_summary
+''')
+
+statement('payroll_summary_from_raw', f'''
+    SELECT employee_id, month,
+           SUM(normal_hours) AS normal_hours, SUM(overtime_hours) AS overtime_hours,
+           SUM(holiday_hours) AS holiday_hours, SUM(advances) AS advances,
+           SUM(food_expenses) AS food_expenses, SUM(amount_paid) AS amount_paid,
+           COALESCE(SUM(earnings), 0) AS earnings, COALESCE(SUM(normal_earnings), 0) AS normal_earnings,
+           COALESCE(SUM(overtime_earnings), 0) AS overtime_earnings,
+           COALESCE(SUM(holiday_earnings), 0) AS holiday_earnings
+    FROM ({SUMMARY_SOURCE_SQL}) source
+    GROUP BY employee_id, month
+''')
+
+statement('truncate_payroll_summary', 'DELETE FROM payroll_monthly_summary')
+
+statement('rebuild_payroll_summary', REBUILD_SUMMARY_SQL)
+
+# ===== LEDGER =====
+
+statement('insert_ledger_posting', '''
+    INSERT INTO payroll_ledger (employee_id, month, earned, paid) VALUES (?, ?, ?, ?) {returning_id}
+''')
+
+statement('open_employee_balance', '''
+    INSERT INTO employee_balances (employee_id) VALUES (?) ON CONFLICT (employee_id) DO NOTHING
+''')
+
+# Taken before reading the summary, so concurrent writers for one employee
+# post their deltas one after the other
+statement('lock_employee_balance', '''
+    UPDATE employee_balances SET updated_date = CURRENT_TIMESTAMP WHERE employee_id = ?
+''')
+
+statement('add_to_employee_balance', '''
+    UPDATE employee_balances
+    SET earned = earned + ?, paid = paid + ?, last_posting_id = ?, updated_date = CURRENT_TIMESTAMP
+    WHERE employee_id = ?
+''')
+
+statement('employee_balance_rows', 'SELECT employee_id, earned, paid FROM employee_balances')
+
+statement('summary_lifetime_totals', '''
+    SELECT employee_id, SUM(earnings) AS earned, SUM(amount_paid) AS paid
+    FROM payroll_monthly_summary
+    GROUP BY employee_id
+''')
+
+statement('checkpoint_employee_balances', '''
+    INSERT INTO payroll_ledger_checkpoints (employee_id, posting_id, earned, paid)
+    SELECT b.employee_id, b.last_posting_id, b.earned, b.paid
+    FROM employee_balances b
+    WHERE b.last_posting_id > COALESCE(
+        (SELECT MAX(c.posting_id) FROM payroll_ledger_checkpoints c WHERE c.employee_id = b.employee_id), 0)
+''')
+
+statement('ledger_checkpoint_before', '''
+    SELECT posting_id, earned, paid FROM payroll_ledger_checkpoints
+    WHERE employee_id = ? AND created_date <= ?
+    ORDER BY posting_id DESC
+    LIMIT 1
+''')
+
+statement('ledger_postings_since', '''
+    SELECT COALESCE(SUM(earned), 0) AS earned, COALESCE(SUM(paid), 0) AS paid
+    FROM payroll_ledger
+    WHERE employee_id = ? AND id > ? AND posted_date <= ?
+''')
+
+statement('delete_employee_payroll_ledger', 'DELETE FROM payroll_ledger WHERE employee_id = ?')
+statement('delete_employee_balance', 'DELETE FROM employee_balances WHERE employee_id = ?')
+statement('delete_employee_ledger_checkpoints', 'DELETE FROM payroll_ledger_checkpoints WHERE employee_id = ?')
+
+
+def month_totals(month, conn=None):
+    """Hours, advances and food expenses per employee for a 'YYYY-MM' month"""
+    return query('payroll_month', (month,), conn=conn).fetchall()
+
+
+def employee_month_totals(employee_id, month, conn=None):
+    """One employee's month_totals row (zeros when nothing was recorded)"""
+    return query('employee_payroll_month', (month, employee_id), conn=conn).fetchone()
+
+
+def lifetime_totals(conn=None):
+    """Every employee row with lifetime total_earnings and total_paid"""
+    return query('payroll_lifetime', conn=conn).fetchall()
+
+
+def employee_lifetime_totals(employee_id, conn=None):
+    return query('employee_payroll_lifetime', (employee_id,), conn=conn).fetchone()
+
+
+def refresh_summary(employee_id, *days, conn=None):
+    """Recompute the summary rows for the months containing ``days`` and post the change to the ledger.
+
+    Call this inside the transaction that wrote the raw rows, passing both
+    the old and the new date when an edit moves a row between months.
+    A 'YYYY-MM' month may be passed for a day when a whole month changed.
+    """
+    months = sorted({str(day)[:7] for day in days if day})
+    if not months:
+        return
+    rollups.log_changes(employee_id, days, conn=conn)
+    query('open_employee_balance', (employee_id,), conn=conn)
+    query('lock_employee_balance', (employee_id,), conn=conn)
+    for month in months:
+        start, end = month_range(month)
+        query('stamp_work_entry_rates', (employee_id, start, end), conn=conn)
+        before = query('payroll_summary_key', (employee_id, month), conn=conn).fetchone()
+        totals = query('payroll_summary_key_from_raw', (employee_id, start, end) * 4, conn=conn).fetchone()
+        if totals['source_rows']:
+            query('upsert_payroll_summary',
+                  (employee_id, month) + tuple(totals[c] for c in SUMMARY_COLUMNS), conn=conn)
+        else:
+            query('delete_payroll_summary_key', (employee_id, month), conn=conn)
+        had_earned, had_paid = (before['earnings'] or 0, before['amount_paid'] or 0) if before else (0, 0)
+        earned = round(totals['earnings'] - had_earned, LEDGER_PRECISION)
+        paid = round(totals['amount_paid'] - had_paid, LEDGER_PRECISION)
+        if earned or paid:
+            post(employee_id, month, earned, paid, conn=conn)
+
+
+def post(employee_id, month, earned, paid, conn=None):
+    """Append a ledger posting and add it to the running balance (the balance row must exist)"""
+    posting_id = inserted_id(query('insert_ledger_posting', (employee_id, month, earned, paid), conn=conn))
+    query('add_to_employee_balance', (earned, paid, posting_id, employee_id), conn=conn)
+    return posting_id
+
+
+def checkpoint_balances(conn):
+    """Snapshot every balance that moved since its last checkpoint; returns how many"""
+    count = query('checkpoint_employee_balances', conn=conn).rowcount
+    conn.commit()
+    return count
+
+
+def balance_at(employee_id, when, conn=None):
+    """(earned, paid) as the ledger stood at ``when`` ('YYYY-MM-DD HH:MM:SS'), from the nearest checkpoint"""
+    checkpoint = query('ledger_checkpoint_before', (employee_id, when), conn=conn).fetchone()
+    posting_id, earned, paid = (checkpoint['posting_id'], checkpoint['earned'], checkpoint['paid']) if checkpoint else (0, 0, 0)
+    since = query('ledger_postings_since', (employee_id, posting_id, when), conn=conn).fetchone()
+    return earned + since['earned'], paid + since['paid']
+
+
+def forget_employee(employee_id, conn=None):
+    """Drop an employee's summary, ledger and balance rows; the caller commits"""
+    rollups.forget_employee(employee_id, conn=conn)
+    for name in ('delete_employee_payroll_summary', 'delete_employee_payroll_ledger', 'delete_employee_balance',
+                 'delete_employee_ledger_checkpoints'):
+        query(name, (employee_id,), conn=conn)
+
+
+def rebuild_summary(conn, check_only=False, tolerance=1e-6):
+    """Recompute payroll_monthly_summary from the raw rows.
+
+    Returns the (employee_id, month) keys whose stored totals had drifted
+    from the raw data. With ``check_only`` the table is left untouched;
+    otherwise balances that no longer match the summary get a correcting
+    ledger posting.
+    """
+    def load(name):
+        return {(row['employee_id'], row['month']): tuple(row[c] or 0 for c in SUMMARY_COLUMNS)
+                for row in query(name, conn=conn).fetchall()}
+
+    if not check_only:
+        query('stamp_all_work_entry_rates', conn=conn)
+    expected = load('payroll_summary_from_raw')
+    actual = load('payroll_summary_rows')
+    zeros = (0,) * len(SUMMARY_COLUMNS)
+    drift = sorted(
+        key for key in expected.keys() | actual.keys()
+        if any(abs(a - b) > tolerance for a, b in zip(expected.get(key, zeros), actual.get(key, zeros)))
+    )
+
+    if not check_only:
+        query('truncate_payroll_summary', conn=conn)
+        query('rebuild_payroll_summary', conn=conn)
+        correct_balances(conn, tolerance)
+        conn.commit()
+    return drift
+
+
+def correct_balances(conn, tolerance=1e-6):
+    """Post the difference wherever a running balance disagrees with the summary; returns the employees corrected"""
+    balances = {row['employee_id']: (row['earned'], row['paid']) for row in query('employee_balance_rows', conn=conn)}
+    totals = {row['employee_id']: (row['earned'] or 0, row['paid'] or 0)
+              for row in query('summary_lifetime_totals', conn=conn)}
+    corrected = []
+    for employee_id in sorted(balances.keys() | totals.keys()):
+        earned, paid = totals.get(employee_id, (0, 0))
+        have_earned, have_paid = balances.get(employee_id, (0, 0))
+        if abs(earned - have_earned) > tolerance or abs(paid - have_paid) > tolerance:
+            query('open_employee_balance', (employee_id,), conn=conn)
+            post(employee_id, None, round(earned - have_earned, LEDGER_PRECISION),
+                 round(paid - have_paid, LEDGER_PRECISION), conn=conn)
+            corrected.append(employee_id)
+    return corrected
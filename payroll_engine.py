@@ -0,0 +1,170 @@
+import os
+
+# NumPy import with fallback: the plain-Python path gives the same results, only slower
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Hours and pay for whole columns of work entries at once. Every caller
+# (single entries from the forms, month rows on the dashboards, export
+# batches) goes through the same rules, so pay is computed one way only.
+#
+# Times are 'HH:MM' strings; a shift whose end is before its start ends on
+# the next day (overnight). Batches smaller than NUMPY_MIN_BATCH take the
+# plain-Python path, where array setup would cost more than it saves.
+NUMPY_MIN_BATCH = 64
+
+
+class PayrollRules:
+    """Daily overtime threshold and pay multipliers"""
+
+    def __init__(self, normal_hours=8.0, overtime_multiplier=1.5, holiday_multiplier=1.5, default_break_minutes=60):
+        self.normal_hours = normal_hours
+        self.overtime_multiplier = overtime_multiplier
+        self.holiday_multiplier = holiday_multiplier
+        self.default_break_minutes = default_break_minutes
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            normal_hours=float(os.environ.get('PAYROLL_NORMAL_HOURS', 8)),
+            overtime_multiplier=float(os.environ.get('PAYROLL_OVERTIME_MULTIPLIER', 1.5)),
+            holiday_multiplier=float(os.environ.get('PAYROLL_HOLIDAY_MULTIPLIER', 1.5)),
+            default_break_minutes=int(os.environ.get('PAYROLL_DEFAULT_BREAK_MINUTES', 60)),
+        )
+
+
+RULES = PayrollRules.from_env()
+
+HOUR_COLUMNS = ('normal_hours', 'overtime_hours', 'holiday_hours', 'overnight')
+PAY_COLUMNS = ('normal_pay', 'overtime_pay', 'holiday_pay', 'total_pay')
+
+
+def _minutes(value):
+    """Minutes since midnight for one 'HH:MM' (or 'H:MM', 'HH:MM:SS') string"""
+    hours, sep, rest = str(value).partition(':')
+    if not sep:
+        raise ValueError(f'Invalid time {value!r}')
+    return int(hours) * 60 + int(rest[:2])
+
+
+def parse_minutes(times):
+    """Minutes since midnight for a column of time strings"""
+    if not NUMPY_AVAILABLE or len(times) < NUMPY_MIN_BATCH:
+        return [_minutes(value) for value in times]
+
+    # Read the 'HH:MM' bytes as digits instead of parsing each string
+    raw = np.array(times, dtype='S5')
+    digits = raw.view(np.uint8).reshape(-1, 5).astype(np.int32) - ord('0')
+    minutes = (digits[:, 0] * 10 + digits[:, 1]) * 60 + digits[:, 3] * 10 + digits[:, 4]
+    clock = digits[:, [0, 1, 3, 4]]
+    irregular = (digits[:, 2] != ord(':') - ord('0')) | ((clock < 0) | (clock > 9)).any(axis=1)
+    for i in np.flatnonzero(irregular):
+        minutes[i] = _minutes(times[i])
+    return minutes
+
+
+def _column(values):
+    """float64 array with NULLs (None) as 0"""
+    return np.nan_to_num(np.asarray(values, dtype=np.float64), copy=False)
+
+
+def compute_hours(start_times, end_times, break_minutes=None, is_holiday=None, rules=RULES):
+    """Normal, overtime and holiday hours plus an overnight flag per entry.
+
+    Returns a dict of HOUR_COLUMNS, each a list as long as ``start_times``.
+    Worked time never goes below zero, however long the break.
+    """
+    count = len(start_times)
+    if break_minutes is None:
+        break_minutes = [rules.default_break_minutes] * count
+    if is_holiday is None:
+        is_holiday = [False] * count
+    starts = parse_minutes(start_times)
+    ends = parse_minutes(end_times)
+
+    if not NUMPY_AVAILABLE or count < NUMPY_MIN_BATCH:
+        columns = {name: [] for name in HOUR_COLUMNS}
+        for start, end, pause, holiday in zip(starts, ends, break_minutes, is_holiday):
+            overnight = end < start
+            worked = max((end + 1440 if overnight else end) - start - (pause or 0), 0) / 60
+            if holiday:
+                normal, overtime, holiday_hours = 0, 0, worked
+            else:
+                normal, overtime, holiday_hours = min(worked, rules.normal_hours), max(worked - rules.normal_hours, 0), 0
+            columns['normal_hours'].append(normal)
+            columns['overtime_hours'].append(overtime)
+            columns['holiday_hours'].append(holiday_hours)
+            columns['overnight'].append(overnight)
+        return columns
+
+    starts = np.asarray(starts)
+    ends = np.asarray(ends)
+    pauses = _column(break_minutes)
+    holidays = np.asarray(is_holiday, dtype=bool)
+    overnight = ends < starts
+    worked = np.maximum(np.where(overnight, ends + 1440, ends) - starts - pauses, 0) / 60
+    regular = np.where(holidays, 0, worked)
+    return {
+        'normal_hours': np.minimum(regular, rules.normal_hours).tolist(),
+        'overtime_hours': np.maximum(regular - rules.normal_hours, 0).tolist(),
+        'holiday_hours': np.where(holidays, worked, 0).tolist(),
+        'overnight': overnight.tolist(),
+    }
+
+
+def compute_pay(normal_hours, overtime_hours, holiday_hours, hourly_rates, rules=RULES):
+    """Pay per entry (or per employee-month) as a dict of PAY_COLUMNS lists"""
+    if not NUMPY_AVAILABLE or len(normal_hours) < NUMPY_MIN_BATCH:
+        columns = {name: [] for name in PAY_COLUMNS}
+        for normal, overtime, holiday, rate in zip(normal_hours, overtime_hours, holiday_hours, hourly_rates):
+            rate = rate or 0
+            normal_pay = (normal or 0) * rate
+            overtime_pay = (overtime or 0) * rate * rules.overtime_multiplier
+            holiday_pay = (holiday or 0) * rate * rules.holiday_multiplier
+            columns['normal_pay'].append(normal_pay)
+            columns['overtime_pay'].append(overtime_pay)
+            columns['holiday_pay'].append(holiday_pay)
+            columns['total_pay'].append(normal_pay + overtime_pay + holiday_pay)
+        return columns
+
+    rates = _column(hourly_rates)
+    normal_pay = _column(normal_hours) * rates
+    overtime_pay = _column(overtime_hours) * rates * rules.overtime_multiplier
+    holiday_pay = _column(holiday_hours) * rates * rules.holiday_multiplier
+    return {
+        'normal_pay': normal_pay.tolist(),
+        'overtime_pay': overtime_pay.tolist(),
+        'holiday_pay': holiday_pay.tolist(),
+        'total_pay': (normal_pay + overtime_pay + holiday_pay).tolist(),
+    }
+
+
+def entry_hours(start_time, end_time, break_minutes=60, is_holiday=False, rules=RULES):
+    """(normal, overtime, holiday) hours for a single entry"""
+    hours = compute_hours([start_time], [end_time], [break_minutes], [is_holiday], rules)
+    return hours['normal_hours'][0], hours['overtime_hours'][0], hours['holiday_hours'][0]
+
+
+# Month rows carry their hours already priced at each entry's stamped rate
+# (normal_earnings etc.), so they go through compute_pay at a rate of 1 and
+# only pick up the multipliers; a later rate change never reprices them.
+
+def month_pay(row, rules=RULES):
+    """Pay columns for one payroll.month_totals row, as a dict"""
+    return {name: values[0] for name, values in compute_pay(
+        [row['normal_earnings']], [row['overtime_earnings']], [row['holiday_earnings']], [1], rules).items()}
+
+
+def with_pay(rows, rules=RULES):
+    """payroll.month_totals rows as dicts with pay columns and grand_total added"""
+    rows = [dict(row) for row in rows]
+    pay = compute_pay([row['normal_earnings'] for row in rows], [row['overtime_earnings'] for row in rows],
+                      [row['holiday_earnings'] for row in rows], [1] * len(rows), rules)
+    for i, row in enumerate(rows):
+        for name in PAY_COLUMNS:
+            row[name] = pay[name][i]
+        row['grand_total'] = row['total_pay'] - (row['total_advances'] or 0) - (row['total_food_expenses'] or 0)
+    return rows
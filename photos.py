@@ -0,0 +1,252 @@
+import base64
+import binascii
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+
+from db import statement, query
+from logs import get_logger
+
+# Pillow import with fallback: without it every size is served as the original
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Attendance photos live on disk, addressed by the SHA-256 of their bytes
+# and sharded two levels deep (ab/cd/abcd...). attendance_photos keeps only
+# the hash and metadata, so listing photos never drags image data along.
+PHOTO_STORAGE_DIR = os.path.abspath(os.environ.get('PHOTO_STORAGE_DIR', 'photo_store'))
+
+# Longest edge in pixels for each thumbnail size
+THUMBNAIL_SIZES = {'small': 160, 'medium': 640}
+THUMBNAIL_QUALITY = 80
+
+# Capture profile: what the dashboard camera uploads (longest edge, encoder
+# quality 0-1, preferred types and a byte budget). Clients get it from
+# /employee/capture_profile. The server refuses bodies over
+# CAPTURE_UPLOAD_LIMIT before reading them and re-encodes anything else
+# that is off-profile, so older clients still work.
+CAPTURE_MAX_EDGE = int(os.environ.get('CAPTURE_MAX_EDGE', 800))
+CAPTURE_QUALITY = float(os.environ.get('CAPTURE_QUALITY', 0.7))
+CAPTURE_MAX_BYTES = int(os.environ.get('CAPTURE_MAX_BYTES', 150 * 1024))
+CAPTURE_TYPES = ('image/webp', 'image/jpeg')
+CAPTURE_UPLOAD_LIMIT = int(os.environ.get('CAPTURE_UPLOAD_LIMIT', 2 * 2 ** 20))
+# Re-encoding steps down to this quality before giving up on the budget
+CAPTURE_MIN_QUALITY = 0.4
+
+logger = get_logger('photos')
+
+statement('insert_attendance_photo', '''
+    INSERT INTO attendance_photos (employee_id, work_date, photo_type, photo_data, photo_hash, content_type, byte_size)
+    VALUES (?, ?, ?, '', ?, ?, ?)
+''')
+
+statement('attendance_photo_by_id', '''
+    SELECT id, employee_id, work_date, photo_type, photo_hash, content_type, byte_size, created_date
+    FROM {history(attendance_photos)} WHERE id = ?
+''')
+
+statement('attendance_photo_with_name', '''
+    SELECT p.id, p.employee_id, p.work_date, p.photo_type, p.photo_hash, p.content_type, p.byte_size, p.created_date,
+           e.full_name
+    FROM {history(attendance_photos)} p
+    LEFT JOIN employees e ON e.employee_id = p.employee_id
+    WHERE p.id = ?
+''')
+
+statement('employee_recent_photos', '''
+    SELECT id, employee_id, work_date, photo_type, photo_hash, content_type, byte_size, created_date
+    FROM {history(attendance_photos)}
+    WHERE employee_id = ?
+    ORDER BY work_date DESC, id DESC
+    LIMIT ?
+''')
+
+statement('attendance_photo_inline_data', 'SELECT photo_data FROM {history(attendance_photos)} WHERE id = ?')
+
+# Keyset batches of rows still carrying base64 in photo_data
+statement('inline_attendance_photos', '''
+    SELECT id, photo_data FROM attendance_photos
+    WHERE id > ? AND photo_hash IS NULL
+    ORDER BY id
+    LIMIT ?
+''')
+
+statement('set_attendance_photo_blob', '''
+    UPDATE attendance_photos
+    SET photo_hash = ?, content_type = ?, byte_size = ?, photo_data = ''
+    WHERE id = ?
+''')
+
+
+class BlobStore:
+    """Content-addressed files under ``root``; identical photos are stored once"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest, variant=None):
+        """Path of a blob, or of a derived ``variant`` (thumbnail) stored next to it"""
+        name = f'{digest}-{variant}' if variant else digest
+        return os.path.join(self.root, digest[:2], digest[2:4], name)
+
+    def exists(self, digest, variant=None):
+        return os.path.exists(self.path(digest, variant))
+
+    def put(self, data):
+        """Store ``data`` and return its hex SHA-256"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            self.write(path, data)
+        return digest
+
+    def write(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file in the same directory and rename, so readers
+        # never see a half-written blob
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+store = BlobStore(PHOTO_STORAGE_DIR)
+
+
+def decode_data_url(data_url):
+    """Split a ``data:image/jpeg;base64,...`` URL into (bytes, content type)"""
+    header, sep, payload = (data_url or '').partition(',')
+    if not sep or not header.startswith('data:') or not header.endswith(';base64'):
+        raise ValueError('Photo must be a base64 data URL')
+    content_type = header[len('data:'):-len(';base64')] or 'application/octet-stream'
+    try:
+        data = base64.b64decode(payload, validate=True)
+    except binascii.Error:
+        raise ValueError('Photo is not valid base64')
+    return data, content_type
+
+
+def thumbnail_path(digest, size):
+    """Path of the ``size`` thumbnail, generating and caching it on first use.
+
+    Falls back to the original when Pillow is missing or the blob is not a
+    readable image.
+    """
+    if size not in THUMBNAIL_SIZES or not PIL_AVAILABLE:
+        return store.path(digest)
+    path = store.path(digest, size)
+    if os.path.exists(path):
+        return path
+
+    edge = THUMBNAIL_SIZES[size]
+    try:
+        with Image.open(store.path(digest)) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((edge, edge))
+            buffer = BytesIO()
+            image.convert('RGB').save(buffer, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+    except (OSError, ValueError) as e:
+        logger.warning('thumbnail failed', extra={'size': size, 'digest': digest, 'error': str(e)})
+        return store.path(digest)
+    store.write(path, buffer.getvalue())
+    return path
+
+
+def make_thumbnails(digest):
+    for size in THUMBNAIL_SIZES:
+        thumbnail_path(digest, size)
+
+
+def capture_profile():
+    return {
+        'max_edge': CAPTURE_MAX_EDGE,
+        'quality': CAPTURE_QUALITY,
+        'max_bytes': CAPTURE_MAX_BYTES,
+        'types': list(CAPTURE_TYPES),
+        'upload_limit': CAPTURE_UPLOAD_LIMIT,
+    }
+
+
+def fit_capture(data, content_type):
+    """The photo as (bytes, content type) within the capture profile.
+
+    On-profile uploads are kept as they are; larger, oversized or other
+    types are re-encoded as JPEG, lowering the quality until they fit the
+    byte budget. Without Pillow (or for unreadable data) only the budget is
+    checked.
+    """
+    if len(data) > CAPTURE_UPLOAD_LIMIT:
+        raise ValueError('Photo is too large')
+    if not PIL_AVAILABLE:
+        return data, content_type
+    try:
+        with Image.open(BytesIO(data)) as image:
+            if (content_type in CAPTURE_TYPES and len(data) <= CAPTURE_MAX_BYTES
+                    and max(image.size) <= CAPTURE_MAX_EDGE):
+                return data, content_type
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((CAPTURE_MAX_EDGE, CAPTURE_MAX_EDGE))
+            image = image.convert('RGB')
+            quality = CAPTURE_QUALITY
+            while True:
+                buffer = BytesIO()
+                image.save(buffer, 'JPEG', quality=round(quality * 100), optimize=True)
+                if buffer.tell() <= CAPTURE_MAX_BYTES or quality <= CAPTURE_MIN_QUALITY:
+                    break
+                quality -= 0.1
+    except (OSError, ValueError) as e:
+        if len(data) > CAPTURE_MAX_BYTES:
+            raise ValueError(f'Photo is not a readable image: {e}')
+        return data, content_type
+    logger.debug('photo re-encoded', extra={'from_bytes': len(data), 'to_bytes': buffer.tell(),
+                                            'content_type': content_type})
+    return buffer.getvalue(), 'image/jpeg'
+
+
+def save_photo(employee_id, work_date, photo_type, data, content_type, conn=None):
+    """Store the image bytes, pre-render its thumbnails and record the attendance_photos row"""
+    digest = store.put(data)
+    make_thumbnails(digest)
+    query('insert_attendance_photo',
+          (employee_id, work_date, photo_type, digest, content_type, len(data)), conn=conn)
+    return digest
+
+
+def migrate_inline_photos(conn, batch_size=100, progress=None):
+    """Move base64 photo_data rows into the blob store, one committed batch at a time.
+
+    Only ``batch_size`` rows are held in memory; rerunning resumes where an
+    interrupted run stopped because finished rows no longer match.
+    """
+    last_id = 0
+    moved = 0
+    while True:
+        rows = query('inline_attendance_photos', (last_id, batch_size), conn=conn).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            try:
+                data, content_type = decode_data_url(row['photo_data'])
+            except ValueError as e:
+                if progress:
+                    progress(f'skipping photo {row["id"]}: {e}')
+                continue
+            query('set_attendance_photo_blob', (store.put(data), content_type, len(data), row['id']), conn=conn)
+            moved += 1
+        conn.commit()
+        last_id = rows[-1]['id']
+        if progress:
+            progress(f'moved {moved} photos (up to id {last_id})')
+    return moved
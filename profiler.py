@@ -0,0 +1,86 @@
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from logs import get_logger
+
+# Optional request profiling with cProfile. Off unless PROFILE_SAMPLE_RATE
+# (fraction of requests, e.g. 0.01) is set, or an admin adds ?_profile=1
+# to a single request. The profile of that request (top functions by
+# cumulative time) is kept in memory and its id returned in the
+# X-Profile-Id header; /admin/metrics/profiles lists the recent ones.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 20))
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_PARAM = '_profile'
+
+logger = get_logger('profiler')
+
+_ids = itertools.count(1)
+_profiles = OrderedDict()  # id -> profile dict, oldest first
+_lock = threading.Lock()
+
+
+def _report(profile):
+    out = io.StringIO()
+    pstats.Stats(profile, stream=out).strip_dirs().sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    return out.getvalue()
+
+
+def recent():
+    """Summaries of the kept profiles, newest first"""
+    with _lock:
+        return [{key: value for key, value in entry.items() if key != 'report'}
+                for entry in reversed(_profiles.values())]
+
+
+def get(profile_id):
+    with _lock:
+        return _profiles.get(profile_id)
+
+
+def init_app(app, allowed):
+    """Profile sampled requests, and single requests asking for it when ``allowed()``"""
+    from flask import g, request
+
+    @app.before_request
+    def start_profile():
+        requested = request.args.get(PROFILE_PARAM) == '1' and allowed()
+        if not requested and (not PROFILE_SAMPLE_RATE or random.random() >= PROFILE_SAMPLE_RATE):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running on this thread
+            return
+        g.profile = (profile, time.perf_counter())
+
+    @app.after_request
+    def finish_profile(response):
+        profile, started = g.pop('profile', (None, None))
+        if profile is None:
+            return response
+        profile.disable()
+        entry = {
+            'id': next(_ids),
+            'endpoint': request.endpoint,
+            'path': request.full_path.rstrip('?'),
+            'seconds': round(time.perf_counter() - started, 4),
+            'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'report': _report(profile),
+        }
+        with _lock:
+            _profiles[entry['id']] = entry
+            while len(_profiles) > PROFILE_KEEP:
+                _profiles.popitem(last=False)
+        response.headers['X-Profile-Id'] = str(entry['id'])
+        logger.info('request profiled', extra={'profile_id': entry['id'], 'endpoint': entry['endpoint'],
+                                                'seconds': entry['seconds']})
+        return response
@@ -0,0 +1,147 @@
+from db import statement
+
+# Statements are written once with ? placeholders; db.Dialect renders them
+# per backend. prepare=True marks the hot dashboard queries that Postgres
+# should plan once per connection.
+
+# ===== EMPLOYEES =====
+
+statement('employee_by_id', 'SELECT * FROM employees WHERE employee_id = ?', prepare=True)
+
+statement('employee_count', 'SELECT COUNT(*) FROM employees')
+
+statement('employee_count_by_status', 'SELECT COUNT(*) FROM employees WHERE status = ?')
+
+statement('employee_choices', 'SELECT employee_id, full_name FROM employees ORDER BY employee_id')
+
+statement('insert_employee', '''
+    INSERT INTO employees (employee_id, full_name, email, phone, hourly_rate, passport_number, bank_name, bank_account_name, bank_account_number)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+''')
+
+statement('update_employee', '''
+    UPDATE employees
+    SET full_name = ?, email = ?, phone = ?, hourly_rate = ?, passport_number = ?, bank_name = ?,
+        bank_account_name = ?, bank_account_number = ?, status = ?
+    WHERE employee_id = ?
+''')
+
+statement('delete_employee', 'DELETE FROM employees WHERE employee_id = ?')
+statement('delete_employee_work_entries', 'DELETE FROM work_entries WHERE employee_id = ?')
+statement('delete_employee_advance_payments', 'DELETE FROM advance_payments WHERE employee_id = ?')
+statement('delete_employee_food_expenses', 'DELETE FROM food_expenses WHERE employee_id = ?')
+statement('delete_employee_attendance_photos', 'DELETE FROM attendance_photos WHERE employee_id = ?')
+statement('delete_employee_payment_records', 'DELETE FROM payment_records WHERE employee_id = ?')
+
+# ===== WORK ENTRIES =====
+
+statement('employee_month_work_entries', '''
+    SELECT * FROM {history(work_entries)}
+    WHERE employee_id = ? AND work_date >= ? AND work_date < ?
+    ORDER BY work_date DESC
+''', prepare=True)
+
+statement('work_entry_for_day', 'SELECT * FROM work_entries WHERE employee_id = ? AND work_date = ?', prepare=True)
+
+statement('work_entry_by_id', 'SELECT * FROM work_entries WHERE id = ?')
+
+statement('insert_work_entry', '''
+    INSERT INTO work_entries (employee_id, work_date, start_time, end_time, break_minutes, normal_hours, overtime_hours, holiday_hours)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+''')
+
+statement('update_work_entry', '''
+    UPDATE work_entries
+    SET employee_id = ?, work_date = ?, start_time = ?, end_time = ?, break_minutes = ?,
+        normal_hours = ?, overtime_hours = ?, holiday_hours = ?
+    WHERE id = ?
+''')
+
+statement('delete_work_entry', 'DELETE FROM work_entries WHERE id = ?')
+
+statement('check_out_work_entry', '''
+    UPDATE work_entries
+    SET end_time = ?, normal_hours = ?, overtime_hours = ?, holiday_hours = ?
+    WHERE id = ?
+''')
+
+# ===== ADVANCE PAYMENTS =====
+
+statement('advances_with_names', '''
+    SELECT a.*, e.full_name
+    FROM advance_payments a
+    JOIN employees e ON e.employee_id = a.employee_id
+    ORDER BY a.payment_date DESC, a.id DESC
+''')
+
+statement('employee_recent_advances', '''
+    SELECT * FROM advance_payments
+    WHERE employee_id = ?
+    ORDER BY payment_date DESC, id DESC
+    LIMIT ?
+''')
+
+statement('advance_payment_by_id', 'SELECT * FROM advance_payments WHERE id = ?')
+
+statement('insert_advance_payment', '''
+    INSERT INTO advance_payments (employee_id, amount, payment_date, reason)
+    VALUES (?, ?, ?, ?)
+''')
+
+statement('delete_advance_payment', 'DELETE FROM advance_payments WHERE id = ?')
+
+# ===== FOOD EXPENSES =====
+
+statement('food_expenses_with_names', '''
+    SELECT f.*, e.full_name
+    FROM food_expenses f
+    JOIN employees e ON e.employee_id = f.employee_id
+    ORDER BY f.expense_date DESC, f.id DESC
+''')
+
+statement('employee_recent_food_expenses', '''
+    SELECT * FROM food_expenses
+    WHERE employee_id = ?
+    ORDER BY expense_date DESC, id DESC
+    LIMIT ?
+''')
+
+statement('food_expense_by_id', 'SELECT * FROM food_expenses WHERE id = ?')
+
+statement('insert_food_expense', '''
+    INSERT INTO food_expenses (employee_id, amount, expense_date, description)
+    VALUES (?, ?, ?, ?)
+''')
+
+statement('delete_food_expense', 'DELETE FROM food_expenses WHERE id = ?')
+
+# ===== PAYMENT RECORDS =====
+
+statement('insert_payment', '''
+    INSERT INTO payment_records (employee_id, payment_date, amount_paid, payment_type, description)
+    VALUES (?, ?, ?, ?, ?)
+''')
+
+statement('employee_payment_totals', '''
+    SELECT COUNT(*) AS payments,
+           COALESCE(SUM(amount_paid), 0) AS amount_paid,
+           COALESCE(SUM(CASE WHEN status = 'paid' THEN 1 ELSE 0 END), 0) AS paid,
+           COALESCE(SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END), 0) AS pending
+    FROM payment_records
+    WHERE employee_id = ?
+''')
+
+statement('payment_by_id', '''
+    SELECT p.*, e.full_name
+    FROM payment_records p
+    JOIN employees e ON e.employee_id = p.employee_id
+    WHERE p.id = ?
+''')
+
+statement('update_payment', '''
+    UPDATE payment_records
+    SET payment_date = ?, amount_paid = ?, payment_type = ?, status = ?, description = ?
+    WHERE id = ?
+''')
+
+statement('delete_payment', 'DELETE FROM payment_records WHERE id = ?')
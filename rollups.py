@@ -0,0 +1,400 @@
+import os
+import time
+from datetime import date, timedelta
+
+import payroll_engine
+from db import statement, query, stream, month_range
+from logs import get_logger
+
+# Report rollups. The report pages show totals per day, ISO week and month
+# across the whole workforce, and per employee. report_rollup holds them
+# precomputed, keyed by (grain, period, employee_id), with employee_id '*'
+# for everyone:
+#
+#   grain  period
+#   day    2026-10-17
+#   week   2026-W42
+#   month  2026-10
+#
+# Every write that calls payroll.refresh_summary() also appends the
+# employee and day to report_changes. refresh() drains that log in
+# batches: the changed days are recomputed from the raw rows, and the
+# weeks, months and '*' rows they fall in are summed again from the day
+# rows. Nothing is recomputed from scratch, and a 12-month trend is one
+# short range of the primary key.
+#
+# Only the job worker refreshes, on every heartbeat. Report pages never
+# write (they may read a replica): an employee with changes still waiting
+# in the requested periods has their days summed from the raw rows on the
+# fly instead, so reports are current even while the worker lags or is
+# not running. Pay uses the hourly rate stamped on each entry
+# and the payroll_engine multipliers in force when the day was rolled up;
+# after changing PAYROLL_*_MULTIPLIER run `flask rebuild-report-rollup`.
+ALL = '*'
+GRAINS = ('day', 'week', 'month')
+# Name of the period field in report rows, as the report templates use it
+LABELS = {'day': 'date', 'week': 'week', 'month': 'month'}
+
+# Changes applied per transaction
+REPORT_REFRESH_BATCH = int(os.environ.get('REPORT_REFRESH_BATCH', 500))
+
+TOTAL_COLUMNS = ('entries', 'normal_hours', 'overtime_hours', 'holiday_hours', 'normal_pay', 'overtime_pay',
+                 'holiday_pay', 'advances', 'food_expenses', 'amount_paid')
+
+logger = get_logger('rollups')
+
+_COLUMN_LIST = ', '.join(TOTAL_COLUMNS)
+_SUMS = ', '.join(f'COALESCE(SUM({column}), 0)' for column in TOTAL_COLUMNS)
+
+# One employee's rows in [start, end), one per entry or payment, with the
+# day they count towards
+_EMPLOYEE_DAY_SOURCE_SQL = '''
+    SELECT employee_id, {day(work_date)} AS day, 1 AS entries, normal_hours, overtime_hours, holiday_hours,
+           normal_hours * hourly_rate AS normal_pay,
+           overtime_hours * hourly_rate * ? AS overtime_pay,
+           holiday_hours * hourly_rate * ? AS holiday_pay,
+           0 AS advances, 0 AS food_expenses, 0 AS amount_paid
+    FROM {history(work_entries)} WHERE employee_id = ? AND work_date >= ? AND work_date < ?
+    UNION ALL
+    SELECT employee_id, {day(payment_date)}, 0, 0, 0, 0, 0, 0, 0, amount, 0, 0
+    FROM advance_payments WHERE employee_id = ? AND payment_date >= ? AND payment_date < ?
+    UNION ALL
+    SELECT employee_id, {day(expense_date)}, 0, 0, 0, 0, 0, 0, 0, 0, amount, 0
+    FROM food_expenses WHERE employee_id = ? AND expense_date >= ? AND expense_date < ?
+    UNION ALL
+    SELECT employee_id, {day(payment_date)}, 0, 0, 0, 0, 0, 0, 0, 0, 0, amount_paid
+    FROM payment_records WHERE employee_id = ? AND payment_date >= ? AND payment_date < ?
+'''
+
+statement('log_report_change', 'INSERT INTO report_changes (employee_id, change_date) VALUES (?, ?)')
+
+# A whole month per employee, for changes that are not tied to one day
+statement('log_employee_report_months', '''
+    INSERT INTO report_changes (employee_id, change_date)
+    SELECT employee_id, period FROM report_rollup WHERE employee_id = ? AND grain = 'month'
+''')
+
+statement('log_all_report_months', '''
+    INSERT INTO report_changes (employee_id, change_date)
+    SELECT employee_id, month FROM payroll_monthly_summary ORDER BY employee_id, month
+''')
+
+statement('pending_report_changes', 'SELECT id, employee_id, change_date FROM report_changes ORDER BY id LIMIT ?')
+
+# Month-wide changes are logged as 'YYYY-MM', which sorts before the month's days
+statement('pending_report_employees', '''
+    SELECT DISTINCT employee_id FROM report_changes WHERE change_date >= ? AND change_date < ?
+''')
+
+statement('clear_report_changes', 'DELETE FROM report_changes WHERE id <= ?')
+
+# Serialises refreshes across processes (taken first in the transaction)
+statement('lock_report_rollup', 'UPDATE report_rollup_state SET refreshed_date = CURRENT_TIMESTAMP WHERE id = 1')
+
+statement('delete_report_rollup_range', '''
+    DELETE FROM report_rollup WHERE grain = ? AND employee_id = ? AND period >= ? AND period < ?
+''')
+
+statement('delete_report_rollup_key', 'DELETE FROM report_rollup WHERE grain = ? AND period = ? AND employee_id = ?')
+
+# One employee's days in [start, end) from the raw rows
+statement('insert_employee_day_rollups', f'''
+    INSERT INTO report_rollup (grain, period, employee_id, {_COLUMN_LIST})
+    SELECT 'day', day, employee_id, {_SUMS}
+    FROM ({_EMPLOYEE_DAY_SOURCE_SQL}) source
+    GROUP BY employee_id, day
+''')
+
+# The same days, read instead of stored (for changes not rolled up yet)
+statement('employee_day_totals', f'''
+    SELECT day AS period, {', '.join(f'COALESCE(SUM({column}), 0) AS {column}' for column in TOTAL_COLUMNS)}
+    FROM ({_EMPLOYEE_DAY_SOURCE_SQL}) source
+    GROUP BY day
+''')
+
+# A week or month of one employee, summed from their day rows
+statement('insert_employee_period_rollup', f'''
+    INSERT INTO report_rollup (grain, period, employee_id, {_COLUMN_LIST})
+    SELECT ?, ?, employee_id, {_SUMS}
+    FROM report_rollup
+    WHERE grain = 'day' AND employee_id = ? AND period >= ? AND period < ?
+    GROUP BY employee_id
+''')
+
+statement('insert_total_rollup', f'''
+    INSERT INTO report_rollup (grain, period, employee_id, {_COLUMN_LIST})
+    SELECT grain, period, '{ALL}', {_SUMS}
+    FROM report_rollup
+    WHERE grain = ? AND period = ? AND employee_id <> '{ALL}'
+    GROUP BY grain, period
+''')
+
+statement('report_rollup_series', f'''
+    SELECT period, {_COLUMN_LIST} FROM report_rollup
+    WHERE grain = ? AND employee_id = ? AND period >= ? AND period <= ?
+    ORDER BY period
+''')
+
+statement('report_rollup_by_employee', f'''
+    SELECT r.employee_id, e.full_name, e.hourly_rate, r.period, {', '.join('r.' + c for c in TOTAL_COLUMNS)}
+    FROM report_rollup r
+    LEFT JOIN employees e ON e.employee_id = r.employee_id
+    WHERE r.grain = ? AND r.employee_id <> '{ALL}' AND r.period >= ? AND r.period <= ?
+    ORDER BY r.employee_id, r.period
+''')
+
+statement('report_employee', 'SELECT employee_id, full_name, hourly_rate FROM employees WHERE employee_id = ?')
+
+
+# ===== PERIODS =====
+
+def week_of(day):
+    year, week, _ = day.isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+def week_range(week):
+    """Half-open [Monday, next Monday) bounds of a 'YYYY-Www' ISO week"""
+    year, number = week.split('-W')
+    monday = date.fromisocalendar(int(year), int(number), 1)
+    return monday.isoformat(), (monday + timedelta(days=7)).isoformat()
+
+
+def period_range(grain, period):
+    if grain == 'month':
+        return month_range(period)
+    if grain == 'week':
+        return week_range(period)
+    day = date.fromisoformat(period)
+    return period, (day + timedelta(days=1)).isoformat()
+
+
+def last_periods(grain, count, today=None):
+    """The ``count`` most recent periods of ``grain`` up to and including today's, oldest first"""
+    today = today or date.today()
+    if grain == 'month':
+        index = today.year * 12 + today.month - 1
+        return [f'{i // 12:04d}-{i % 12 + 1:02d}' for i in range(index - count + 1, index + 1)]
+    step = 7 if grain == 'week' else 1
+    days = [today - timedelta(days=step * i) for i in range(count - 1, -1, -1)]
+    return [week_of(day) if grain == 'week' else day.isoformat() for day in days]
+
+
+def period_of(grain, day):
+    """The ``grain`` period a 'YYYY-MM-DD' day falls in"""
+    if grain == 'month':
+        return day[:7]
+    if grain == 'week':
+        return week_of(date.fromisoformat(day))
+    return day
+
+
+# ===== MAINTENANCE =====
+
+def log_changes(employee_id, days, conn=None):
+    """Record that ``employee_id``'s rows for ``days`` (dates, or 'YYYY-MM' for a whole month) changed"""
+    for day in sorted({str(day)[:10] for day in days if day}):
+        query('log_report_change', (employee_id, day), conn=conn)
+
+
+def forget_employee(employee_id, conn=None):
+    """Queue every month the employee appears in; their rows go on the next refresh"""
+    query('log_employee_report_months', (employee_id,), conn=conn)
+
+
+def _changed_ranges(changes):
+    """{employee_id: [(start, end)]} of the days to recompute, whole months swallowing their days"""
+    months, days = {}, {}
+    for change in changes:
+        employee_id, changed = change['employee_id'], str(change['change_date'])
+        if len(changed) == 7:
+            months.setdefault(employee_id, set()).add(changed)
+        else:
+            days.setdefault(employee_id, set()).add(changed[:10])
+    ranges = {}
+    for employee_id in months.keys() | days.keys():
+        whole = months.get(employee_id, set())
+        ranges[employee_id] = [month_range(month) for month in sorted(whole)]
+        ranges[employee_id] += [period_range('day', day) for day in sorted(days.get(employee_id, ()))
+                                if day[:7] not in whole]
+    return ranges
+
+
+def _periods_in(start, end):
+    """{(grain, period)} of every day, week and month overlapping [start, end)"""
+    periods = set()
+    day, last = date.fromisoformat(start), date.fromisoformat(end)
+    while day < last:
+        periods.update((('day', day.isoformat()), ('week', week_of(day)), ('month', day.isoformat()[:7])))
+        day += timedelta(days=1)
+    return periods
+
+
+def _apply(changes, conn):
+    rules = payroll_engine.RULES
+    totals = set()
+    for employee_id, ranges in sorted(_changed_ranges(changes).items()):
+        periods = set()
+        for start, end in ranges:
+            query('delete_report_rollup_range', ('day', employee_id, start, end), conn=conn)
+            query('insert_employee_day_rollups',
+                  (rules.overtime_multiplier, rules.holiday_multiplier) + (employee_id, start, end) * 4, conn=conn)
+            periods |= _periods_in(start, end)
+        for grain, period in sorted(periods):
+            if grain != 'day':
+                query('delete_report_rollup_key', (grain, period, employee_id), conn=conn)
+                query('insert_employee_period_rollup', (grain, period, employee_id) + period_range(grain, period),
+                      conn=conn)
+        totals |= periods
+    for grain, period in sorted(totals):
+        query('delete_report_rollup_key', (grain, period, ALL), conn=conn)
+        query('insert_total_rollup', (grain, period), conn=conn)
+
+
+def _refresh_batch(conn, batch_size):
+    """Apply up to ``batch_size`` logged changes in the open transaction; returns how many"""
+    query('lock_report_rollup', conn=conn)
+    changes = query('pending_report_changes', (batch_size,), conn=conn).fetchall()
+    if changes:
+        _apply(changes, conn)
+        query('clear_report_changes', (changes[-1]['id'],), conn=conn)
+    return len(changes)
+
+
+def refresh(conn, batch_size=REPORT_REFRESH_BATCH, max_batches=None, deadline=None):
+    """Apply logged changes to report_rollup, a committed batch at a time; returns how many.
+
+    Stops once the log is empty, after ``max_batches`` or past ``deadline``
+    (a time.monotonic() value); the rest waits for the next call.
+    """
+    applied = batches = 0
+    while max_batches is None or batches < max_batches:
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        count = _refresh_batch(conn, batch_size)
+        if not count:
+            conn.rollback()
+            break
+        conn.commit()
+        applied += count
+        batches += 1
+    if applied:
+        logger.info('report rollup refreshed', extra={'changes': applied})
+    return applied
+
+
+def rebuild(conn, progress=None):
+    """Queue every employee month and apply them all (after changing the pay multipliers)"""
+    query('log_all_report_months', conn=conn)
+    conn.commit()
+    total = 0
+    while True:
+        applied = refresh(conn, max_batches=1)
+        if not applied:
+            return total
+        total += applied
+        if progress:
+            progress(f'{total} changes applied')
+
+
+# ===== READS =====
+
+def _report_row(row, label):
+    pay = row['normal_pay'] + row['overtime_pay'] + row['holiday_pay']
+    return {
+        label: row['period'],
+        'entries_count': row['entries'],
+        'total_hours': round(row['normal_hours'] + row['overtime_hours'] + row['holiday_hours'], 2),
+        'total_normal': round(row['normal_pay'], 2),
+        'total_overtime': round(row['overtime_pay'], 2),
+        'total_holiday': round(row['holiday_pay'], 2),
+        'total_pay': round(pay, 2),
+        'total_advance': round(row['advances'], 2),
+        'total_food': round(row['food_expenses'], 2),
+        'total_paid': round(row['amount_paid'], 2),
+        'grand_total': round(pay - row['advances'] - row['food_expenses'], 2),
+    }
+
+
+def _zero_row(period):
+    return dict({column: 0 if column == 'entries' else 0.0 for column in TOTAL_COLUMNS}, period=period)
+
+
+def _add(found, row, sign=1):
+    """Add (or with ``sign`` -1, take away) ``row``'s totals to its period in ``found``"""
+    sums = found.setdefault(row['period'], _zero_row(row['period']))
+    for column in TOTAL_COLUMNS:
+        sums[column] += sign * row[column]
+
+
+def pending(grain, first, last, conn=None):
+    """{employee_id: {period: totals}} from the raw rows, for employees with changes waiting in first..last.
+
+    Employees whose rows are all gone map to an empty dict.
+    """
+    start, end = period_range(grain, first)[0], period_range(grain, last)[1]
+    rules = payroll_engine.RULES
+    live = {}
+    for change in query('pending_report_employees', (start[:7], end), conn=conn).fetchall():
+        employee_id = change['employee_id']
+        live[employee_id] = {}
+        for row in query('employee_day_totals', (rules.overtime_multiplier, rules.holiday_multiplier)
+                         + (employee_id, start, end) * 4, conn=conn):
+            row = dict(row)
+            row['period'] = period_of(grain, str(row['period'])[:10])
+            _add(live[employee_id], row)
+    return live
+
+
+def trend(grain, periods, employee_id=ALL, conn=None):
+    """Report rows (see _report_row) for ``periods`` of ``grain``, zeros where nothing was recorded"""
+    found = {row['period']: dict(row) for row in
+             query('report_rollup_series', (grain, employee_id, periods[0], periods[-1]), conn=conn)}
+    live = pending(grain, periods[0], periods[-1], conn=conn)
+    if employee_id != ALL:
+        found = live.get(employee_id, found)
+    for other, totals in live.items() if employee_id == ALL else ():
+        # Swap the stale rolled-up rows in the '*' totals for the live ones
+        for row in query('report_rollup_series', (grain, other, periods[0], periods[-1]), conn=conn):
+            _add(found, row, -1)
+        for row in totals.values():
+            _add(found, row)
+    return [_report_row(found.get(period) or _zero_row(period), LABELS[grain]) for period in periods]
+
+
+def employee_rows(grain, first, last, conn=None, batch_size=1000):
+    """Yield batches of per-employee rollup rows for ``grain`` periods first..last, by employee and period
+
+    Streamed from report_rollup while nothing in the range is waiting;
+    otherwise the rows are merged with pending() in memory.
+    """
+    live = pending(grain, first, last, conn=conn)
+    if not live:
+        yield from stream('report_rollup_by_employee', (grain, first, last), conn=conn, batch_size=batch_size)
+        return
+    rows = [row for row in map(dict, query('report_rollup_by_employee', (grain, first, last), conn=conn))
+            if row['employee_id'] not in live]
+    for employee_id, totals in live.items():
+        employee = query('report_employee', (employee_id,), conn=conn).fetchone()
+        rows += [dict(row, employee_id=employee_id, full_name=employee['full_name'] if employee else None,
+                      hourly_rate=employee['hourly_rate'] if employee else None)
+                 for row in totals.values() if first <= row['period'] <= last]
+    rows.sort(key=lambda row: (row['employee_id'], row['period']))
+    for i in range(0, len(rows), batch_size):
+        yield rows[i:i + batch_size]
+
+
+def by_employee(grain, periods, conn=None):
+    """[(employee, totals, rows)] per employee with anything in ``periods``: their rows and summed totals"""
+    employees = {}
+    for row in (row for batch in employee_rows(grain, periods[0], periods[-1], conn=conn) for row in batch):
+        row = dict(row)  # named access on a driver row is a scan of its columns
+        if row['employee_id'] not in employees:
+            employees[row['employee_id']] = (
+                {'user_id': row['employee_id'], 'full_name': row['full_name'], 'default_rate': row['hourly_rate']},
+                _zero_row(None), [])
+        employee, sums, rows = employees[row['employee_id']]
+        rows.append(_report_row(row, LABELS[grain]))
+        for column in TOTAL_COLUMNS:
+            sums[column] += row[column]
+    return [(employee, _report_row(sums, LABELS[grain]), rows) for employee, sums, rows in employees.values()]
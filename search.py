@@ -0,0 +1,425 @@
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from itertools import islice
+from operator import itemgetter
+
+import db
+import metrics
+from cache import cache
+from db import statement, query
+from logs import get_logger
+
+# Employee search for the front desk type-ahead, the employee listing and
+# login. A query matches an employee when every word of it is the start of
+# one of their search terms: the words of the name and employee ID, and the
+# phone, passport and bank account numbers both as written and with spaces
+# and dashes removed ("012-345 6789" is found by "012", "345" or "0123456").
+# Inactive employees are included unless the caller filters on status.
+#
+# employees.search_terms holds those terms, written with the row
+# (store_terms()), and the database indexes it:
+#
+#   Postgres  a pg_trgm GIN index, so "search_terms LIKE '% term%'" is an
+#             index scan
+#   SQLite    the employee_search FTS5 table, kept in step by triggers,
+#             with prefix indexes for one to three characters
+#
+# With SEARCH_INDEX=memory (the default) each process also keeps every
+# employee's terms in a sorted list and answers type-ahead queries from it
+# with a binary search, without a database round trip. The employee routes
+# update it after their commit; writes made by other processes reach it
+# when the 'employee_search' cache generation moves (a shared Redis cache)
+# or after SEARCH_INDEX_TTL. SEARCH_INDEX=database sends every query to the
+# database indexes instead. ems_employee_search_seconds compares the two.
+SEARCH_INDEX = os.environ.get('SEARCH_INDEX', 'memory')
+# Reload the in-process index this often to pick up other workers' writes
+SEARCH_INDEX_TTL = float(os.environ.get('SEARCH_INDEX_TTL', 60))
+SEARCH_DEFAULT_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+# Longer queries are cut short; nobody types more than this into a search box
+MAX_QUERY_LENGTH = 100
+MAX_QUERY_WORDS = 8
+
+SEARCH_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+# Fields searched by their words, and identifiers also searched with the separators removed
+WORD_FIELDS = ('employee_id', 'full_name')
+NUMBER_FIELDS = ('employee_id', 'phone', 'passport_number', 'bank_account_number')
+
+logger = get_logger('search')
+
+SEARCH_TIME = metrics.register(metrics.Histogram(
+    'ems_employee_search_seconds', 'Time spent answering an employee search', ('source',), SEARCH_BUCKETS))
+
+_WORD = re.compile(r'[^\W_]+')
+_SEPARATORS = re.compile(r'[\W_]+')
+# Sorts after anything a term can continue with, so (prefix + it) ends a prefix's run
+_LAST_CHARACTER = chr(0x10FFFF)
+
+SEARCH_COLUMNS = 'e.employee_id, e.full_name, e.email, e.phone, e.status'
+
+statement('employee_search_rows', f'''
+    SELECT {SEARCH_COLUMNS}, e.passport_number, e.bank_account_number FROM employees e
+''')
+
+statement('employee_search_row', f'''
+    SELECT {SEARCH_COLUMNS}, e.passport_number, e.bank_account_number FROM employees e WHERE e.employee_id = ?
+''')
+
+statement('employees_without_search_terms', f'''
+    SELECT {SEARCH_COLUMNS}, e.passport_number, e.bank_account_number FROM employees e
+    WHERE e.search_terms IS NULL
+    LIMIT ?
+''')
+
+statement('set_employee_search_terms', 'UPDATE employees SET search_terms = ? WHERE employee_id = ?')
+
+# Login IDs are matched without regard to case (idx_employees_lower_id)
+statement('employee_id_by_lower', 'SELECT employee_id FROM employees WHERE LOWER(employee_id) = ?')
+
+
+# Indexes every row of employees afresh. The triggers only keep the FTS
+# table in step with rows it already holds, so this runs when the table is
+# created over existing employees, and whenever the index is rebuilt.
+REBUILD_FTS_SQL = "INSERT INTO employee_search (employee_search) VALUES ('rebuild')"
+
+
+def migration_steps():
+    """search_terms column and its index for migrations.MIGRATIONS (filled in by ensure())"""
+    return {
+        'postgres': [
+            'ALTER TABLE employees ADD COLUMN search_terms TEXT',
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            'CREATE INDEX IF NOT EXISTS idx_employees_search_terms ON employees USING GIN (search_terms gin_trgm_ops)',
+            'CREATE INDEX IF NOT EXISTS idx_employees_lower_id ON employees (LOWER(employee_id))',
+        ],
+        'sqlite': [
+            'ALTER TABLE employees ADD COLUMN search_terms TEXT',
+            # External content: the terms live in employees, the FTS table only indexes them
+            '''
+            CREATE VIRTUAL TABLE IF NOT EXISTS employee_search USING fts5(
+                search_terms, content='employees', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 0', prefix='1 2 3'
+            )
+            ''',
+            REBUILD_FTS_SQL,
+            '''
+            CREATE TRIGGER IF NOT EXISTS employee_search_insert AFTER INSERT ON employees BEGIN
+                INSERT INTO employee_search (rowid, search_terms) VALUES (new.id, new.search_terms);
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS employee_search_delete AFTER DELETE ON employees BEGIN
+                INSERT INTO employee_search (employee_search, rowid, search_terms)
+                VALUES ('delete', old.id, old.search_terms);
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS employee_search_update AFTER UPDATE OF search_terms ON employees BEGIN
+                INSERT INTO employee_search (employee_search, rowid, search_terms)
+                VALUES ('delete', old.id, old.search_terms);
+                INSERT INTO employee_search (rowid, search_terms) VALUES (new.id, new.search_terms);
+            END
+            ''',
+            'CREATE INDEX IF NOT EXISTS idx_employees_lower_id ON employees (LOWER(employee_id))',
+        ],
+    }
+
+
+# ===== TERMS =====
+
+def words(value):
+    """Lower-cased runs of letters and digits in ``value``"""
+    return _WORD.findall(value.lower()) if value else []
+
+
+def terms(row):
+    """Sorted search terms of an employee row (a mapping with the searched columns)"""
+    found = set()
+    for field in WORD_FIELDS:
+        found.update(words(row[field]))
+    for field in NUMBER_FIELDS:
+        if row[field]:
+            found.update(words(row[field]))
+            found.add(_SEPARATORS.sub('', row[field].lower()))
+    found.discard('')
+    return sorted(found)
+
+
+def _stored(row):
+    # The leading space puts one before every term, so "LIKE '% term%'" is a term prefix
+    return ' ' + ' '.join(terms(row))
+
+
+def store_terms(employee_id, conn=None):
+    """Recompute the employee's search_terms; call in the transaction that wrote the row"""
+    row = query('employee_search_row', (employee_id,), conn=conn).fetchone()
+    if row is not None:
+        query('set_employee_search_terms', (_stored(row), employee_id), conn=conn)
+
+
+def ensure(conn, batch_size=500, rebuild=False):
+    """Fill in search_terms where it is missing (everywhere with ``rebuild``); returns the rows written"""
+    if rebuild:
+        rows = query('employee_search_rows', conn=conn).fetchall()
+        for row in rows:
+            query('set_employee_search_terms', (_stored(row), row['employee_id']), conn=conn)
+        if db.backend() == 'sqlite':
+            db.execute(REBUILD_FTS_SQL, conn=conn)
+        conn.commit()
+        return len(rows)
+    written = 0
+    while True:
+        rows = query('employees_without_search_terms', (batch_size,), conn=conn).fetchall()
+        for row in rows:
+            query('set_employee_search_terms', (_stored(row), row['employee_id']), conn=conn)
+        conn.commit()
+        written += len(rows)
+        if len(rows) < batch_size:
+            break
+    if written:
+        logger.info('employee search terms written', extra={'rows': written})
+    return written
+
+
+# ===== DATABASE SEARCH =====
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def match(alias, query_words):
+    """(SQL condition, params) matching ``alias``'s employees on every word of ``query_words``"""
+    if not query_words:
+        return '1 = 0', ()
+    if db.backend() == 'postgres':
+        conditions = ' AND '.join(f"{alias}.search_terms LIKE ? ESCAPE '\\'" for _ in query_words)
+        return conditions, tuple(f'% {_escape_like(word)}%' for word in query_words)
+    # Words are letters and digits only, so quoting them is all FTS5 needs
+    fts_query = ' '.join(f'"{word}"*' for word in query_words)
+    return f'{alias}.id IN (SELECT rowid FROM employee_search WHERE employee_search MATCH ?)', (fts_query,)
+
+
+def listing_filter(alias):
+    """pagination.Listing filter on the search index (the condition depends on the words typed)"""
+    def condition(value):
+        return match(alias, _query_words(value))
+    return condition, None
+
+
+def _search_database(text, query_words, limit, status, conn):
+    condition, params = match('e', query_words)
+    if status:
+        condition += ' AND e.status = ?'
+        params += (status,)
+    lowered = text.strip().lower()
+    sql = f'''
+        SELECT {SEARCH_COLUMNS} FROM employees e
+        WHERE {condition}
+        ORDER BY CASE WHEN LOWER(e.employee_id) = ? THEN 0
+                      WHEN LOWER(e.employee_id) LIKE ? ESCAPE '\\' THEN 1 ELSE 2 END,
+                 LOWER(e.full_name), e.employee_id
+        LIMIT {int(limit)}
+    '''
+    rows = db.execute(sql, params + (lowered, _escape_like(lowered) + '%'), conn=conn,
+                      name='employee_search').fetchall()
+    return [{column: row[column] for column in ('employee_id', 'full_name', 'email', 'phone', 'status')}
+            for row in rows]
+
+
+# ===== IN-PROCESS INDEX =====
+
+class PrefixIndex:
+    """Every employee's search terms in one sorted list; a word's matches are a contiguous slice of it.
+
+    Matches of one- and two-letter words, which can be most of the staff,
+    are kept between queries until the next change. Results are picked by
+    walking the employees in name order, which stops as soon as enough
+    candidates are found.
+    """
+
+    SHORT_WORD = 2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._terms = []  # sorted (term, employee_id)
+        self._ids = []  # sorted (lower-cased employee_id, employee_id), for ranking ID matches first
+        self._names = []  # sorted (lower-cased full_name, employee_id)
+        self._name_order = []  # the employee_ids of _names, in the same order
+        self._employees = {}  # employee_id -> (result dict, terms)
+        self._short = {}  # word of up to SHORT_WORD letters -> matching employee_ids
+        self.loaded_at = None
+        self.generation = None
+
+    def load(self, rows, generation):
+        employees = {row['employee_id']: self._entry(row) for row in rows}
+        names = sorted(self._name_key(result) for result, _ in employees.values())
+        with self._lock:
+            self._employees = employees
+            self._terms = sorted((term, employee_id) for employee_id, (_, row_terms) in employees.items()
+                                 for term in row_terms)
+            self._ids = sorted((employee_id.lower(), employee_id) for employee_id in employees)
+            self._names = names
+            self._name_order = [employee_id for _, employee_id in names]
+            self._short = {}
+            self.loaded_at = time.monotonic()
+            self.generation = generation
+
+    @staticmethod
+    def _entry(row):
+        result = {column: row[column] for column in ('employee_id', 'full_name', 'email', 'phone', 'status')}
+        return result, tuple(terms(row))
+
+    @staticmethod
+    def _name_key(result):
+        return result['full_name'].lower(), result['employee_id']
+
+    def put(self, row):
+        employee_id = row['employee_id']
+        entry = self._entry(row)
+        with self._lock:
+            self._remove(employee_id)
+            self._employees[employee_id] = entry
+            insort(self._ids, (employee_id.lower(), employee_id))
+            for term in entry[1]:
+                insort(self._terms, (term, employee_id))
+            key = self._name_key(entry[0])
+            index = bisect_left(self._names, key)
+            self._names.insert(index, key)
+            self._name_order.insert(index, employee_id)
+            self._short = {}
+
+    def remove(self, employee_id):
+        with self._lock:
+            self._remove(employee_id)
+            self._short = {}
+
+    def _remove(self, employee_id):
+        entry = self._employees.pop(employee_id, None)
+        if entry is None:
+            return
+        self._delete(self._ids, (employee_id.lower(), employee_id))
+        for term in entry[1]:
+            self._delete(self._terms, (term, employee_id))
+        index = self._delete(self._names, self._name_key(entry[0]))
+        if index is not None:
+            del self._name_order[index]
+
+    @staticmethod
+    def _delete(pairs, pair):
+        index = bisect_left(pairs, pair)
+        if index < len(pairs) and pairs[index] == pair:
+            del pairs[index]
+            return index
+        return None
+
+    @staticmethod
+    def _prefixed(pairs, prefix):
+        """Employee IDs of the slice of ``pairs`` whose first item starts with ``prefix``"""
+        start = bisect_left(pairs, (prefix,))
+        end = bisect_left(pairs, (prefix + _LAST_CHARACTER,), start)
+        return set(map(itemgetter(1), pairs[start:end]))
+
+    def _matching(self, word):
+        if len(word) > self.SHORT_WORD:
+            return self._prefixed(self._terms, word)
+        found = self._short.get(word)
+        if found is None:
+            found = self._short[word] = frozenset(self._prefixed(self._terms, word))
+        return found
+
+    def _by_name(self, employee_ids, limit):
+        return list(islice(filter(employee_ids.__contains__, self._name_order), limit))
+
+    def search(self, text, query_words, limit, status=None):
+        lowered = text.strip().lower()
+        with self._lock:
+            candidates = None
+            # The longest word usually has the fewest matches; start there
+            for word in sorted(set(query_words), key=len, reverse=True):
+                found = self._matching(word)
+                candidates = set(found) if candidates is None else candidates & found
+                if not candidates:
+                    return []
+            if status:
+                candidates = {employee_id for employee_id in candidates
+                              if self._employees[employee_id][0]['status'] == status}
+            # Exact ID, then IDs starting with the query, then everyone else by name
+            leading = self._prefixed(self._ids, lowered) & candidates if lowered else set()
+            exact = [employee_id for employee_id in leading if employee_id.lower() == lowered]
+            ranked = exact + self._by_name(leading.difference(exact), limit)
+            if len(ranked) < limit:
+                ranked += self._by_name(candidates - leading, limit - len(ranked))
+            return [dict(self._employees[employee_id][0]) for employee_id in ranked[:limit]]
+
+    def __len__(self):
+        return len(self._employees)
+
+
+index = PrefixIndex()
+
+
+def _memory_index(conn=None):
+    """The in-process index, (re)loaded when missing or stale; None with SEARCH_INDEX=database"""
+    if SEARCH_INDEX != 'memory':
+        return None
+    generation = cache.generation('employee_search')
+    if (index.loaded_at is None or generation != index.generation
+            or time.monotonic() - index.loaded_at > SEARCH_INDEX_TTL):
+        started = time.perf_counter()
+        index.load(query('employee_search_rows', conn=conn).fetchall(), generation)
+        logger.info('employee search index loaded',
+                    extra={'employees': len(index), 'ms': round((time.perf_counter() - started) * 1000, 1)})
+    return index
+
+
+def employee_changed(employee_id, conn=None):
+    """Bring the in-process index up to date after a committed add, edit or delete"""
+    if SEARCH_INDEX != 'memory' or index.loaded_at is None:
+        return
+    row = query('employee_search_row', (employee_id,), conn=conn).fetchone()
+    if row is None:
+        index.remove(employee_id)
+    else:
+        index.put(row)
+    # Other workers reload on the new generation (when the cache is shared); this one is already current
+    cache.invalidate('employee_search')
+    index.generation = cache.generation('employee_search')
+
+
+# ===== QUERIES =====
+
+def _query_words(text):
+    return words((text or '')[:MAX_QUERY_LENGTH])[:MAX_QUERY_WORDS]
+
+
+def search(text, limit=SEARCH_DEFAULT_LIMIT, status=None, conn=None):
+    """Employees matching ``text`` (see the top of this module), exact and leading ID matches first, then by name"""
+    started = time.perf_counter()
+    query_words = _query_words(text)
+    if not query_words:
+        return []
+    limit = min(max(int(limit), 1), SEARCH_MAX_LIMIT)
+    memory = _memory_index(conn)
+    if memory is not None:
+        results = memory.search(text, query_words, limit, status)
+    else:
+        results = _search_database(text, query_words, limit, status, conn)
+    SEARCH_TIME.observe(time.perf_counter() - started, 'memory' if memory is not None else 'database')
+    return results
+
+
+def resolve_employee_id(username, conn=None):
+    """The stored employee_id for a login ID typed in any case (None when there is none).
+
+    Always asks the database: an employee added a moment ago by another
+    worker must be able to log in straight away.
+    """
+    username = (username or '').strip()
+    if not username:
+        return None
+    row = query('employee_id_by_lower', (username.lower(),), conn=conn).fetchone()
+    return row['employee_id'] if row else None
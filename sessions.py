@@ -0,0 +1,246 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+import metrics
+from db import statement, query, get_db, write
+from logs import get_logger
+
+# Login sessions. The cookie used to carry the whole session, signed but
+# readable by anyone holding it, and it grew with everything stored there.
+# With a server-side store the cookie only holds a random session id and
+# the data lives in:
+#
+#   SESSION_STORE=db      the sessions table (default; shared by every
+#                         gunicorn worker and survives restarts)
+#   SESSION_STORE=memory  an LRU in this process; only for a single worker,
+#                         since other workers cannot see its sessions
+#   SESSION_STORE=cookie  Flask's signed cookie, as before
+#
+# Flask opens the session once per request and keeps it on the request
+# context, so a request reads the store at most once however often the
+# session is consulted, and writes it back only when something changed.
+# ems_session_cookie_bytes and ems_session_load_seconds compare the stores.
+SESSION_STORE = os.environ.get('SESSION_STORE', 'db')
+# Idle sessions expire after this long; every request within it extends it
+SESSION_TTL = float(os.environ.get('SESSION_TTL', 12 * 3600))
+SESSION_MAX_ENTRIES = int(os.environ.get('SESSION_MAX_ENTRIES', 10000))
+# Expired rows are deleted by whichever process notices first, this often
+SESSION_PRUNE_INTERVAL = float(os.environ.get('SESSION_PRUNE_INTERVAL', 3600))
+
+COOKIE_BYTE_BUCKETS = (32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+logger = get_logger('sessions')
+
+COOKIE_BYTES = metrics.register(metrics.Histogram(
+    'ems_session_cookie_bytes', 'Size of the session cookie sent by the browser', ('store',), COOKIE_BYTE_BUCKETS))
+LOAD_TIME = metrics.register(metrics.Histogram(
+    'ems_session_load_seconds', 'Time spent loading the session of a request', ('store',)))
+
+statement('session_by_id', 'SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?')
+
+statement('save_session', '''
+    INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+''')
+
+statement('touch_session', 'UPDATE sessions SET expires_at = ? WHERE id = ?')
+
+statement('delete_session', 'DELETE FROM sessions WHERE id = ?')
+
+statement('delete_expired_sessions', 'DELETE FROM sessions WHERE expires_at <= ?')
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data kept on the server under ``sid``"""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = sid is None
+        self.expires_at = expires_at
+        self.modified = False
+        self.regenerate = False
+
+
+def regenerate(session):
+    """Move the session to a fresh id on the next save (call on login)"""
+    if isinstance(session, ServerSession):
+        session.regenerate = True
+        session.modified = True
+
+
+class DatabaseStore:
+    name = 'db'
+
+    def __init__(self):
+        self._pruned_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        row = query('session_by_id', (sid, time.time()), conn=get_db()).fetchone()
+        return (row['data'], row['expires_at']) if row else None
+
+    def save(self, sid, data, expires_at):
+        self._write(lambda conn: query('save_session', (sid, data, expires_at), conn=conn))
+        self._prune()
+
+    def touch(self, sid, expires_at):
+        self._write(lambda conn: query('touch_session', (expires_at, sid), conn=conn))
+
+    def delete(self, sid):
+        self._write(lambda conn: query('delete_session', (sid,), conn=conn))
+
+    @staticmethod
+    def _write(fn):
+        """db.write() with anything the view left uncommitted rolled back first.
+
+        Sessions are saved after the view returns. Views commit their own
+        writes, so an open transaction here belongs to one that failed
+        halfway (and still answered with a flash and a redirect). It must
+        not be committed along with the session, and on SQLite the writer
+        would wait behind its lock.
+        """
+        get_db().rollback()
+        return write(fn)
+
+    def _prune(self):
+        with self._lock:
+            if time.monotonic() - self._pruned_at < SESSION_PRUNE_INTERVAL:
+                return
+            self._pruned_at = time.monotonic()
+        deleted = self._write(lambda conn: query('delete_expired_sessions', (time.time(),), conn=conn).rowcount)
+        if deleted:
+            logger.info('deleted expired sessions', extra={'count': deleted})
+
+
+class MemoryStore:
+    """Thread-safe in-process LRU; the least recently used session goes first when full"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # sid -> (data, expires_at)
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return entry
+
+    def save(self, sid, data, expires_at):
+        with self._lock:
+            self._entries[sid] = (data, expires_at)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, sid, expires_at):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None:
+                self._entries[sid] = (entry[0], expires_at)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keeps the session in ``store``; the cookie holds only its id"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, ttl=SESSION_TTL):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        started = time.perf_counter()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        session = None
+        if sid:
+            COOKIE_BYTES.observe(len(sid), self.store.name)
+            entry = self.store.load(sid)
+            if entry is not None:
+                session = ServerSession(self.serializer.loads(entry[0]), sid, entry[1])
+        LOAD_TIME.observe(time.perf_counter() - started, self.store.name)
+        return session if session is not None else ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        # A failed request may have left its own transaction half done;
+        # do not commit it along with the session
+        if response.status_code >= 500:
+            return
+
+        if not session:
+            if session.sid is not None and session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        response.vary.add('Cookie')
+        expires_at = time.time() + self.ttl
+        if session.modified or session.new:
+            if session.regenerate and session.sid is not None:
+                self.store.delete(session.sid)
+                session.sid = None
+            if session.sid is None:
+                session.sid = secrets.token_urlsafe(32)
+            self.store.save(session.sid, self.serializer.dumps(dict(session)), expires_at)
+        elif session.expires_at - time.time() < self.ttl / 2:
+            # Extend an idle timeout without rewriting the data every request
+            self.store.touch(session.sid, expires_at)
+            return
+        else:
+            return
+
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+class CookieSessionInterface(SecureCookieSessionInterface):
+    """Flask's signed cookie session, measured the same way as the server-side stores"""
+
+    def open_session(self, app, request):
+        started = time.perf_counter()
+        value = request.cookies.get(self.get_cookie_name(app))
+        if value:
+            COOKIE_BYTES.observe(len(value), 'cookie')
+        session = super().open_session(app, request)
+        LOAD_TIME.observe(time.perf_counter() - started, 'cookie')
+        return session
+
+
+def init_app(app):
+    if SESSION_STORE == 'cookie':
+        app.session_interface = CookieSessionInterface()
+    elif SESSION_STORE == 'memory':
+        app.session_interface = ServerSessionInterface(MemoryStore())
+    else:
+        if SESSION_STORE != 'db':
+            logger.error('unknown SESSION_STORE, using the database', extra={'store': SESSION_STORE})
+        app.session_interface = ServerSessionInterface(DatabaseStore())
+    logger.info('session store', extra={'store': SESSION_STORE})
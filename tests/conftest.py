@@ -0,0 +1,47 @@
+import os
+import tempfile
+import uuid
+
+import pytest
+
+# app.py creates the schema when it is imported, so the database is chosen
+# first: a throwaway SQLite file shared by the whole run. Every test makes
+# its own employees and only looks at those.
+DATA_DIR = tempfile.mkdtemp(prefix='ems-test-')
+os.environ.pop('DATABASE_URL', None)
+os.environ['SQLITE_PATH'] = os.path.join(DATA_DIR, 'test.db')
+
+import app as ems  # noqa: E402
+import db  # noqa: E402
+
+
+@pytest.fixture
+def conn():
+    with ems.app.app_context():
+        yield db.get_db()
+
+
+@pytest.fixture
+def make_employee(conn):
+    """make_employee(hourly_rate) -> the employee_id of a new active employee"""
+    def make(hourly_rate=10.0):
+        employee_id = f'T{uuid.uuid4().hex[:8].upper()}'
+        db.execute('''
+            INSERT INTO employees (employee_id, full_name, email, phone, hourly_rate, status)
+            VALUES (?, ?, ?, ?, ?, 'Active')
+        ''', (employee_id, f'Test {employee_id}', f'{employee_id.lower()}@example.com', '0100000000', hourly_rate),
+                   conn=conn)
+        conn.commit()
+        return employee_id
+    return make
+
+
+@pytest.fixture
+def admin():
+    """A test client logged in as the admin"""
+    client = ems.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+        session['username'] = 'admin'
+        session['user_type'] = 'admin'
+    return client
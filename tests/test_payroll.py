@@ -0,0 +1,123 @@
+import random
+
+import db
+import exports
+import payroll
+import payroll_engine
+
+MONTH = '2024-03'
+
+
+def add_rows(conn, employee_id, rng):
+    """Several work entries, advances, food expenses and payments around MONTH; returns what was added"""
+    rows = {'work': [], 'advances': [], 'food': [], 'payments': []}
+    for day in ('2024-02-28', '2024-03-01', '2024-03-04', '2024-03-05', '2024-03-29', '2024-04-01'):
+        hours = (rng.choice((6.0, 8.0)), rng.choice((0.0, 1.5, 2.0)), rng.choice((0.0, 0.0, 4.0)))
+        db.execute('''
+            INSERT INTO work_entries (employee_id, work_date, start_time, end_time, break_minutes,
+                                      normal_hours, overtime_hours, holiday_hours)
+            VALUES (?, ?, '08:00', '18:00', 60, ?, ?, ?)
+        ''', (employee_id, day) + hours, conn=conn)
+        rows['work'].append((day,) + hours)
+    for day in ('2024-03-02', '2024-03-20', '2024-04-02'):
+        amount = float(rng.randrange(10, 100))
+        db.execute('INSERT INTO advance_payments (employee_id, amount, payment_date, reason) VALUES (?, ?, ?, ?)',
+                   (employee_id, amount, day, 'test'), conn=conn)
+        rows['advances'].append((day, amount))
+        db.execute('INSERT INTO food_expenses (employee_id, amount, expense_date, description) VALUES (?, ?, ?, ?)',
+                   (employee_id, amount / 2, day, 'test'), conn=conn)
+        rows['food'].append((day, amount / 2))
+    for day in ('2024-02-29', '2024-03-31'):
+        db.execute('''
+            INSERT INTO payment_records (employee_id, payment_date, amount_paid, payment_type, description)
+            VALUES (?, ?, ?, 'salary', 'test')
+        ''', (employee_id, day, 100.0), conn=conn)
+        rows['payments'].append((day, 100.0))
+    # As every payroll write does, in the transaction that wrote the rows
+    payroll.refresh_summary(employee_id, '2024-02', '2024-03', '2024-04', conn=conn)
+    conn.commit()
+    return rows
+
+
+def in_month(day):
+    return day.startswith(MONTH)
+
+
+def test_totals_match_row_by_row(conn, make_employee):
+    rng = random.Random(4)
+    rates = {make_employee(hourly_rate=rate): rate for rate in (9.0, 12.5, 15.0)}
+    added = {employee_id: add_rows(conn, employee_id, rng) for employee_id in rates}
+
+    month = {row['employee_id']: row for row in payroll.month_totals(MONTH, conn=conn)}
+    lifetime = {row['employee_id']: row for row in payroll.lifetime_totals(conn=conn)}
+    for employee_id, rows in added.items():
+        # Each child table summed on its own, one row at a time
+        expected = [sum(entry[column] for entry in rows['work'] if in_month(entry[0])) for column in (1, 2, 3)]
+        expected += [sum(amount for day, amount in rows[kind] if in_month(day)) for kind in ('advances', 'food')]
+        got = month[employee_id]
+        assert [got['total_normal_hours'], got['total_overtime_hours'], got['total_holiday_hours'],
+                got['total_advances'], got['total_food_expenses']] == expected
+
+        single = payroll.employee_month_totals(employee_id, MONTH, conn=conn)
+        assert single['total_normal_hours'] == expected[0]
+        assert single['total_advances'] == expected[3]
+
+        earnings = sum((normal + overtime + holiday) * rates[employee_id] for _, normal, overtime, holiday in rows['work'])
+        paid = sum(amount for _, amount in rows['payments'])
+        assert abs(lifetime[employee_id]['total_earnings'] - earnings) < 1e-6
+        assert lifetime[employee_id]['total_paid'] == paid
+        single = payroll.employee_lifetime_totals(employee_id, conn=conn)
+        assert abs(single['total_earnings'] - earnings) < 1e-6
+        assert single['total_paid'] == paid
+
+
+def test_employee_without_rows_has_zero_totals(conn, make_employee):
+    employee_id = make_employee()
+    row = payroll.employee_month_totals(employee_id, MONTH, conn=conn)
+    assert (row['total_normal_hours'], row['total_advances'], row['total_food_expenses']) == (0, 0, 0)
+    assert payroll.employee_lifetime_totals(employee_id, conn=conn)['total_earnings'] == 0
+
+
+def test_summary_follows_deletes(conn, make_employee):
+    employee_id = make_employee()
+    add_rows(conn, employee_id, random.Random(5))
+    entry = db.execute('SELECT id, work_date FROM work_entries WHERE employee_id = ? ORDER BY id LIMIT 1',
+                       (employee_id,), conn=conn).fetchone()
+    db.execute('DELETE FROM work_entries WHERE id = ?', (entry['id'],), conn=conn)
+    payroll.refresh_summary(employee_id, entry['work_date'], conn=conn)
+    conn.commit()
+    drift = payroll.rebuild_summary(conn, check_only=True)
+    assert [key for key in drift if key[0] == employee_id] == []
+
+
+def test_month_pay_keeps_the_rate_each_entry_was_paid_at(conn, make_employee):
+    employee_id = make_employee(hourly_rate=10.0)
+
+    def work(day, normal, overtime):
+        db.execute('''
+            INSERT INTO work_entries (employee_id, work_date, start_time, end_time, break_minutes,
+                                      normal_hours, overtime_hours, holiday_hours)
+            VALUES (?, ?, '08:00', '18:00', 60, ?, ?, 0)
+        ''', (employee_id, day, normal, overtime), conn=conn)
+        payroll.refresh_summary(employee_id, day, conn=conn)
+        conn.commit()
+
+    work('2026-09-01', 8.0, 2.0)
+    db.execute('UPDATE employees SET hourly_rate = 20 WHERE employee_id = ?', (employee_id,), conn=conn)
+    conn.commit()
+    work('2026-09-02', 8.0, 0.0)
+
+    multiplier = payroll_engine.RULES.overtime_multiplier
+    expected = 8 * 10 + 2 * 10 * multiplier + 8 * 20
+    row = payroll.employee_month_totals(employee_id, '2026-09', conn=conn)
+    assert abs(payroll_engine.month_pay(row)['total_pay'] - expected) < 1e-6
+    rows = [row for row in payroll_engine.with_pay(payroll.month_totals('2026-09', conn=conn))
+            if row['employee_id'] == employee_id]
+    assert abs(rows[0]['total_pay'] - expected) < 1e-6
+
+    exported = [row for batch in exports.payroll_rows('2026-09-01', '2026-10-01', conn=conn) for row in batch
+                if row[0] == employee_id]
+    assert [row[9] for row in exported] == [10.0, 20.0]
+    assert abs(sum(row[13] for row in exported) - expected) < 0.01
+    # The ledger prices hours without the multipliers
+    assert abs(payroll.employee_lifetime_totals(employee_id, conn=conn)['total_earnings'] - (10 * 10 + 8 * 20)) < 1e-6
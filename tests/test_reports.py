@@ -0,0 +1,38 @@
+import csv
+from datetime import date
+from io import StringIO
+
+import rollups
+
+
+def mine(employee_id, conn):
+    """The employee's rows in this month's by_employee report"""
+    month = date.today().isoformat()[:7]
+    return [rows for employee, _, rows in rollups.by_employee('month', [month], conn=conn)
+            if employee['user_id'] == employee_id]
+
+
+def test_reports_show_changes_the_worker_has_not_rolled_up(conn, make_employee, admin):
+    employee_id = make_employee(hourly_rate=10.0)
+    response = admin.post('/admin/work_entries/add', data={
+        'employee_id': employee_id, 'work_date': date.today().isoformat(),
+        'start_time': '08:00', 'end_time': '17:00', 'break_minutes': '60'})
+    assert response.status_code == 302
+    conn.rollback()
+
+    # No job worker runs here, so report_rollup has not seen the entry yet
+    page = admin.get('/admin/reports/monthly')
+    assert page.status_code == 200
+    assert f'Test {employee_id}' in page.get_data(as_text=True)
+    export = admin.get('/admin/reports/export?grain=month&periods=1')
+    rows = [row for row in csv.reader(StringIO(export.get_data(as_text=True))) if row[1] == employee_id]
+    assert [(row[3], float(row[10])) for row in rows] == [('1', 80.0)]
+    assert [row['total_pay'] for row in mine(employee_id, conn)[0]] == [80.0]
+
+    month = date.today().isoformat()[:7]
+    before = rollups.trend('month', [month], conn=conn)[0]
+    rollups.refresh(conn)
+    after = rollups.trend('month', [month], conn=conn)[0]
+    assert abs(before['total_pay'] - after['total_pay']) < 0.01
+    assert before['entries_count'] == after['entries_count']
+    assert [row['total_pay'] for row in mine(employee_id, conn)[0]] == [80.0]
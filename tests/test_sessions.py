@@ -0,0 +1,42 @@
+import app as ems
+import db
+import payroll
+
+
+def add_payment(conn, employee_id):
+    cursor = db.execute('''
+        INSERT INTO payment_records (employee_id, payment_date, amount_paid, payment_type, description)
+        VALUES (?, '2024-05-31', 100, 'salary', 'test')
+    ''', (employee_id,), conn=conn)
+    payroll.refresh_summary(employee_id, '2024-05-31', conn=conn)
+    conn.commit()
+    return db.inserted_id(cursor)
+
+
+def test_failed_edit_keeps_the_session_and_the_data(conn, make_employee, admin):
+    employee_id = make_employee()
+    payment_id = add_payment(conn, employee_id)
+
+    response = admin.post(f'/admin/payments/edit/{payment_id}', data={
+        'payment_date': 'garbage', 'amount_paid': '999', 'payment_type': 'salary', 'status': 'Completed'})
+    assert response.status_code == 302
+    with admin.session_transaction() as session:
+        assert session['logged_in']
+        assert any(category == 'error' for category, _ in session['_flashes'])
+
+    conn.rollback()
+    row = db.execute('SELECT payment_date, amount_paid FROM payment_records WHERE id = ?', (payment_id,),
+                     conn=conn).fetchone()
+    assert (str(row['payment_date']), row['amount_paid']) == ('2024-05-31', 100)
+
+
+def test_saving_a_session_does_not_commit_the_request(make_employee):
+    employee_id = make_employee()
+    store = ems.app.session_interface.store
+    with ems.app.test_request_context():
+        conn = db.get_db()
+        db.execute("UPDATE employees SET full_name = 'half done' WHERE employee_id = ?", (employee_id,), conn=conn)
+        store.save('test-session', '{}', 2 ** 31)
+        row = db.execute('SELECT full_name FROM employees WHERE employee_id = ?', (employee_id,), conn=conn).fetchone()
+        assert row['full_name'] != 'half done'
+        store.delete('test-session')
@@ -0,0 +1,25 @@
+"""Background job worker, run next to the web process:
+
+    python worker.py --threads 2
+
+Shares DATABASE_URL (or SQLITE_PATH), JOB_RESULTS_DIR and PHOTO_STORAGE_DIR with
+the web app.
+"""
+import argparse
+
+import app  # noqa: F401  (schema, migrations and statements)
+import ingest
+import jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=2, help='jobs run at the same time')
+    args = parser.parse_args(argv)
+    # Also finish photo uploads that a web worker accepted but did not process
+    ingest.pool.start()
+    jobs.Worker(threads=args.threads).run()
+
+
+if __name__ == '__main__':
+    main()